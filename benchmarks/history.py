@@ -0,0 +1,94 @@
+"""
+Measure the size of, and the time taken to record into and read from, a
+:mod:`picky.history` holding years of nightly snapshots of a synthetic
+environment in which a few packages change each night.
+
+Run with ``python -m benchmarks.history``.
+"""
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from timeit import default_timer
+
+from picky.env import Environment, PackageSpec
+from picky.history import History
+from .synthetic import synthetic_export
+
+DAY = 24 * 60 * 60
+
+
+def nightly(env, nights, changes, seed=0):
+    """
+    Yield the environment as it is on each of the supplied number of
+    nights, with the supplied number of conda packages upgraded each night.
+    """
+    rng = random.Random(seed)
+    names = list(env['conda'])
+    for night in range(nights):
+        env = env.copy()
+        for name in rng.sample(names, changes):
+            spec = env['conda'][name]
+            env['conda'][name] = PackageSpec(spec.sep, name, '{}.{}'.format(spec.version, night),
+                                             spec.build)
+        yield env
+
+
+def timed(operation, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = default_timer()
+        operation()
+        elapsed = default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--packages', type=int, default=1000)
+    parser.add_argument('--nights', type=int, default=3 * 365)
+    parser.add_argument('--changes', type=int, default=5,
+                        help='Number of packages upgraded each night.')
+    args = parser.parse_args()
+
+    env = Environment.from_string(synthetic_export(conda=args.packages))
+    full_size = len(env.to_string().encode('utf-8'))
+    directory = tempfile.mkdtemp()
+    try:
+        recorded = History(os.path.join(directory, 'environment.lock.yaml.history'))
+        start = default_timer()
+        for night, snapshot in enumerate(nightly(env, args.nights, args.changes)):
+            recorded.record(snapshot, float(night * DAY))
+        record_time = (default_timer() - start) * 1000 / args.nights
+        size = sum(os.path.getsize(path) for path in (
+            recorded.path, recorded.index_path, recorded.packages_path
+        ))
+        name = next(iter(env['conda']))
+        print('{} nights of {} packages, {} changing each night'.format(
+            args.nights, args.packages, args.changes
+        ))
+        print('{:<32} {:>12.1f}'.format('history size (MB)', size / 1e6))
+        print('{:<32} {:>12.1f}'.format('full copies size (MB)',
+                                        full_size * args.nights / 1e6))
+        print('{:<32} {:>12.2f}'.format('record, per night (ms)', record_time))
+        for snapshot in 0, args.nights // 2, args.nights - 1:
+            print('{:<32} {:>12.2f}'.format(
+                'state of snapshot {} (ms)'.format(snapshot),
+                timed(lambda: recorded.state(snapshot))
+            ))
+        print('{:<32} {:>12.2f}'.format(
+            'snapshot at a time (ms)', timed(lambda: recorded.at(args.nights * DAY / 2))
+        ))
+        print('{:<32} {:>12.2f}'.format(
+            'log for one package (ms)', timed(lambda: recorded.log(name))
+        ))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Measure the memory retained by, and the time taken to parse and sort,
+several synthetic 10,000 package environments, comparing
+:class:`picky.env.PackageSpec` with the plain class it replaced.
+
+Run with ``python -m benchmarks.spec_memory``.
+"""
+from __future__ import print_function
+
+import tracemalloc
+from argparse import ArgumentParser
+from timeit import default_timer
+
+from picky import env
+from .synthetic import synthetic_export
+
+
+class DictSpec(object):
+    """
+    The original :class:`~picky.env.PackageSpec`, with a per-instance
+    ``__dict__`` and a sort key built on every comparison.
+    """
+
+    def __init__(self, sep, name, version=None, build=None):
+        self.sep = sep
+        self.name = name
+        self.version = version
+        self.build = build
+
+    def __lt__(self, other):
+        return (self.name, self.version) < (other.name, other.version)
+
+
+def measure(exports):
+    start = default_timer()
+    envs = [env.Environment.from_string(export) for export in exports]
+    parse_time = default_timer() - start
+    del envs
+    tracemalloc.start()
+    try:
+        envs = [env.Environment.from_string(export) for export in exports]
+        memory = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    start = default_timer()
+    for parsed in envs:
+        sorted(parsed['conda'].values())
+    sort_time = default_timer() - start
+    return memory, parse_time, sort_time
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--packages', type=int, default=10000)
+    parser.add_argument('--environments', type=int, default=10,
+                        help='Number of environments to hold in memory at once.')
+    args = parser.parse_args()
+
+    print('{} environments of {} packages'.format(args.environments, args.packages))
+    print('{:<12} {:>12} {:>12} {:>12}'.format('', 'memory (MB)', 'parse (ms)', 'sort (ms)'))
+    original = env.PackageSpec
+    for name, cls in (('dict', DictSpec), ('tuple', original)):
+        exports = [synthetic_export(conda=args.packages)
+                   for _ in range(args.environments)]
+        env.PackageSpec = cls
+        try:
+            memory, parse_time, sort_time = measure(exports)
+        finally:
+            env.PackageSpec = original
+        print('{:<12} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+            name, memory / 1e6, parse_time * 1000, sort_time * 1000
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Time parsing, modifying, matching rules against, serializing, copying and
+diffing synthetic environments at a range of scales, reporting throughput
+and peak memory for each, and optionally comparing the results against a stored baseline.
+
+Run with ``python -m benchmarks.suite``. Use ``--save baseline.json`` to
+record a baseline and ``--compare baseline.json`` to check a later run
+against it; the exit code is 1 if anything got slower by more than the
+threshold.
+"""
+from __future__ import print_function
+
+import json
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from collections import OrderedDict
+from timeit import default_timer
+
+from picky.env import Environment, diff_text, modify
+from picky.rules import Rules
+from .synthetic import synthetic_export
+
+# name: keyword arguments for synthetic_export
+SCALES = OrderedDict((
+    ('100', dict(conda=80, pip=20)),
+    ('1k', dict(conda=800, pip=200)),
+    ('10k', dict(conda=8000, pip=2000)),
+    ('50k', dict(conda=40000, pip=10000)),
+    ('develop', dict(conda=500, pip=500, develop=2000)),
+    ('channels', dict(conda=1000, pip=100, channels=200)),
+))
+
+OPERATIONS = 'from_string', 'modify', 'rules', 'to_string', 'copy', 'diff'
+
+
+def package_count(scale):
+    return sum(scale.get(key, 0) for key in ('conda', 'pip', 'develop'))
+
+
+def prepare(scale):
+    """
+    Return a mapping of operation name to a callable performing it
+    once on environments built from the supplied scale.
+    """
+    export = synthetic_export(**scale)
+    env = Environment.from_string(export)
+    # the same packages with different versions and builds:
+    other = Environment.from_string(synthetic_export(seed=1, **scale))
+    pip = list(env['pip'])
+    ignore = set(list(env['conda'])[::10] + pip[::10])
+    develop = dict((name, '/src/' + name) for name in pip[5::10])
+    # a large rule set of every kind, compiled as part of each run:
+    rules = sorted(ignore) + [
+        'conda-package-{:03d}*'.format(i) for i in range(0, 400, 7)
+    ] + [
+        '*-{:05d}'.format(i) for i in range(3, 50000, 97)
+    ] + [
+        'conda-package-?{:03d}?'.format(i) for i in range(0, 1000, 31)
+    ] + [
+        {'pip': 're:pip-package-{:02d}[0-9]+7'.format(i)} for i in range(0, 100, 3)
+    ]
+    compiled_ignore = Rules(ignore)
+    return OrderedDict((
+        ('from_string', lambda: Environment.from_string(export)),
+        # picky.config compiles the ignore rules once when it is loaded:
+        ('modify', lambda: modify(env, compiled_ignore, develop)),
+        ('rules', lambda: modify(env, Rules(rules), develop)),
+        ('to_string', env.to_string),
+        ('copy', env.copy),
+        ('diff', lambda: diff_text(env, other)),
+    ))
+
+
+def best(operation, repeat, budget):
+    """
+    Return the fastest of ``repeat`` runs of the operation, stopping
+    early once ``budget`` seconds have been spent.
+    """
+    times = []
+    spent = 0
+    while len(times) < repeat and (not times or spent < budget):
+        start = default_timer()
+        operation()
+        elapsed = default_timer() - start
+        times.append(elapsed)
+        spent += elapsed
+    return min(times)
+
+
+def peak_memory(operation):
+    tracemalloc.start()
+    try:
+        result = operation()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+
+def run(scales, operations, repeat=5, budget=2.0):
+    """
+    Return the results as a nested mapping of scale name to operation
+    name to a mapping containing ``seconds``, ``packages_per_second``
+    and ``peak_bytes``.
+    """
+    results = OrderedDict()
+    for name in scales:
+        scale = SCALES[name]
+        packages = package_count(scale)
+        prepared = prepare(scale)
+        results[name] = OrderedDict()
+        for operation in operations:
+            seconds = best(prepared[operation], repeat, budget)
+            results[name][operation] = OrderedDict((
+                ('seconds', seconds),
+                ('packages_per_second', packages / seconds if seconds else None),
+                ('peak_bytes', peak_memory(prepared[operation])),
+            ))
+    return results
+
+
+def print_results(results, baseline=None):
+    print('{:<10} {:<12} {:>10} {:>14} {:>10} {:>10}'.format(
+        'scale', 'operation', 'ms', 'packages/s', 'peak MB', 'vs base'
+    ))
+    for name, operations in results.items():
+        for operation, result in operations.items():
+            ratio = ''
+            base = (baseline or {}).get(name, {}).get(operation)
+            if base:
+                ratio = '{:+.0%}'.format(result['seconds'] / base['seconds'] - 1)
+            print('{:<10} {:<12} {:>10.2f} {:>14,.0f} {:>10.2f} {:>10}'.format(
+                name, operation, result['seconds'] * 1000,
+                result['packages_per_second'] or 0,
+                result['peak_bytes'] / 1e6, ratio,
+            ))
+
+
+def regressions(results, baseline, threshold):
+    """
+    Return a list of ``(scale, operation, ratio)`` for each result that
+    took longer than the baseline by more than the supplied fraction.
+    """
+    found = []
+    for name, operations in results.items():
+        for operation, result in operations.items():
+            base = baseline.get(name, {}).get(operation)
+            if base:
+                ratio = result['seconds'] / base['seconds']
+                if ratio > 1 + threshold:
+                    found.append((name, operation, ratio))
+    return found
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--scale', action='append', choices=list(SCALES),
+                        help='Scale to run, may be repeated. Defaults to all.')
+    parser.add_argument('--operation', action='append', choices=OPERATIONS,
+                        help='Operation to time, may be repeated. Defaults to all.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Maximum number of runs of each operation.')
+    parser.add_argument('--budget', type=float, default=2.0,
+                        help='Seconds after which to stop repeating an operation.')
+    parser.add_argument('--save', metavar='PATH',
+                        help='Write the results to a JSON baseline file.')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='Compare the results with a JSON baseline file.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Slowdown, as a fraction, treated as a regression.')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as source:
+            baseline = json.load(source)
+
+    results = run(args.scale or list(SCALES), args.operation or OPERATIONS,
+                  args.repeat, args.budget)
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as target:
+            json.dump(results, target, indent=2)
+            target.write('\n')
+
+    if baseline is not None:
+        found = regressions(results, baseline, args.threshold)
+        for name, operation, ratio in found:
+            print('Regression: {} {} took {:.0%} of the baseline time'.format(
+                name, operation, ratio
+            ))
+        return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+"""
+Generate synthetic ``conda env export`` output of arbitrary size.
+"""
+import random
+
+
+def synthetic_export(conda=1000, pip=0, develop=0, channels=2,
+                     include_build=True, seed=0):
+    """
+    Return text in the format produced by ``conda env export`` describing
+    an environment with the requested numbers of packages.
+    """
+    rng = random.Random(seed)
+    lines = ['name: synthetic', 'channels:']
+    for i in range(channels):
+        lines.append('  - channel-{}'.format(i))
+    lines.append('dependencies:')
+    for i in range(conda):
+        version = '{}.{}.{}'.format(rng.randint(0, 9), rng.randint(0, 30), rng.randint(0, 99))
+        spec = 'conda-package-{:05d}={}'.format(i, version)
+        if include_build:
+            spec += '=py36h{:07x}_{}'.format(rng.getrandbits(28), rng.randint(0, 9))
+        lines.append('  - ' + spec)
+    if pip or develop:
+        lines.append('  - pip:')
+        for i in range(pip):
+            lines.append('    - pip-package-{:05d}=={}.{}'.format(
+                i, rng.randint(0, 9), rng.randint(0, 99)
+            ))
+        for i in range(develop):
+            lines.append('    - -e /src/develop-{:05d}'.format(i))
+    lines.append('prefix: /opt/conda/envs/synthetic')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,70 @@
+"""
+Compare loading a synthetic 1,000 package export with, and serializing it
+through, libyaml, when available, against the pure-Python PyYAML
+implementation.
+
+Run with ``python -m benchmarks.yaml_speed``.
+"""
+from __future__ import print_function
+
+from argparse import ArgumentParser
+from timeit import repeat
+
+from picky import oyaml
+from picky.env import Environment
+from .synthetic import synthetic_export
+
+
+def pure_safe_load(stream):
+    return oyaml.load(stream, Loader=oyaml.SafeLoader)
+
+
+def pure_safe_dump(data, stream=None, **kwds):
+    return oyaml.dump_all([data], stream, Dumper=oyaml.SafeDumper, **kwds)
+
+
+def best(statement, number):
+    return min(repeat(statement, number=number, repeat=5)) / number
+
+
+def measure(export, parsed, load, number):
+    # Environment.from_string uses its own line parser for exports like
+    # these, so loading is measured on the YAML functions themselves:
+    return (
+        best(lambda: load(export), number),
+        best(parsed.to_string, number),
+    )
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--packages', type=int, default=1000)
+    parser.add_argument('--number', type=int, default=10)
+    args = parser.parse_args()
+
+    export = synthetic_export(conda=args.packages)
+    parsed = Environment.from_string(export)
+    fast_load, fast_dump = measure(export, parsed, oyaml.safe_load, args.number)
+
+    # to_string imports safe_dump from picky.oyaml each time it is called:
+    original = oyaml.safe_dump
+    oyaml.safe_dump = pure_safe_dump
+    try:
+        pure_load, pure_dump = measure(export, parsed, pure_safe_load, args.number)
+    finally:
+        oyaml.safe_dump = original
+
+    print('{} packages, libyaml {}'.format(
+        args.packages,
+        'available' if oyaml.FastSafeLoader is not oyaml.SafeLoader else 'not available'
+    ))
+    print('{:<12} {:>12} {:>12} {:>8}'.format('', 'pure (ms)', 'fast (ms)', 'speedup'))
+    for name, pure, fast in (('safe_load', pure_load, fast_load),
+                             ('to_string', pure_dump, fast_dump)):
+        print('{:<12} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(
+            name, pure * 1000, fast * 1000, pure / fast
+        ))
+
+
+if __name__ == '__main__':
+    main()
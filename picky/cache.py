@@ -0,0 +1,151 @@
+import os
+from hashlib import sha256
+
+from .pip import site_packages
+
+
+def default_cache_dir():
+    """
+    Where cached exports are kept unless ``PICKY_CACHE_DIR`` says otherwise.
+    """
+    path = os.environ.get('PICKY_CACHE_DIR')
+    if path:
+        return path
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join('~', '.cache')
+    return os.path.join(os.path.expanduser(base), 'picky')
+
+
+def fingerprint(prefix):
+    """
+    Return a digest that changes whenever packages are installed into or
+    removed from the environment at the supplied prefix, or ``None``
+    if it does not look like a conda environment or changed while its
+    digest was being made.
+
+    This is made from the names and modification times of everything in
+    ``conda-meta``, the size of its ``history`` file and the modification
+    times of the site-packages directories, so that ``pip`` operations
+    are noticed too.
+    """
+    meta = os.path.join(prefix, 'conda-meta')
+    try:
+        names = sorted(os.listdir(meta))
+    except OSError:
+        return None
+    digest = sha256()
+    try:
+        for name in names:
+            stat = os.stat(os.path.join(meta, name))
+            digest.update('{} {!r}\n'.format(name, stat.st_mtime).encode('utf-8'))
+        history = os.path.join(meta, 'history')
+        if os.path.exists(history):
+            digest.update('history {}\n'.format(os.path.getsize(history)).encode('utf-8'))
+        for path in site_packages(prefix):
+            digest.update('{} {!r}\n'.format(path, os.stat(path).st_mtime).encode('utf-8'))
+    except OSError:
+        # something was removed while we looked, so the environment is
+        # changing under us and is best treated as uncacheable:
+        return None
+    return digest.hexdigest()
+
+
+class ExportCache(object):
+    """
+    An on-disk cache of ``conda env export`` output, with one entry per
+    prefix and detail level that is only used while the
+    :func:`fingerprint` of the prefix is unchanged.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_cache_dir()
+
+    def path(self, prefix, include_build):
+        key = '{}\n{}'.format(os.path.abspath(prefix), include_build)
+        name = sha256(key.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.directory, name + '.yaml')
+
+    def load(self, prefix, include_build, print_):
+        """
+        Return the cached export for the prefix if the supplied fingerprint
+        matches the one it was stored with, otherwise ``None``.
+        """
+        try:
+            with open(self.path(prefix, include_build), 'rb') as source:
+                header = source.readline()
+                if header.strip() != b'# ' + print_.encode('ascii'):
+                    return None
+                return source.read()
+        except (IOError, OSError):
+            return None
+
+    def store(self, prefix, include_build, print_, export):
+        if not isinstance(export, bytes):
+            export = export.encode('utf-8')
+        path = self.path(prefix, include_build)
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(temp, 'wb') as target:
+                target.write(b'# ' + print_.encode('ascii') + b'\n')
+                target.write(export)
+            os.rename(temp, path)
+        except (IOError, OSError):
+            # caching is only an optimisation, so never fail because of it:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def export(self, export, include_build=True, prefix=None):
+        """
+        Return the output of ``export(include_build, prefix)``, using the
+        cached copy if nothing has been installed or removed since it was
+        stored. If no prefix is supplied, the activated environment is used.
+        """
+        path = prefix or os.environ.get('CONDA_PREFIX')
+        print_ = fingerprint(path) if path else None
+        if print_ is None:
+            return export(include_build, prefix)
+        cached = self.load(path, include_build, print_)
+        if cached is None:
+            cached = export(include_build, prefix)
+            # don't store an export that raced with an install:
+            if fingerprint(path) == print_:
+                self.store(path, include_build, print_, cached)
+        return cached
+
+    def cached(self, include_build=True, prefix=None):
+        """
+        Return the text of the cached export for the supplied prefix, or
+        the activated environment, if nothing has been installed or
+        removed since it was stored, otherwise ``None``.
+        """
+        path = prefix or os.environ.get('CONDA_PREFIX')
+        print_ = fingerprint(path) if path else None
+        if print_ is None:
+            return None
+        cached = self.load(path, include_build, print_)
+        return None if cached is None else cached.decode('utf-8')
+
+    def stream(self, stream, include_build=True, prefix=None):
+        """
+        Yield the lines produced by ``stream(include_build, prefix)``, using
+        the cached copy if nothing has been installed or removed since it
+        was stored. The lines are stored once they have all been yielded.
+        """
+        path = prefix or os.environ.get('CONDA_PREFIX')
+        print_ = fingerprint(path) if path else None
+        if print_ is None:
+            for line in stream(include_build, prefix):
+                yield line
+            return
+        cached = self.load(path, include_build, print_)
+        if cached is not None:
+            for line in cached.decode('utf-8').splitlines(True):
+                yield line
+            return
+        lines = []
+        for line in stream(include_build, prefix):
+            lines.append(line)
+            yield line
+        if fingerprint(path) == print_:
+            self.store(path, include_build, print_, ''.join(lines))
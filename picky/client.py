@@ -0,0 +1,73 @@
+"""
+A thin client for :mod:`picky.server`. This only uses the standard library
+so that talking to a running server is as cheap as possible.
+"""
+import json
+import os
+import socket
+
+SOCKET_ENV = 'PICKY_SOCKET'
+# seconds to wait for a server to accept a connection, which a healthy one
+# does at once, and then for it to respond, beyond which picky gives up on
+# it and does the work itself:
+CONNECT_TIMEOUT = 1.0
+RESPONSE_TIMEOUT = 120.0
+
+
+def socket_path(path=None):
+    """
+    Return the socket path to use, taken from the supplied path or the
+    ``PICKY_SOCKET`` environment variable, or ``None`` if neither is set.
+    """
+    return path or os.environ.get(SOCKET_ENV) or None
+
+
+def send(path, request, timeout=None, connect_timeout=None):
+    """
+    Send a request to the server listening on the supplied socket path
+    and return its response, raising :class:`socket.timeout` if connecting
+    takes longer than ``connect_timeout`` seconds or any wait for the
+    response longer than ``timeout``.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(connect_timeout)
+        connection.connect(path)
+        connection.settimeout(timeout)
+        connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        chunks = []
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        connection.close()
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def request(path, command, concrete, config, **options):
+    """
+    Ask the server listening on the supplied socket path to run a command
+    against the currently activated environment, returning the response,
+    or ``None`` if there is no server, no activated environment or the
+    server doesn't respond in time.
+
+    If the request has a ``timeout`` for exporting the environment, the
+    server is given that long on top of :data:`RESPONSE_TIMEOUT`.
+    """
+    prefix = os.environ.get('CONDA_PREFIX')
+    if not (path and prefix and os.path.exists(path)):
+        return None
+    payload = dict(
+        command=command,
+        prefix=prefix,
+        concrete=os.path.abspath(concrete),
+        config=os.path.abspath(config),
+        **options
+    )
+    timeout = RESPONSE_TIMEOUT + (options.get('timeout') or 0)
+    try:
+        return send(path, payload, timeout, CONNECT_TIMEOUT)
+    except (IOError, OSError, ValueError):
+        return None
@@ -1,10 +1,200 @@
+import json
 import os
-from subprocess import check_output
+import re
+from collections import OrderedDict
+from subprocess import CalledProcessError, PIPE, Popen, TimeoutExpired
 
+from .env import Environment, PackageSpec
+from .pip import pip_packages
 
-def conda_env_export(include_build=True):
+
+def export_command(include_build=True, prefix=None):
     conda = os.environ.get('CONDA_EXE', 'conda')
     cmd = [conda, 'env', 'export']
     if not include_build:
         cmd.append('--no-builds')
-    return check_output(cmd)
+    if prefix:
+        cmd.extend(('--prefix', prefix))
+    return cmd
+
+
+def conda_env_export(include_build=True, prefix=None, timeout=None, retries=0):
+    """
+    Return the output of ``conda env export``, timing out and retrying
+    as described in :func:`picky.export.export`.
+    """
+    from .export import export_sync
+    return export_sync(include_build, prefix, timeout, retries)
+
+
+def conda_env_stream(include_build=True, prefix=None, timeout=None):
+    """
+    Run ``conda env export``, yielding each line of its output as soon as
+    it is produced. :class:`~subprocess.CalledProcessError` is raised once
+    the output is exhausted if conda did not succeed.
+
+    If conda hasn't finished after ``timeout`` seconds, it is killed and
+    :class:`~subprocess.TimeoutExpired` is raised.
+    """
+    cmd = export_command(include_build, prefix)
+    process = Popen(cmd, stdout=PIPE)
+    expired = []
+    timer = None
+    if timeout is not None:
+        from threading import Timer
+
+        def expire():
+            expired.append(True)
+            process.kill()
+
+        timer = Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+    complete = False
+    try:
+        for line in process.stdout:
+            yield line.decode('utf-8')
+        complete = True
+    finally:
+        if timer is not None:
+            timer.cancel()
+        process.stdout.close()
+        if not complete:
+            process.kill()
+        returncode = process.wait()
+    if returncode:
+        if expired:
+            raise TimeoutExpired(cmd, timeout)
+        raise CalledProcessError(returncode, cmd)
+
+
+ANACONDA_HOSTS = (
+    'conda.anaconda.org', 'repo.anaconda.com', 'repo.continuum.io',
+)
+
+
+def canonical_channel(record):
+    """
+    Return the name ``conda env export`` would use for the channel a
+    package record was installed from.
+    """
+    channel = record.get('channel') or ''
+    subdir = record.get('subdir')
+    channel = channel.rstrip('/')
+    for suffix in subdir, 'noarch':
+        if suffix and channel.endswith('/' + suffix):
+            channel = channel[:-len(suffix) - 1]
+            break
+    match = re.match(r'^[a-z]+://([^/]+)/(.+)$', channel)
+    if match:
+        host, path = match.groups()
+        if host not in ANACONDA_HOSTS:
+            return channel
+        channel = path
+    if channel.startswith('pkgs/'):
+        return 'defaults'
+    return channel
+
+
+def configured_channels(prefix):
+    """
+    Return the channels from any ``.condarc`` files that conda would
+    read for the supplied prefix, in the order conda would use them.
+    """
+    paths = []
+    root = os.environ.get('CONDA_ROOT')
+    if root:
+        paths.append(os.path.join(root, '.condarc'))
+    home = os.path.expanduser('~')
+    paths.extend((
+        os.path.join(home, '.config', 'conda', '.condarc'),
+        os.path.join(home, '.conda', '.condarc'),
+        os.path.join(home, '.condarc'),
+        os.path.join(prefix, '.condarc'),
+    ))
+    if os.environ.get('CONDARC'):
+        paths.append(os.environ['CONDARC'])
+    channels = []
+    for path in paths:
+        if os.path.isfile(path):
+            from .oyaml import safe_load
+            with open(path) as source:
+                data = safe_load(source) or {}
+            for channel in data.get('channels') or ():
+                if channel not in channels:
+                    channels.append(channel)
+    return channels or ['defaults']
+
+
+def read_records(prefix, cache=None):
+    """
+    Return the package records from the ``conda-meta`` directory of the
+    supplied prefix, sorted by package name.
+
+    If a cache dictionary is supplied, records are kept in it and only
+    re-read when their files change.
+    """
+    meta = os.path.join(prefix, 'conda-meta')
+    records = []
+    seen = set()
+    for name in os.listdir(meta):
+        if name.endswith('.json'):
+            path = os.path.join(meta, name)
+            if cache is not None:
+                stat = os.stat(path)
+                key = stat.st_mtime, stat.st_size
+                seen.add(name)
+                cached = cache.get(name)
+                if cached is not None and cached[0] == key:
+                    records.append(cached[1])
+                    continue
+            with open(path) as source:
+                record = json.load(source)
+            if cache is not None:
+                cache[name] = key, record
+            records.append(record)
+    if cache is not None:
+        for name in set(cache) - seen:
+            del cache[name]
+    records.sort(key=lambda record: record['name'])
+    return records
+
+
+def environment_name(prefix):
+    if prefix == os.environ.get('CONDA_PREFIX'):
+        name = os.environ.get('CONDA_DEFAULT_ENV')
+        if name and os.sep not in name:
+            return name
+    if os.path.isdir(os.path.join(prefix, 'conda-meta')) and \
+            os.path.isdir(os.path.join(prefix, 'envs')):
+        return 'base'
+    return os.path.basename(os.path.normpath(prefix))
+
+
+def conda_meta_environment(include_build=True, prefix=None, cache=None):
+    """
+    Build an :class:`~picky.env.Environment` for the supplied prefix,
+    or the activated environment, by reading the ``conda-meta`` records
+    and site-packages metadata directly rather than running conda.
+    A cache may be supplied as described in :func:`read_records`.
+    """
+    prefix = prefix or os.environ['CONDA_PREFIX']
+    records = read_records(prefix, cache)
+    channels = configured_channels(prefix)
+    conda = OrderedDict()
+    for record in records:
+        channel = canonical_channel(record)
+        if channel and channel not in channels:
+            channels.insert(0, channel)
+        build = record['build'] if include_build else None
+        conda[record['name']] = PackageSpec(
+            '=', record['name'], record['version'], build
+        )
+    pip, develop = pip_packages(prefix, records)
+    return Environment(
+        name=environment_name(prefix),
+        channels=channels,
+        conda=conda,
+        pip=pip,
+        develop=develop,
+    )
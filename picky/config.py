@@ -1,23 +1,31 @@
 import os
 from argparse import Namespace
-from .oyaml import safe_load
+
+from .rules import Rules
 
 VERSION = 'version'
 BUILD = 'build'
 
+EXPORT = 'export'
+NATIVE = 'native'
+BACKENDS = EXPORT, NATIVE
+
 
 def parse_config(path):
     if os.path.exists(path):
+        from .oyaml import safe_load
         with open(path) as source:
             data = safe_load(source)
     else:
         data = {}
 
-    ignore = set(data.get('ignore', ()))
+    ignore = Rules(data.get('ignore', ()))
     develop = data.get('develop', {})
     detail = data.get('detail', BUILD)
+    backend = data.get('backend', EXPORT)
     return Namespace(
         ignore=ignore,
         develop=develop,
         detail=detail,
+        backend=backend,
     )
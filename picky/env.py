@@ -1,47 +1,225 @@
 from __future__ import print_function
 
-from collections import OrderedDict
-from difflib import unified_diff
+import re
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from hashlib import sha256
+from sys import intern
 
-from .oyaml import safe_load, safe_dump
+from .rules import Rules, compiled
 
 
-class PackageSpec(object):
+class PackageSpec(namedtuple('PackageSpec', 'sep name version build')):
+    """
+    An immutable specification of a single package. Separators and
+    names are interned as they are shared between many environments.
 
-    def __init__(self, sep, name, version=None, build=None):
-        self.sep = sep
-        self.name = name
-        self.version = version
-        self.build = build
+    Specs are their own sort key: within a section, where the separators
+    are all the same, they sort by name and then version.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, sep, name, version=None, build=None):
+        return tuple.__new__(cls, (intern(sep), intern(name), version, build))
 
     def __str__(self):
         return self.sep.join(e for e in (self.name, self.version, self.build)
                              if e is not None)
 
-    def __lt__ (self, other):
-        return (self.name, self.version) < (other.name, other.version)
+
+def add_conda_spec(conda, text):
+    package = PackageSpec('=', *text.split('=', 2))
+    conda[package.name] = package
+
+
+def add_pip_spec(pip, develop, text):
+    if text.startswith('-e'):
+        e, path = text.split()
+        develop[path] = PackageSpec(' ', e, path)
+    else:
+        package = PackageSpec('==', *text.split('=='))
+        pip[package.name] = package
+
+
+TOP_LEVEL = re.compile(r'^([a-z]+):(?: +(.*))?$')
+ITEM = re.compile(r'^( *)- +(.*)$')
+UNSAFE_START = frozenset('[]{}#&*!|>\'"%@`,?:')
+NOT_A_STRING = re.compile(
+    r'^(?:[-+]?\.?[0-9].*|[-+]?\.(?:inf|nan)|~|null|true|false|yes|no|on|off|y|n)$',
+    re.IGNORECASE
+)
+
+
+def plain(value):
+    """
+    Return ``True`` if the value is a YAML plain scalar that would be
+    loaded as the same string.
+    """
+    return bool(
+        value and
+        value[0] not in UNSAFE_START and
+        value != '-' and
+        not value.startswith('- ') and
+        ': ' not in value and
+        ' #' not in value and
+        not value.endswith(':') and
+        not NOT_A_STRING.match(value)
+    )
+
+
+def unquote(value):
+    """
+    Return the string a single or double quoted YAML scalar loads as,
+    if it has no escapes or embedded quotes, otherwise the value as is.
+    """
+    if (len(value) > 1 and value[0] in '\'"' and value[-1] == value[0] and
+            value[0] not in value[1:-1] and '\\' not in value):
+        return value[1:-1]
+    return value
+
+
+class LineParser(object):
+    """
+    An incremental parser for the regular subset of YAML produced by
+    ``conda env export`` and :meth:`Environment.to_string`.
+
+    Lines are passed to :meth:`feed` as they become available, which
+    returns ``False`` as soon as anything outside that subset is seen,
+    at which point the caller should fall back to a full YAML parser.
+    """
+
+    def __init__(self):
+        self.name = None
+        self.channels = None
+        self.conda = OrderedDict()
+        self.pip = OrderedDict()
+        self.develop = OrderedDict()
+        self.section = None
+        self.indent = None
+        self.in_pip = False
+
+    def feed(self, line):
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            return True
+        match = ITEM.match(line)
+        if match:
+            indent, value = match.groups()
+            return self.item(len(indent), value)
+        match = TOP_LEVEL.match(line)
+        if not match:
+            return False
+        key, value = match.groups()
+        self.section = self.indent = None
+        self.in_pip = False
+        if key in ('name', 'prefix'):
+            if value is not None and not plain(value):
+                return False
+            if key == 'name':
+                self.name = value
+            return True
+        if key not in ('channels', 'dependencies'):
+            return False
+        if key == 'channels':
+            self.channels = []
+        if value == '[]':
+            return True
+        if value is not None:
+            return False
+        self.section = key
+        return True
+
+    def item(self, indent, value):
+        if self.section is None:
+            return False
+        if self.indent is None:
+            self.indent = indent
+        if self.section == 'channels':
+            if indent != self.indent or not plain(value):
+                return False
+            self.channels.append(value)
+        elif indent == self.indent:
+            self.in_pip = value == 'pip:'
+            if not self.in_pip:
+                if not plain(value):
+                    return False
+                add_conda_spec(self.conda, value)
+        elif self.in_pip and indent == self.indent + 2 and plain(value):
+            add_pip_spec(self.pip, self.develop, value)
+        else:
+            return False
+        return True
+
+    def environment(self, cls):
+        return cls(
+            name=self.name,
+            channels=() if self.channels is None else self.channels,
+            conda=self.conda,
+            pip=self.pip,
+            develop=self.develop,
+        )
+
+
+class PositionParser(LineParser):
+    """
+    A :class:`LineParser` that also records where each entry was found,
+    so that the lines it parsed can be edited in place.
+    """
+
+    def __init__(self):
+        super(PositionParser, self).__init__()
+        self.lineno = -1
+        self.name_line = None
+        self.pip_line = None
+        # section -> list of (key, line number, indent):
+        self.positions = dict((section, []) for section in ('channels',) + SECTIONS)
+
+    def feed(self, line):
+        self.lineno += 1
+        if line.startswith('name:'):
+            self.name_line = self.lineno
+        return super(PositionParser, self).feed(line)
+
+    def item(self, indent, value):
+        # quoted entries, such as "-e ." as written by some YAML dumpers, are
+        # located by what they load as so that the lines around them can be
+        # updated in place:
+        value = unquote(value)
+        if not super(PositionParser, self).item(indent, value):
+            return False
+        if self.section == 'channels':
+            section, key = 'channels', value
+        elif indent == self.indent:
+            if self.in_pip:
+                self.pip_line = self.lineno
+                return True
+            section, key = 'conda', value.split('=', 1)[0]
+        elif value.startswith('-e'):
+            section, key = 'develop', value.split()[1]
+        else:
+            section, key = 'pip', value.split('==', 1)[0]
+        self.positions[section].append((key, self.lineno, indent))
+        return True
 
 
 class Environment(dict):
 
     @classmethod
-    def from_string(cls, yaml):
-        data = safe_load(yaml) or {}
+    def from_data(cls, data):
+        """
+        Build an environment from the structure obtained by loading
+        the YAML of an export or concrete specification.
+        """
         conda = OrderedDict()
         pip = OrderedDict()
         develop = OrderedDict()
         for spec in data.get('dependencies', ()):
             if isinstance(spec, dict):
                 for pip_spec in spec['pip']:
-                    if pip_spec.startswith('-e'):
-                        e, path = pip_spec.split()
-                        develop[path] = PackageSpec(' ', e, path)
-                    else:
-                        name, version = pip_spec.split('==')
-                        pip[name] = PackageSpec('==', name, version)
+                    add_pip_spec(pip, develop, pip_spec)
             else:
-                parts = spec.split('=', 2)
-                conda[parts[0]] = PackageSpec('=', *parts)
+                add_conda_spec(conda, spec)
         return cls(
             name=data.get('name'),
             channels=data.get('channels', ()),
@@ -50,12 +228,37 @@ class Environment(dict):
             develop=develop,
         )
 
+    @classmethod
+    def from_lines(cls, lines):
+        """
+        Build an environment from an iterable of lines of YAML, such as the
+        output of a running ``conda env export``, parsing each line as it
+        arrives. A full YAML parser is used if anything unexpected is found.
+        """
+        parser = LineParser()
+        seen = []
+        for line in lines:
+            seen.append(line)
+            if parser is not None and not parser.feed(line):
+                parser = None
+        if parser is None:
+            from .oyaml import safe_load
+            return cls.from_data(safe_load(''.join(seen)) or {})
+        return parser.environment(cls)
+
+    @classmethod
+    def from_string(cls, yaml):
+        if isinstance(yaml, bytes):
+            yaml = yaml.decode('utf-8')
+        return cls.from_lines(yaml.splitlines(True))
+
     @classmethod
     def from_path(cls, path):
         with open(path) as source:
-            return cls.from_string(source.read())
+            return cls.from_lines(source)
 
     def to_string(self):
+        from .oyaml import safe_dump
         output = OrderedDict()
         name = self.get('name')
         if name:
@@ -84,22 +287,183 @@ class Environment(dict):
             develop=self['develop'].copy(),
         )
 
+    def digest(self):
+        """
+        Return a digest of everything :func:`changes` compares, such that
+        two environments have the same digest only when there are no
+        changes between them.
+        """
+        digest = sha256()
+        for channel in sorted(set(self.get('channels') or ())):
+            digest.update('channels\t{}\n'.format(channel).encode('utf-8'))
+        for section in SECTIONS:
+            specs = self.get(section) or {}
+            for key in sorted(specs):
+                spec = specs[key]
+                digest.update('{}\t{}\t{!r}\t{!r}\n'.format(
+                    section, key, spec.version, spec.build
+                ).encode('utf-8'))
+        return digest.hexdigest()
+
+
+class SpecStore(dict):
+    """
+    A store of the :class:`PackageSpec` instances used by many
+    environments, so that each distinct spec is only held in memory once,
+    however many environments it is found in.
+    """
+
+    def add(self, env):
+        """
+        Replace each spec in the supplied environment with the stored one
+        that is equal to it, storing any that are new. The environment is
+        returned for convenience.
+        """
+        for section in SECTIONS:
+            specs = env[section]
+            for key, spec in specs.items():
+                specs[key] = self.setdefault(spec, spec)
+        return env
+
+
+DIGEST_HEADER = '# picky-digest: '
+
+
+def add_digest(text, env):
+    """
+    Return the supplied serialized environment with a header comment
+    recording the digest of the environment and of the text itself.
+    """
+    return '{}{} {}\n{}'.format(
+        DIGEST_HEADER, env.digest(), sha256(text.encode('utf-8')).hexdigest(), text
+    )
+
+
+def split_digest(text):
+    """
+    Split a serialized environment into the environment digest recorded
+    in its header comment and the rest of the text. The digest is ``None``
+    if there is no header or if the text has been edited since it was added.
+    """
+    if not text.startswith(DIGEST_HEADER):
+        return None, text
+    header, _, body = text.partition('\n')
+    parts = header[len(DIGEST_HEADER):].split()
+    if len(parts) != 2 or sha256(body.encode('utf-8')).hexdigest() != parts[1]:
+        return None, body
+    return parts[0], body
+
+
+@lru_cache(maxsize=32)
+def develop_rules(names):
+    """
+    Return the :class:`~picky.rules.Rules` for the supplied tuple of
+    ``develop`` names, compiling them only the first time they are seen.
+    """
+    return Rules(list(names))
+
 
 def modify(env, ignore=None, develop=None):
-    env = env.copy()
-    if ignore:
-        for type in 'conda', 'pip':
-            for key in ignore.intersection(env[type]):
-                del env[type][key]
-    if develop:
-        for name, path in develop.items():
-            if name in env['pip']:
-                del env['pip'][name]
-            env['develop'][path] = PackageSpec(' ', '-e', path)
-    return env
+    """
+    Return a new environment with packages matching the ``ignore``
+    :class:`~picky.rules.Rules` removed and pip packages matching the names
+    in ``develop`` replaced by the development install paths they map to.
+    """
+    ignore = compiled(ignore)
+    develop = develop or {}
+    result = Environment(name=env['name'], channels=list(env['channels']))
+    for section in 'conda', 'pip':
+        specs = env[section]
+        # copying and then deleting is done in C, so is quicker than
+        # building a filtered copy when only a few are removed:
+        result[section] = specs.copy()
+        remove = ignore.matching(section, specs) if ignore else set()
+        if section == 'pip' and develop:
+            remove.update(develop_rules(tuple(develop)).matching(section, specs))
+        for key in remove:
+            del result[section][key]
+    result['develop'] = env['develop'].copy()
+    for path in develop.values():
+        result['develop'][path] = PackageSpec(' ', '-e', path)
+    return result
 
 
-def diff(expected, actual):
+ADDED = 'added'
+REMOVED = 'removed'
+VERSION_CHANGED = 'version-changed'
+BUILD_CHANGED = 'build-changed'
+CHANNEL_CHANGED = 'channel-changed'
+
+SECTIONS = 'conda', 'pip', 'develop'
+
+
+class Change(namedtuple('Change', 'kind section name expected actual')):
+    """
+    A single difference between two environments. ``expected`` and
+    ``actual`` are the :class:`PackageSpec` from each environment, or
+    ``None`` if it is absent. For the ``channels`` section, they are the
+    channel name, or ``None``.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        if self.section == 'channels':
+            return 'channel {} {}'.format(
+                self.name, 'added' if self.expected is None else 'removed'
+            )
+        if self.kind == ADDED:
+            detail = str(self.actual)
+        elif self.kind == REMOVED:
+            detail = str(self.expected)
+        else:
+            detail = '{} -> {}'.format(self.expected, self.actual)
+        return '{} {}: {}'.format(self.section, self.kind, detail)
+
+
+def changes(expected, actual):
+    """
+    Return a list of the :class:`Change` objects needed to turn the
+    expected environment into the actual one, ignoring their names and
+    the order of their channels.
+    """
+    result = []
+    expected_channels = set(expected.get('channels') or ())
+    actual_channels = set(actual.get('channels') or ())
+    for channel in sorted(expected_channels ^ actual_channels):
+        if channel in expected_channels:
+            result.append(Change(CHANNEL_CHANGED, 'channels', channel, channel, None))
+        else:
+            result.append(Change(CHANNEL_CHANGED, 'channels', channel, None, channel))
+    for section in SECTIONS:
+        expected_specs = expected.get(section) or {}
+        actual_specs = actual.get(section) or {}
+        section_changes = []
+        for key, expected_spec in expected_specs.items():
+            actual_spec = actual_specs.get(key)
+            if actual_spec is None:
+                kind = REMOVED
+            elif actual_spec.version != expected_spec.version:
+                kind = VERSION_CHANGED
+            elif actual_spec.build != expected_spec.build:
+                kind = BUILD_CHANGED
+            else:
+                continue
+            section_changes.append(Change(kind, section, key, expected_spec, actual_spec))
+        for key, actual_spec in actual_specs.items():
+            if key not in expected_specs:
+                section_changes.append(Change(ADDED, section, key, None, actual_spec))
+        section_changes.sort(key=lambda change: change.name)
+        result.extend(section_changes)
+    return result
+
+
+def render_unified(expected, actual):
+    """
+    Render the differences between two environments as a unified diff
+    of their serialized forms.
+    """
+    from difflib import unified_diff
     envs = []
     for env in expected, actual:
         env = env.copy()
@@ -108,7 +472,109 @@ def diff(expected, actual):
     udiff = '\n'.join(unified_diff(
         *envs, lineterm='', fromfile='expected', tofile='actual'
     ))
-    if udiff:
-        print('Expected environment does not match actual:')
-        print(udiff)
-    return 1 if udiff else 0
+    return 'Expected environment does not match actual:\n' + udiff + '\n'
+
+
+def diff_text(expected, actual):
+    """
+    Return a report of the differences between the two environments,
+    which will be empty if there are none.
+    """
+    if not changes(expected, actual):
+        return ''
+    return render_unified(expected, actual)
+
+
+def diff(expected, actual):
+    text = diff_text(expected, actual)
+    if text:
+        print(text, end='')
+    return 1 if text else 0
+
+
+def insertion_point(positions, key):
+    """
+    Return the line number before which an entry with the supplied key
+    should be inserted so that it follows the existing ordering, along
+    with the indentation to use, or ``None`` if there are no entries.
+    """
+    if not positions:
+        return None
+    for existing, lineno, indent in positions:
+        if existing > key:
+            return lineno, indent
+    existing, lineno, indent = positions[-1]
+    return lineno + 1, indent
+
+
+def update_text(text, env):
+    """
+    Return the supplied serialized environment with only the lines that
+    differ from the supplied environment changed, leaving everything
+    else, including ordering, as it was. ``None`` is returned if the text
+    cannot be updated in place and should be re-serialized instead.
+    """
+    lines = text.splitlines(True)
+    parser = PositionParser()
+    for line in lines:
+        if not parser.feed(line):
+            return None
+    existing = parser.environment(Environment)
+    found = changes(existing, env)
+    name = env.get('name')
+    if not found and existing['name'] == name:
+        return text
+
+    newline = '\r\n' if lines and lines[0].endswith('\r\n') else '\n'
+    replaced = {}
+    inserted = {}
+
+    def entry(indent, value):
+        if not plain(value):
+            raise ValueError(value)
+        return ' ' * indent + '- ' + value + newline
+
+    try:
+        if existing['name'] != name:
+            if name and not plain(name):
+                return None
+            if parser.name_line is not None:
+                replaced[parser.name_line] = 'name: {}{}'.format(name, newline) if name else ''
+            elif name:
+                inserted.setdefault(0, []).append('name: {}{}'.format(name, newline))
+        for change in found:
+            positions = parser.positions[change.section]
+            if (change.kind == REMOVED or
+                    change.kind == CHANNEL_CHANGED and change.actual is None):
+                for key, lineno, indent in positions:
+                    if key == change.name:
+                        replaced[lineno] = ''
+                continue
+            value = change.actual if change.section == 'channels' else str(change.actual)
+            if change.kind in (VERSION_CHANGED, BUILD_CHANGED):
+                for key, lineno, indent in positions:
+                    if key == change.name:
+                        replaced[lineno] = entry(indent, value)
+                continue
+            point = insertion_point(positions, change.name)
+            if point is None and change.section == 'develop':
+                # develop entries follow the pip ones:
+                pip = parser.positions['pip']
+                point = pip and (pip[-1][1] + 1, pip[-1][2])
+            elif point is None and change.section == 'pip':
+                develop = parser.positions['develop']
+                point = develop and (develop[0][1], develop[0][2])
+            if not point:
+                return None
+            lineno, indent = point
+            inserted.setdefault(lineno, []).append(entry(indent, value))
+    except ValueError:
+        return None
+
+    output = []
+    for lineno, line in enumerate(lines):
+        output.extend(inserted.get(lineno, ()))
+        output.append(replaced.get(lineno, line))
+    output.extend(inserted.get(len(lines), ()))
+    return ''.join(output)
+
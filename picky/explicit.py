@@ -0,0 +1,244 @@
+"""
+Explicit specifications, which list the exact package files of an
+environment along with their hashes, so that it can be recreated
+without conda solving anything.
+
+The format is that of ``conda list --explicit --md5``, so the file can
+also be used with ``conda create --file``, with pip packages added as
+comments that conda ignores::
+
+  @EXPLICIT
+  https://conda.anaconda.org/conda-forge/linux-64/certifi-2018.1.18-py36_0.tar.bz2#a4b...
+  # pip: attrs==17.4.0 --hash=sha256:12ab...
+  # pip: -e .
+"""
+import hashlib
+import os
+import shutil
+import sys
+from collections import namedtuple
+from pathlib import Path
+from subprocess import check_call
+from urllib.parse import unquote, urlparse
+from urllib.request import urlopen
+
+from .conda import read_records
+from .pip import normalize_name, pip_hashes
+
+MARKER = '@EXPLICIT'
+PIP_PREFIX = '# pip: '
+DEVELOP_PREFIX = '-e '
+HEADER = (
+    '# This file may be used to create an environment using:\n'
+    '# $ picky restore --explicit <this file> --prefix <prefix>\n'
+    '# or, without installing the pip packages:\n'
+    '# $ conda create --prefix <prefix> --file <this file>\n'
+)
+CHUNK = 1024 * 1024
+
+Package = namedtuple('Package', 'url algorithm digest')
+
+
+def explicit_path(concrete_path, platform=None):
+    """
+    Return the path of the explicit specification kept alongside the
+    supplied concrete specification, or alongside the supplied platform's
+    section of a multi-platform one.
+    """
+    base, extension = os.path.splitext(concrete_path)
+    if extension not in ('.yaml', '.yml'):
+        base = concrete_path
+    if platform:
+        base = '{}.{}'.format(base, platform)
+    return base + '.explicit.txt'
+
+
+def record_url(record):
+    url = record.get('url')
+    if url:
+        return url
+    channel = (record.get('channel') or '').rstrip('/')
+    subdir = record.get('subdir')
+    if subdir and not channel.endswith('/' + subdir):
+        channel += '/' + subdir
+    filename = record.get('fn') or '{name}-{version}-{build}.tar.bz2'.format(**record)
+    return '{}/{}'.format(channel, filename)
+
+
+def render(env, prefix):
+    """
+    Return the explicit specification for the supplied environment, using
+    the package records and pip metadata in the supplied prefix.
+    """
+    records = {record['name']: record for record in read_records(prefix)}
+    lines = [HEADER + MARKER]
+    for name in sorted(env['conda']):
+        record = records.get(name)
+        if record is None:
+            raise ValueError('No conda-meta record for {} in {}'.format(name, prefix))
+        url = record_url(record)
+        if record.get('md5'):
+            url += '#' + record['md5']
+        elif record.get('sha256'):
+            url += '#sha256:' + record['sha256']
+        lines.append(url)
+    hashes = pip_hashes(prefix)
+    found = {name: hashes.get(normalize_name(name)) for name in env['pip']}
+    # pip's hash-checking mode needs a hash for every requirement, so
+    # hashes are only given if they are known for all pip packages:
+    hashed = all(found.values())
+    for name in sorted(env['pip']):
+        line = str(env['pip'][name])
+        if hashed:
+            line += ' --hash=' + found[name]
+        lines.append(PIP_PREFIX + line)
+    for path in sorted(env['develop']):
+        lines.append(PIP_PREFIX + str(env['develop'][path]))
+    return '\n'.join(lines) + '\n'
+
+
+def write(concrete_path, env, prefix=None, platform=None):
+    """
+    Write the explicit specification for the supplied environment next to
+    the supplied concrete specification.
+    """
+    text = render(env, prefix or os.environ['CONDA_PREFIX'])
+    with open(explicit_path(concrete_path, platform), 'w') as target:
+        target.write(text)
+
+
+def parse(text):
+    """
+    Return a list of :class:`Package` and a list of pip requirement lines
+    from the text of an explicit specification.
+    """
+    packages = []
+    pip = []
+    explicit = False
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith(PIP_PREFIX):
+            pip.append(line[len(PIP_PREFIX):])
+        elif line == MARKER:
+            explicit = True
+        elif line and not line.startswith('#'):
+            if not explicit:
+                raise ValueError('Not an explicit specification, no {} line'.format(MARKER))
+            url, _, digest = line.partition('#')
+            algorithm = 'md5'
+            if digest.startswith('sha256:'):
+                algorithm, digest = 'sha256', digest[len('sha256:'):]
+            packages.append(Package(url, algorithm if digest else None, digest or None))
+    return packages, pip
+
+
+def file_digest(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_path(package, pkgs_dir):
+    return os.path.join(pkgs_dir, unquote(urlparse(package.url).path.rsplit('/', 1)[-1]))
+
+
+def fetch(package, pkgs_dir):
+    """
+    Make sure the package file is in the supplied package cache with the
+    expected hash, downloading it if needed, and return its path there.
+    """
+    path = cached_path(package, pkgs_dir)
+    if os.path.exists(path) and (
+        package.digest is None or file_digest(path, package.algorithm) == package.digest
+    ):
+        return path
+    temp = '{}.{}.part'.format(path, os.getpid())
+    try:
+        with urlopen(package.url) as source, open(temp, 'wb') as target:
+            shutil.copyfileobj(source, target, CHUNK)
+        if package.digest is not None:
+            actual = file_digest(temp, package.algorithm)
+            if actual != package.digest:
+                raise ValueError('{} has {} {}, expected {}'.format(
+                    package.url, package.algorithm, actual, package.digest
+                ))
+        os.replace(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+    return path
+
+
+def fetch_all(packages, pkgs_dir, jobs=None):
+    """
+    Fetch all the supplied packages into the package cache in parallel,
+    returning their paths there.
+    """
+    from multiprocessing.pool import ThreadPool
+    if not os.path.isdir(pkgs_dir):
+        os.makedirs(pkgs_dir)
+    # fetching spends most of its time waiting on the network, so threads will do:
+    pool = ThreadPool(jobs or min(32, len(packages) or 1))
+    try:
+        return pool.map(lambda package: fetch(package, pkgs_dir), packages)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def python_path(prefix):
+    if sys.platform == 'win32':
+        return os.path.join(prefix, 'python.exe')
+    return os.path.join(prefix, 'bin', 'python')
+
+
+def restore(explicit, prefix, pkgs_dir, jobs=None):
+    """
+    Create an environment at the supplied prefix from the explicit
+    specification at the supplied path. Packages are fetched into the
+    package cache in parallel, then linked by conda from there with no
+    solve and no further downloads, after which the pip packages are
+    installed without resolving their dependencies, followed by any
+    develop packages.
+    """
+    with open(explicit) as source:
+        packages, pip = parse(source.read())
+    paths = fetch_all(packages, pkgs_dir, jobs)
+    local = os.path.join(pkgs_dir, 'picky-restore-{}.txt'.format(os.getpid()))
+    with open(local, 'w') as target:
+        target.write(MARKER + '\n')
+        for package, path in zip(packages, paths):
+            url = Path(os.path.abspath(path)).as_uri()
+            if package.algorithm == 'md5':
+                url += '#' + package.digest
+            elif package.algorithm == 'sha256':
+                url += '#sha256:' + package.digest
+            target.write(url + '\n')
+    environ = dict(os.environ, CONDA_PKGS_DIRS=os.path.abspath(pkgs_dir))
+    conda = os.environ.get('CONDA_EXE', 'conda')
+    try:
+        check_call([conda, 'create', '--yes', '--offline', '--prefix', prefix,
+                    '--file', local], env=environ)
+    finally:
+        os.remove(local)
+    pip_install = [python_path(prefix), '-m', 'pip', 'install', '--no-deps']
+    requirements = [line for line in pip if not line.startswith(DEVELOP_PREFIX)]
+    if requirements:
+        path = os.path.join(pkgs_dir, 'picky-pip-{}.txt'.format(os.getpid()))
+        with open(path, 'w') as target:
+            target.write('\n'.join(requirements) + '\n')
+        try:
+            check_call(pip_install + ['-r', path])
+        finally:
+            os.remove(path)
+    # develop packages can't be installed in pip's hash-checking mode, so
+    # are installed separately, relative to where the specification is:
+    develop = []
+    for line in pip:
+        if line.startswith(DEVELOP_PREFIX):
+            develop.extend(['-e', line[len(DEVELOP_PREFIX):].strip()])
+    if develop:
+        check_call(pip_install + develop, cwd=os.path.dirname(os.path.abspath(explicit)))
+    return len(packages), len(pip)
@@ -0,0 +1,88 @@
+"""
+Run ``conda env export`` under :mod:`asyncio`, so that a hung conda can be
+timed out, a failed one retried and many environments exported at once
+without running more copies of conda than the machine can cope with.
+"""
+import asyncio
+from subprocess import CalledProcessError, PIPE, TimeoutExpired
+
+from .conda import export_command
+
+# seconds to wait before the first retry, doubled for each one after that:
+RETRY_DELAY = 1.0
+
+
+async def run_export(cmd, timeout=None):
+    """
+    Run the supplied export command once and return its output, killing
+    it if it takes longer than ``timeout`` seconds or the calling task is
+    cancelled.
+    """
+    process = await asyncio.create_subprocess_exec(*cmd, stdout=PIPE)
+    try:
+        output, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutExpired(cmd, timeout)
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    if process.returncode:
+        raise CalledProcessError(process.returncode, cmd, output)
+    return output
+
+
+async def export(include_build=True, prefix=None, timeout=None, retries=0,
+                 semaphore=None):
+    """
+    Return the output of ``conda env export`` for the supplied prefix, or
+    the activated environment.
+
+    Each attempt is given ``timeout`` seconds, after which
+    :class:`~subprocess.TimeoutExpired` is raised, and failed or timed out
+    attempts are retried up to ``retries`` times. If a semaphore is
+    supplied, it is held while conda is running.
+    """
+    cmd = export_command(include_build, prefix)
+    for attempt in range(retries + 1):
+        try:
+            if semaphore is None:
+                return await run_export(cmd, timeout)
+            async with semaphore:
+                return await run_export(cmd, timeout)
+        except (CalledProcessError, TimeoutExpired):
+            if attempt == retries:
+                raise
+        await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+
+
+async def export_many(exports, timeout=None, retries=0, limit=None):
+    """
+    Run each of the supplied ``(include_build, prefix)`` exports
+    concurrently, running no more than ``limit`` copies of conda at once.
+    A list is returned containing either the output or the exception
+    raised for each export, in order.
+    """
+    semaphore = asyncio.BoundedSemaphore(limit) if limit else None
+    return await asyncio.gather(*(
+        export(include_build, prefix, timeout, retries, semaphore)
+        for include_build, prefix in exports
+    ), return_exceptions=True)
+
+
+def export_all(exports, timeout=None, retries=0, limit=None):
+    """
+    Call :func:`export_many` from synchronous code.
+
+    This runs one event loop for all of the exports and, as with
+    :func:`export_sync`, must be called from the main thread, which is the
+    only one asyncio can wait for child processes from on Python 3.7.
+    """
+    return asyncio.run(export_many(exports, timeout, retries, limit))
+
+
+def export_sync(include_build=True, prefix=None, timeout=None, retries=0):
+    """
+    Call :func:`export` from synchronous code, in the main thread.
+    """
+    return asyncio.run(export(include_build, prefix, timeout, retries))
@@ -0,0 +1,313 @@
+"""
+An append-only history of the environments locked into a concrete
+specification, kept next to it in four files:
+
+``<concrete>.history``
+  One JSON record per snapshot, holding the package changes from the
+  snapshot before it, as found by :func:`~picky.env.changes`, along with
+  the channels if they changed. Every :data:`CHECKPOINT_INTERVAL` th
+  record also holds the full environment, so that any snapshot can be
+  rebuilt from at most that many records.
+
+``<concrete>.history.index``
+  A fixed-size entry per snapshot with its time and the offset and
+  length of its record, so records can be read without reading those
+  before them and the snapshot current at a given time found by
+  bisection.
+
+``<concrete>.history.packages``
+  A line for each change to a package naming the snapshot it was made
+  in, so that the history of one package can be read without
+  rebuilding any environments. Each line also holds the offset of the
+  line before it for a package whose name hashes to the same one of
+  :data:`BUCKETS` buckets.
+
+``<concrete>.history.packages.index``
+  The offset of the latest line for each bucket, so that the lines for
+  one package can be found by following the offsets back from there,
+  without reading those for other packages.
+"""
+import json
+import os
+import struct
+import zlib
+from collections import OrderedDict, namedtuple
+
+from .env import (
+    ADDED, BUILD_CHANGED, REMOVED, SECTIONS, VERSION_CHANGED, Change, Environment,
+    PackageSpec, changes,
+)
+from .sidecar import SEPARATORS
+
+SUFFIX = '.history'
+INDEX_SUFFIX = '.index'
+PACKAGES_SUFFIX = '.packages'
+CHECKPOINT_INTERVAL = 50
+# time, then offset and length of the record:
+ENTRY = struct.Struct('<dQI')
+BUCKETS = 4096
+# one more than the offset of a line in the packages file, so zero means none:
+LINK = struct.Struct('<Q')
+
+Event = namedtuple('Event', 'snapshot time change')
+
+
+def history_path(concrete_path, platform=None):
+    """
+    Return the path of the history for the supplied concrete
+    specification or, for a multi-platform one, for the supplied platform
+    within it.
+    """
+    if platform:
+        return '{}.{}{}'.format(concrete_path, platform, SUFFIX)
+    return concrete_path + SUFFIX
+
+
+def encode_spec(spec):
+    return None if spec is None else [spec.version, spec.build]
+
+
+def decode_spec(section, key, value):
+    if value is None:
+        return None
+    version, build = value
+    if section == 'develop':
+        return PackageSpec(' ', '-e', version)
+    return PackageSpec(SEPARATORS[section], key, version, build)
+
+
+def encode_environment(env):
+    data = OrderedDict(name=env.get('name'), channels=list(env['channels']))
+    for section in SECTIONS:
+        data[section] = OrderedDict(
+            (key, encode_spec(spec)) for key, spec in env[section].items()
+        )
+    return data
+
+
+def decode_environment(data):
+    env = Environment(name=data['name'], channels=list(data['channels']))
+    for section in SECTIONS:
+        env[section] = OrderedDict(
+            (key, decode_spec(section, key, value)) for key, value in data[section].items()
+        )
+    return env
+
+
+def apply(env, record):
+    """
+    Apply the changes in the supplied record to the environment in place.
+    """
+    if 'name' in record:
+        env['name'] = record['name']
+    if 'channels' in record:
+        env['channels'] = list(record['channels'])
+    for section, key, old, new in record['changes']:
+        if new is None:
+            del env[section][key]
+        else:
+            env[section][key] = decode_spec(section, key, new)
+
+
+def bucket(name):
+    return zlib.crc32(name.encode('utf-8')) % BUCKETS
+
+
+def decoded_change(section, key, old, new):
+    """
+    Return the :class:`~picky.env.Change` for a package from a record.
+    """
+    old = decode_spec(section, key, old)
+    new = decode_spec(section, key, new)
+    if old is None:
+        kind = ADDED
+    elif new is None:
+        kind = REMOVED
+    elif old.version != new.version:
+        kind = VERSION_CHANGED
+    else:
+        kind = BUILD_CHANGED
+    return Change(kind, section, key, old, new)
+
+
+class History(object):
+    """
+    The history at the supplied path, as returned by :func:`history_path`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.packages_path = path + PACKAGES_SUFFIX
+        self.packages_index_path = self.packages_path + INDEX_SUFFIX
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.index_path) // ENTRY.size
+        except OSError:
+            return 0
+
+    @staticmethod
+    def entry(index, snapshot):
+        index.seek(snapshot * ENTRY.size)
+        return ENTRY.unpack(index.read(ENTRY.size))
+
+    def records(self, first, last):
+        """
+        Return the records for the snapshots from ``first`` to ``last``
+        inclusive, which are read in one go.
+        """
+        with open(self.index_path, 'rb') as index:
+            _, start, _ = self.entry(index, first)
+            _, offset, length = self.entry(index, last)
+        with open(self.path, 'rb') as source:
+            source.seek(start)
+            data = source.read(offset + length - start)
+        return [json.loads(line) for line in data.decode('utf-8').splitlines()]
+
+    def check(self, snapshot):
+        if not 0 <= snapshot < len(self):
+            raise ValueError('{} has no snapshot {}'.format(self.path, snapshot))
+
+    def state(self, snapshot):
+        """
+        Return the :class:`~picky.env.Environment` recorded in the
+        supplied snapshot, starting from the checkpoint before it.
+        """
+        self.check(snapshot)
+        records = self.records(snapshot - snapshot % CHECKPOINT_INTERVAL, snapshot)
+        env = decode_environment(records[0]['environment'])
+        for record in records[1:]:
+            apply(env, record)
+        return env
+
+    def time(self, snapshot):
+        self.check(snapshot)
+        with open(self.index_path, 'rb') as index:
+            return self.entry(index, snapshot)[0]
+
+    def times(self):
+        """
+        Return a list of the time of each snapshot.
+        """
+        if not len(self):
+            return []
+        with open(self.index_path, 'rb') as index:
+            data = index.read(len(self) * ENTRY.size)
+        return [time for time, _, _ in ENTRY.iter_unpack(data)]
+
+    def at(self, when):
+        """
+        Return the number of the last snapshot taken at or before the
+        supplied time, or ``None`` if there wasn't one.
+        """
+        low, high = 0, len(self)
+        if not high:
+            return None
+        with open(self.index_path, 'rb') as index:
+            while low < high:
+                middle = (low + high) // 2
+                if self.entry(index, middle)[0] <= when:
+                    low = middle + 1
+                else:
+                    high = middle
+        return low - 1 if low else None
+
+    def record(self, env, when):
+        """
+        Record the supplied environment as a new snapshot taken at the
+        supplied time, returning its number, or ``None`` if it is the
+        same as the latest snapshot.
+        """
+        count = len(self)
+        previous = self.state(count - 1) if count else None
+        found = changes(previous or Environment(channels=[]), env)
+        # changes() ignores names, so a rename on its own is checked for here:
+        if previous is not None and not found and previous['name'] == env.get('name'):
+            return None
+        record = OrderedDict(snapshot=count, time=when)
+        if previous is None or previous['name'] != env.get('name'):
+            record['name'] = env.get('name')
+        if previous is None or any(change.section == 'channels' for change in found):
+            record['channels'] = list(env['channels'])
+        record['changes'] = [
+            [change.section, change.name,
+             encode_spec(change.expected), encode_spec(change.actual)]
+            for change in found if change.section != 'channels'
+        ]
+        if count % CHECKPOINT_INTERVAL == 0:
+            record['environment'] = encode_environment(env)
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        end = 0
+        if count:
+            with open(self.index_path, 'rb') as index:
+                _, offset, length = self.entry(index, count - 1)
+            end = offset + length
+        # anything past the last indexed record or entry was left by an
+        # interrupted write, so it is discarded:
+        with open(self.path, 'ab') as target:
+            target.truncate(end)
+            target.write(line)
+        with open(self.index_path, 'ab') as index:
+            index.truncate(count * ENTRY.size)
+            index.write(ENTRY.pack(when, end, len(line)))
+        self.link(record['changes'], count)
+        return count
+
+    def link(self, changes, snapshot):
+        """
+        Add a line to the packages file for each of the supplied changes,
+        each pointing back to the previous line in its bucket.
+        """
+        mode = 'r+b' if os.path.exists(self.packages_index_path) else 'w+b'
+        with open(self.packages_path, 'ab') as packages, \
+                open(self.packages_index_path, mode) as heads:
+            for section, name, _, _ in changes:
+                number = bucket(name)
+                heads.seek(number * LINK.size)
+                head = heads.read(LINK.size)
+                previous = LINK.unpack(head)[0] if len(head) == LINK.size else 0
+                offset = packages.tell()
+                packages.write('{}\t{}\t{}\t{}\n'.format(
+                    section, name, snapshot, previous
+                ).encode('utf-8'))
+                # the line is written before anything points to it:
+                packages.flush()
+                heads.seek(number * LINK.size)
+                heads.write(LINK.pack(offset + 1))
+
+    def log(self, name, section=None):
+        """
+        Return a list of :class:`Event` objects for each change to the
+        named package, optionally only in the supplied section.
+        """
+        count = len(self)
+        if not count or not os.path.exists(self.packages_index_path):
+            return []
+        with open(self.packages_index_path, 'rb') as heads:
+            heads.seek(bucket(name) * LINK.size)
+            head = heads.read(LINK.size)
+        link = LINK.unpack(head)[0] if len(head) == LINK.size else 0
+        wanted = set()
+        with open(self.packages_path, 'rb') as source:
+            while link:
+                source.seek(link - 1)
+                line = source.readline().decode('utf-8')
+                line_section, line_name, snapshot, link = line.rstrip('\n').split('\t')
+                link = int(link)
+                # lines for snapshots that were never indexed are ignored,
+                # and those repeated after an interrupted write only used once:
+                if line_name == name and section in (None, line_section) and \
+                        int(snapshot) < count:
+                    wanted.add(int(snapshot))
+        events = []
+        with open(self.index_path, 'rb') as index, open(self.path, 'rb') as source:
+            for snapshot in sorted(wanted):
+                time, offset, length = self.entry(index, snapshot)
+                source.seek(offset)
+                record = json.loads(source.read(length).decode('utf-8'))
+                for change_section, key, old, new in record['changes']:
+                    if key == name and section in (None, change_section):
+                        change = decoded_change(change_section, key, old, new)
+                        events.append(Event(snapshot, time, change))
+        return events
@@ -0,0 +1,306 @@
+"""
+An SQLite index of the packages pinned by many concrete specifications,
+so that questions about a whole fleet of environments can be answered
+without parsing every file each time.
+
+Files are only parsed again when their content hash changes, and the
+modification time and size of each file are checked first so that
+unchanged files aren't even read.
+"""
+import os
+import re
+import sqlite3
+from collections import OrderedDict, namedtuple
+from fnmatch import fnmatch
+from hashlib import sha256
+
+from .cache import default_cache_dir
+from .env import SECTIONS, Environment, PackageSpec, split_digest
+from .platforms import PLATFORMS_HEADER, read_all
+
+DEFAULT_PATTERN = '*.lock.yaml'
+DATABASE = 'index.sqlite'
+SKIPPED_DIRECTORIES = {'.git', '.hg', '.svn', '.tox', '__pycache__', 'node_modules'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    hash TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS packages (
+    file INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    platform TEXT NOT NULL,
+    section TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT,
+    build TEXT
+);
+CREATE INDEX IF NOT EXISTS packages_by_name ON packages (name, version, build);
+CREATE INDEX IF NOT EXISTS packages_by_file ON packages (file);
+"""
+
+CONSTRAINT = re.compile(r'\s*(==|!=|<=|>=|<|>|=)?\s*([^\s,<>=!][^\s,]*)\s*$')
+REQUIREMENT = re.compile(r'\s*([A-Za-z0-9_.\-]+)\s*(.*)$')
+VERSION_PART = re.compile(r'\d+|[A-Za-z]+')
+
+Pin = namedtuple('Pin', 'path platform section name version build')
+
+
+def default_database():
+    return os.path.join(default_cache_dir(), DATABASE)
+
+
+def version_parts(version):
+    # numbers sort after letters, so that 1.0rc1 is before 1.0:
+    return [(1, int(part), '') if part.isdigit() else (0, 0, part.lower())
+            for part in VERSION_PART.findall(version)]
+
+
+def compare_versions(left, right):
+    """
+    Return -1, 0 or 1 as the ``left`` version is lower than, the same as,
+    or higher than the ``right`` one.
+    """
+    left, right = version_parts(left), version_parts(right)
+    padding = (1, 0, '')
+    length = max(len(left), len(right))
+    left += [padding] * (length - len(left))
+    right += [padding] * (length - len(right))
+    return (left > right) - (left < right)
+
+
+def parse_requirement(text):
+    """
+    Parse a requirement such as ``numpy``, ``numpy<1.24`` or
+    ``openssl>=1.1,<3`` into the name and a list of
+    ``(operator, version)`` constraints. ``=`` matches the version and
+    any version starting with it, as it does for conda.
+    """
+    match = REQUIREMENT.match(text)
+    if not match:
+        raise ValueError('Invalid requirement: {!r}'.format(text))
+    name, rest = match.groups()
+    constraints = []
+    if rest.strip():
+        for part in rest.split(','):
+            constraint = CONSTRAINT.match(part)
+            if not constraint:
+                raise ValueError('Invalid requirement: {!r}'.format(text))
+            operator, version = constraint.groups()
+            constraints.append((operator or '==', version.rstrip('*').rstrip('.')
+                                if operator == '=' else version))
+    return name, constraints
+
+
+def satisfies(version, constraints):
+    for operator, wanted in constraints:
+        if version is None:
+            return False
+        if operator == '=':
+            if not (version == wanted or version.startswith(wanted + '.')):
+                return False
+            continue
+        if '*' in wanted and operator in ('==', '!='):
+            if fnmatch(version, wanted) != (operator == '=='):
+                return False
+            continue
+        order = compare_versions(version, wanted)
+        if not {
+            '==': order == 0, '!=': order != 0, '<': order < 0,
+            '<=': order <= 0, '>': order > 0, '>=': order >= 0,
+        }[operator]:
+            return False
+    return True
+
+
+def find(roots, pattern=DEFAULT_PATTERN):
+    """
+    Yield the absolute path of every file matching the supplied pattern
+    within the supplied files and directories.
+    """
+    for root in roots:
+        root = os.path.abspath(root)
+        if os.path.isfile(root):
+            yield root
+            continue
+        for directory, directories, names in os.walk(root):
+            directories[:] = sorted(d for d in directories if d not in SKIPPED_DIRECTORIES)
+            for name in sorted(names):
+                if fnmatch(name, pattern):
+                    yield os.path.join(directory, name)
+
+
+def environments(path, text):
+    """
+    Return a mapping of platform name to environment for the concrete
+    specification at the supplied path, with its text. Single-platform
+    files have one environment, under an empty platform name.
+    """
+    if text.startswith(PLATFORMS_HEADER):
+        return read_all(path)
+    return OrderedDict([('', Environment.from_string(split_digest(text)[1]))])
+
+
+def within(path, root):
+    root = os.path.abspath(root)
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+class Index(object):
+    """
+    The index in the SQLite database at the supplied path.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, roots, pattern=DEFAULT_PATTERN):
+        """
+        Bring the index up to date with the concrete specifications
+        within the supplied files and directories, returning the numbers
+        of files that were parsed, unchanged and removed, along with a list
+        of ``(path, exception)`` for files that could not be read or
+        parsed. Those are skipped, leaving whatever the index already had
+        for them, so that one bad file doesn't stop the rest being indexed.
+        """
+        parsed = unchanged = 0
+        skipped = []
+        seen = set()
+        known = {path: (file_id, hash, mtime, size) for file_id, path, hash, mtime, size
+                 in self.connection.execute('SELECT id, path, hash, mtime, size FROM files')}
+        with self.connection:
+            for path in find(roots, pattern):
+                seen.add(path)
+                existing = known.get(path)
+                try:
+                    stat = os.stat(path)
+                    if existing is not None and existing[2:] == (stat.st_mtime, stat.st_size):
+                        unchanged += 1
+                        continue
+                    with open(path, 'rb') as source:
+                        data = source.read()
+                    digest = sha256(data).hexdigest()
+                    if existing is None or existing[1] != digest:
+                        # parsed before anything is written, so a failure leaves no trace:
+                        envs = environments(path, data.decode('utf-8'))
+                except Exception as e:
+                    skipped.append((path, e))
+                    continue
+                if existing is not None and existing[1] == digest:
+                    self.connection.execute('UPDATE files SET mtime = ?, size = ? WHERE id = ?',
+                                            (stat.st_mtime, stat.st_size, existing[0]))
+                    unchanged += 1
+                    continue
+                self.store(path, envs, digest, stat, existing)
+                parsed += 1
+            removed = [
+                file_id for path, (file_id, _, _, _) in known.items()
+                if path not in seen and any(within(path, root) for root in roots)
+            ]
+            self.connection.executemany('DELETE FROM files WHERE id = ?',
+                                        [(file_id,) for file_id in removed])
+        return parsed, unchanged, len(removed), skipped
+
+    def store(self, path, envs, digest, stat, existing):
+        if existing is None:
+            file_id = self.connection.execute(
+                'INSERT INTO files (path, hash, mtime, size) VALUES (?, ?, ?, ?)',
+                (path, digest, stat.st_mtime, stat.st_size)
+            ).lastrowid
+        else:
+            file_id = existing[0]
+            self.connection.execute(
+                'UPDATE files SET hash = ?, mtime = ?, size = ? WHERE id = ?',
+                (digest, stat.st_mtime, stat.st_size, file_id)
+            )
+            self.connection.execute('DELETE FROM packages WHERE file = ?', (file_id,))
+        self.connection.executemany(
+            'INSERT INTO packages (file, platform, section, name, version, build) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(file_id, platform, section, key, spec.version, spec.build)
+             for platform, env in envs.items()
+             for section in SECTIONS
+             for key, spec in env[section].items()]
+        )
+
+    def pins(self, name):
+        """
+        Return a list of :class:`Pin` for every file that pins the
+        named package, ordered by path and platform.
+        """
+        return [Pin(*row) for row in self.connection.execute(
+            'SELECT files.path, platform, section, name, version, build '
+            'FROM packages JOIN files ON packages.file = files.id '
+            'WHERE name = ? ORDER BY files.path, platform, section', (name,)
+        )]
+
+    def query(self, requirement):
+        """
+        Return a list of :class:`Pin` for every file that pins a package
+        meeting the supplied requirement, as parsed by
+        :func:`parse_requirement`.
+        """
+        name, constraints = parse_requirement(requirement)
+        return [pin for pin in self.pins(name) if satisfies(pin.version, constraints)]
+
+    def paths(self):
+        return [path for path, in self.connection.execute(
+            'SELECT path FROM files ORDER BY path'
+        )]
+
+
+def location(pin):
+    return '{} [{}]'.format(pin.path, pin.platform) if pin.platform else pin.path
+
+
+def pinned(pin):
+    """
+    Return the spec a pin is written as in a concrete specification.
+    """
+    if pin.section == 'develop':
+        return str(PackageSpec(' ', '-e', pin.version))
+    return str(PackageSpec('==' if pin.section == 'pip' else '=',
+                           pin.name, pin.version, pin.build))
+
+
+def render_matrix(results):
+    """
+    Return the lines of a table with a row for each file and platform
+    in the supplied mapping of requirement to pins, and a column showing
+    the version of the package for each requirement.
+    """
+    names = [pins[0].name if pins else requirement for requirement, pins in results.items()]
+    rows = OrderedDict()
+    for column, pins in enumerate(results.values()):
+        for pin in pins:
+            rows.setdefault(location(pin), ['-'] * len(names))[column] = pin.version or '?'
+    table = [['environment'] + names] + [[key] + values for key, values in sorted(rows.items())]
+    widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+    return ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+            for row in table]
+
+
+def render_groups(pins):
+    """
+    Return the lines showing the supplied pins grouped by exactly what
+    is pinned, each followed by where it is pinned.
+    """
+    grouped = OrderedDict()
+    for pin in sorted(pins, key=lambda pin: (pin.section, pin.version or '', pin.build or '')):
+        grouped.setdefault(pinned(pin), []).append(location(pin))
+    lines = []
+    for spec, locations in grouped.items():
+        lines.append('{} ({})'.format(spec, len(locations)))
+        lines.extend('  ' + found for found in locations)
+    return lines
@@ -1,26 +1,678 @@
-from argparse import ArgumentParser
+from __future__ import print_function
 
-from .env import Environment, diff, modify
-from .conda import conda_env_export
-from .config import BUILD, parse_config
+import os
+from argparse import ArgumentParser, ArgumentTypeError
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import partial
+from time import time
 
+from .cache import ExportCache, default_cache_dir, fingerprint
+from .client import request, socket_path
+from .env import (
+    SECTIONS, Environment, SpecStore, add_digest, changes, diff_text, modify,
+    split_digest, update_text,
+)
+from .history import History, history_path
+from .conda import conda_env_export, conda_env_stream, conda_meta_environment
+from .config import BACKENDS, BUILD, EXPORT, NATIVE, parse_config
+from .pip import site_packages
+from .platforms import current_platform, is_multi_platform, read_all, read_platform, render
+from .report import FORMATS, REPORTS, TEXT
+from . import sidecar
+from .timing import PROFILE_ENV, STDERR, Timings, profile
 
-def lock(current_env, concrete_path):
+
+def lock(current_env, concrete_path, incremental=False, digest=False,
+         platform=None, write_sidecar=False, write_history=False, write_explicit=False,
+         prefix=None, explicit_env=None):
     """
     Lock the current environment's configuration into a
     concrete configuration file on disk.
+
+    The explicit specification is written from ``explicit_env``, if
+    supplied, which should have nothing ignored, since an environment
+    restored from it gets no other packages.
+    """
+    if platform or is_multi_platform(concrete_path):
+        if digest or write_sidecar:
+            raise ValueError(
+                'Digests and sidecars are not supported for multi-platform '
+                'concrete files such as {}'.format(concrete_path)
+            )
+        return lock_platform(current_env, concrete_path, platform, write_history,
+                             write_explicit, prefix, incremental, explicit_env)
+    existing = text = None
+    if os.path.exists(concrete_path):
+        with open(concrete_path) as source:
+            existing = source.read()
+        # like the sidecar, history and explicit files, a digest is kept
+        # up to date once there is one:
+        recorded, body = split_digest(existing)
+        digest = digest or recorded is not None
+        if incremental:
+            text = update_text(body, current_env)
+    if text is None:
+        text = current_env.to_string()
+    if digest:
+        text = add_digest(text, current_env)
+    if text != existing:
+        with open(concrete_path, 'w') as target:
+            target.write(text)
+    if write_sidecar or os.path.exists(sidecar.sidecar_path(concrete_path)):
+        sidecar.write(concrete_path, current_env, text)
+    record_history(current_env, history_path(concrete_path), write_history)
+    record_explicit(explicit_env or current_env, concrete_path, None, write_explicit, prefix)
+
+
+def record_history(current_env, path, write_history=False):
+    """
+    Add the current environment to the history at the supplied path if
+    asked to or if that history already exists.
+    """
+    if write_history or os.path.exists(path):
+        History(path).record(current_env, time())
+
+
+def record_explicit(current_env, concrete_path, platform=None, write_explicit=False,
+                    prefix=None):
+    """
+    Write the explicit specification of the current environment next to
+    the concrete file if asked to or if one is already there.
+    """
+    from . import explicit
+    if write_explicit or os.path.exists(explicit.explicit_path(concrete_path, platform)):
+        explicit.write(concrete_path, current_env, prefix, platform)
+
+
+def lock_platform(current_env, concrete_path, platform=None, write_history=False,
+                  write_explicit=False, prefix=None, incremental=False, explicit_env=None):
+    """
+    Lock the current environment into the section for the supplied
+    platform, or the current one, of a multi-platform concrete file,
+    leaving the other platforms as they were. If ``incremental`` is true,
+    the file is not written at all when it would not change.
     """
-    with open(concrete_path, 'w') as target:
-        target.write(current_env.to_string())
+    envs = OrderedDict()
+    if is_multi_platform(concrete_path):
+        envs = read_all(concrete_path)
+    platform = platform or current_platform()
+    envs[platform] = current_env
+    # the index records byte offsets, so newlines must not be translated:
+    data = render(envs).encode('utf-8')
+    existing = None
+    if incremental and os.path.exists(concrete_path):
+        with open(concrete_path, 'rb') as source:
+            existing = source.read()
+    if data != existing:
+        with open(concrete_path, 'wb') as target:
+            target.write(data)
+    record_history(current_env, history_path(concrete_path, platform), write_history)
+    record_explicit(explicit_env or current_env, concrete_path, platform, write_explicit,
+                    prefix)
 
 
-def check(current_env, concrete_path):
+def check_result(current_env, concrete_path, format=TEXT, timings=None,
+                 platform=None):
+    """
+    Compare the current environment with a concrete specification,
+    returning a tuple of the return code and the text of the report.
+
+    If the concrete specification has a digest header that matches the
+    current environment, it is not parsed or diffed. Otherwise, if it has
+    an up to date :mod:`~picky.sidecar`, that is used instead of parsing it.
+    If it is a multi-platform file, only the section for the supplied
+    platform, or the current one, is read.
+    """
+    timings = Timings() if timings is None else timings
+    with timings.phase('concrete'):
+        expected_env = read_platform(concrete_path, platform)
+        if expected_env is None:
+            expected_env = read_concrete(current_env, concrete_path)
+    if format == TEXT:
+        with timings.phase('diff'):
+            text = '' if expected_env is None else diff_text(expected_env, current_env)
+        return (1 if text else 0), text
+    with timings.phase('diff'):
+        found = [] if expected_env is None else changes(expected_env, current_env)
+    report = REPORTS[format](concrete_path, expected_env, current_env, found, timings)
+    return (1 if found else 0), report + '\n'
+
+
+def read_concrete(current_env, concrete_path):
+    """
+    Return the environment described by a single-platform concrete
+    specification, or ``None`` if its digest or sidecar shows that it
+    matches the current environment.
+    """
+    with open(concrete_path) as source:
+        full_text = source.read()
+    stored, text = split_digest(full_text)
+    if stored is not None and stored == current_env.digest():
+        return None
+    table = sidecar.load(concrete_path, full_text)
+    if table is not None:
+        try:
+            return None if table.matches(current_env) else table.environment()
+        finally:
+            table.close()
+    expected_env = Environment.from_string(text)
+    if os.path.exists(sidecar.sidecar_path(concrete_path)):
+        # it's stale, so rebuild it for next time:
+        sidecar.write(concrete_path, expected_env, full_text)
+    return expected_env
+
+
+def check(current_env, concrete_path, format=TEXT, timings=None, platform=None):
     """
     Check if a concrete environment specification matches
     that of the currently activated environment.
     """
-    expected_env = Environment.from_path(concrete_path)
-    return diff(expected_env, current_env)
+    rc, text = check_result(current_env, concrete_path, format, timings, platform)
+    if text:
+        print(text, end='')
+    return rc
+
+
+def load_environment(include_build=True, backend=EXPORT, cache=True,
+                     prefix=None, records=None, timeout=None, retries=0, timings=None):
+    """
+    Return the :class:`~picky.env.Environment` of the environment at the
+    supplied prefix, or the currently activated environment, using the
+    named backend. ``records`` is passed to
+    :func:`~picky.conda.conda_meta_environment` by the native backend,
+    while the export backend gives conda ``timeout`` seconds and retries
+    it up to ``retries`` times.
+
+    Reading the environment is timed as the ``export`` phase and, where
+    all of the export is available before it is parsed, parsing it as
+    the ``parse`` phase.
+    """
+    timings = Timings() if timings is None else timings
+    if backend == NATIVE:
+        with timings.phase('export'):
+            return conda_meta_environment(include_build, prefix, records)
+    export_cache = ExportCache() if cache else None
+    if retries:
+        # an export that can be retried is run under asyncio,
+        # so it can't be parsed as it streams:
+        export = partial(conda_env_export, timeout=timeout, retries=retries)
+        with timings.phase('export'):
+            if cache:
+                text = export_cache.export(export, include_build, prefix)
+            else:
+                text = export(include_build, prefix)
+        with timings.phase('parse'):
+            return Environment.from_string(text)
+    stream = partial(conda_env_stream, timeout=timeout)
+    with timings.phase('export'):
+        text = export_cache.cached(include_build, prefix) if cache else None
+        if text is None:
+            # a fresh export is parsed as conda produces it, so this covers both:
+            if cache:
+                return Environment.from_lines(
+                    export_cache.stream(stream, include_build, prefix)
+                )
+            return Environment.from_lines(stream(include_build, prefix))
+    with timings.phase('parse'):
+        return Environment.from_string(text)
+
+
+def load_environments(entries, backend=None, cache=True, timeout=None, retries=0,
+                      jobs=None):
+    """
+    Return a list with a tuple of the config and environment for each
+    manifest entry, or of ``None`` and the exception if that failed.
+
+    Environments that need exporting are all exported under one event
+    loop in the calling thread, with no more than ``jobs`` copies of
+    conda, or one per CPU, running at once.
+    """
+    export_cache = ExportCache() if cache else None
+    results = [None] * len(entries)
+    # (position, config, include_build, prefix, fingerprint) of each export:
+    pending = []
+    for position, entry in enumerate(entries):
+        try:
+            config = parse_config(entry['config'])
+            include_build = config.detail == BUILD
+            prefix = entry['prefix']
+            if (backend or config.backend) == NATIVE:
+                results[position] = config, conda_meta_environment(include_build, prefix)
+                continue
+            print_ = fingerprint(prefix) if cache else None
+            if print_ is not None:
+                cached = export_cache.load(prefix, include_build, print_)
+                if cached is not None:
+                    results[position] = config, Environment.from_string(cached)
+                    continue
+            pending.append((position, config, include_build, prefix, print_))
+        except Exception as e:
+            results[position] = None, e
+    if pending:
+        from .export import export_all
+        outputs = export_all([(include_build, prefix)
+                              for _, _, include_build, prefix, _ in pending],
+                             timeout, retries, jobs or os.cpu_count())
+        for (position, config, include_build, prefix, print_), output in zip(pending, outputs):
+            if isinstance(output, BaseException):
+                results[position] = None, output
+                continue
+            # don't store an export that raced with an install:
+            if print_ is not None and fingerprint(prefix) == print_:
+                export_cache.store(prefix, include_build, print_, output)
+            try:
+                results[position] = config, Environment.from_string(output)
+            except Exception as e:
+                results[position] = None, e
+    return results
+
+
+def current_environment(config, backend=None, cache=True, prefix=None,
+                        timings=None, timeout=None, retries=0):
+    """
+    Return the :class:`~picky.env.Environment` of the environment at the
+    supplied prefix, or the currently activated environment, as obtained
+    from the configured backend.
+    """
+    return load_environment(config.detail == BUILD, backend or config.backend,
+                            cache, prefix, timeout=timeout, retries=retries, timings=timings)
+
+
+def watch_targets(prefix, paths):
+    """
+    Return the ``(directory, names)`` targets for a
+    :mod:`~picky.watch` watcher that cover the packages installed in the
+    supplied prefix and the files at the supplied paths.
+    """
+    targets = OrderedDict()
+    if prefix:
+        targets[os.path.join(prefix, 'conda-meta')] = None
+        for path in site_packages(prefix):
+            targets[path] = None
+    for path in paths:
+        directory, name = os.path.split(os.path.abspath(path))
+        # a directory can only be watched once, so its names are combined:
+        if directory not in targets:
+            targets[directory] = set()
+        if targets[directory] is not None:
+            targets[directory].add(name)
+    return list(targets.items())
+
+
+def watch_check(concrete_path, config_path, backend=None, cache=True, format=TEXT,
+                platform=None, timeout=None, retries=0, interval=1.0, debounce=0.5):
+    """
+    Check the currently activated environment against a concrete
+    specification, then check it again whenever either of them, or the
+    picky configuration, changes until interrupted. Results are only
+    printed when they differ from the previous one.
+    """
+    from .watch import bursts, watcher
+    prefix = os.environ.get('CONDA_PREFIX')
+    watching = watcher(watch_targets(prefix, [concrete_path, config_path]), interval)
+    changed = bursts(watching, debounce)
+    # the native backend only re-reads the conda-meta records that changed,
+    # while the export backend relies on the export cache:
+    records = {}
+    last = None
+    try:
+        while True:
+            try:
+                config = parse_config(config_path)
+                raw_env = load_environment(config.detail == BUILD, backend or config.backend,
+                                           cache, prefix, records, timeout, retries)
+                current_env = modify(raw_env, config.ignore, config.develop)
+                result = check_result(current_env, concrete_path, format, platform=platform)
+            except Exception as e:
+                result = 2, 'Error: {}\n'.format(e)
+            if result != last:
+                rc, text = result
+                status = {0: 'OK', 1: 'does not match'}.get(rc, 'error')
+                print('{}: {}'.format(concrete_path, status))
+                print(text, end='', flush=True)
+                last = result
+            next(changed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watching.close()
+    return last[0] if last else 0
+
+
+def parse_manifest(path):
+    """
+    Parse a manifest listing the environments to work on. Each entry
+    must have a ``prefix`` and may have ``concrete`` and ``config`` paths,
+    which default to the same files as on the command line.
+    Relative paths are relative to the directory containing the manifest.
+    """
+    from .oyaml import safe_load
+    with open(path) as source:
+        data = safe_load(source) or []
+    base = os.path.dirname(os.path.abspath(path))
+    entries = []
+    for item in data:
+        entry = {}
+        for key, default in (('prefix', None),
+                             ('concrete', 'environment.lock.yaml'),
+                             ('config', 'picky.yaml')):
+            value = item.get(key, default)
+            if value is None:
+                raise ValueError('{} has an entry with no {}'.format(path, key))
+            entry[key] = os.path.join(base, os.path.expanduser(value))
+        entries.append(entry)
+    return entries
+
+
+def check_environment(entry, backend=None, cache=True, timeout=None, retries=0):
+    """
+    Check a single manifest entry, returning a tuple of the return code
+    and the text of the report for it.
+    """
+    try:
+        config = parse_config(entry['config'])
+        raw_env = current_environment(config, backend, cache, entry['prefix'],
+                                      timeout=timeout, retries=retries)
+        current_env = modify(raw_env, config.ignore, config.develop)
+        return check_result(current_env, entry['concrete'])
+    except Exception as e:
+        return 2, 'Error: {}\n'.format(e)
+
+
+def check_all(manifest_path, jobs=None, backend=None, cache=True,
+              timeout=None, retries=0):
+    """
+    Check each environment in a manifest against its concrete
+    specification, exporting them concurrently.
+    """
+    entries = parse_manifest(manifest_path)
+    loaded = load_environments(entries, backend, cache, timeout, retries, jobs)
+    results = []
+    for entry, (config, env) in zip(entries, loaded):
+        try:
+            if config is None:
+                raise env
+            current_env = modify(env, config.ignore, config.develop)
+            rc, text = check_result(current_env, entry['concrete'])
+        except Exception as e:
+            rc, text = 2, 'Error: {}\n'.format(e)
+        status = {0: 'OK', 1: 'does not match'}.get(rc, 'error')
+        print('{} ({}): {}'.format(entry['prefix'], entry['concrete'], status))
+        if text:
+            print(text, end='')
+        results.append(rc)
+    failed = len([rc for rc in results if rc])
+    print('{} environments checked, {} failed.'.format(len(results), failed))
+    return max(results or [0])
+
+
+def lock_all(manifest_path, jobs=None, backend=None, cache=True,
+             incremental=False, digest=False, timeout=None, retries=0,
+             write_sidecar=False, write_history=False, write_explicit=False):
+    """
+    Lock each environment in a manifest into its concrete specification,
+    exporting them concurrently and sharing package specs between them.
+    """
+    entries = parse_manifest(manifest_path)
+    store = SpecStore()
+    exported = [(config, env if config is None else store.add(env))
+                for config, env in load_environments(entries, backend, cache, timeout,
+                                                     retries, jobs)]
+    results = []
+    for entry, (config, env) in zip(entries, exported):
+        try:
+            if config is None:
+                raise env
+            current_env = modify(env, config.ignore, config.develop)
+            lock(current_env, entry['concrete'], incremental, digest,
+                 write_sidecar=write_sidecar, write_history=write_history,
+                 write_explicit=write_explicit, prefix=entry['prefix'],
+                 explicit_env=modify(env, develop=config.develop))
+        except Exception as e:
+            status, rc = 'error: {}'.format(e), 2
+        else:
+            status, rc = 'locked', 0
+        print('{} ({}): {}'.format(entry['prefix'], entry['concrete'], status))
+        results.append(rc)
+    failed = len([rc for rc in results if rc])
+    print('{} environments locked, {} failed.'.format(len(results), failed))
+    return max(results or [0])
+
+
+def run_command(args):
+    if getattr(args, 'watch', False):
+        return watch_check(args.concrete, args.config, args.backend, args.cache,
+                           args.format, args.platform, args.timeout, args.retries,
+                           args.interval, args.debounce)
+    # a server's timings would say nothing about where this run's time goes:
+    if not args.profile:
+        response = request(socket_path(args.socket), args.func.__name__,
+                           args.concrete, args.config, backend=args.backend,
+                           cache=args.cache, timeout=args.timeout, retries=args.retries,
+                           format=getattr(args, 'format', TEXT),
+                           incremental=getattr(args, 'incremental', False),
+                           digest=getattr(args, 'digest', False),
+                           platform=args.platform,
+                           sidecar=getattr(args, 'sidecar', False),
+                           history=getattr(args, 'history', False),
+                           explicit=getattr(args, 'explicit', False))
+        if response is not None:
+            print(response['output'], end='')
+            return response['returncode']
+    timings = args.timings
+    with timings.phase('config'):
+        config = parse_config(args.config)
+    raw_env = current_environment(config, args.backend, args.cache, timings=timings,
+                                  timeout=args.timeout, retries=args.retries)
+    with timings.phase('modify'):
+        current_env = modify(raw_env, config.ignore, config.develop)
+    if args.func is check:
+        return check(current_env, args.concrete, args.format, timings, args.platform)
+    with timings.phase('lock'):
+        return lock(current_env, args.concrete, args.incremental, args.digest,
+                    args.platform, args.sidecar, args.history, args.explicit,
+                    explicit_env=modify(raw_env, develop=config.develop))
+
+
+def run_check_all(args):
+    return check_all(args.manifest, args.jobs, args.backend, args.cache,
+                     args.timeout, args.retries)
+
+
+def run_lock_all(args):
+    return lock_all(args.manifest, args.jobs, args.backend, args.cache,
+                    args.incremental, args.digest, args.timeout, args.retries,
+                    args.sidecar, args.history, args.explicit)
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def parse_time(text):
+    parsed = datetime.fromisoformat(text)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def history(concrete_path, platform=None, snapshot=None, at=None, package=None,
+            section=None):
+    """
+    Show the snapshots in the history of a concrete specification, the
+    environment recorded in one of them, or the changes to one package.
+    """
+    if platform is None and is_multi_platform(concrete_path):
+        platform = current_platform()
+    path = history_path(concrete_path, platform)
+    recorded = History(path)
+    if not len(recorded):
+        print('No history found at {}'.format(path))
+        return 1
+    if package:
+        for event in recorded.log(package, section):
+            print('{} #{} {}'.format(format_time(event.time), event.snapshot, event.change))
+        return 0
+    if at is not None:
+        snapshot = recorded.at(parse_time(at))
+        if snapshot is None:
+            print('No snapshot at or before {}'.format(at))
+            return 1
+    if snapshot is not None:
+        print(recorded.state(snapshot).to_string(), end='')
+        return 0
+    for number, timestamp in enumerate(recorded.times()):
+        print('#{} {}'.format(number, format_time(timestamp)))
+    return 0
+
+
+def run_history(args):
+    return history(args.concrete, args.platform, args.snapshot, args.at, args.package,
+                   args.section)
+
+
+def index(roots, database=None, pattern=None):
+    """
+    Build or update an index of the packages pinned by the concrete
+    specifications found in the supplied files and directories.
+    """
+    from .index import DEFAULT_PATTERN, Index, default_database
+    indexed = Index(database or default_database())
+    try:
+        parsed, unchanged, removed, skipped = indexed.update(roots,
+                                                             pattern or DEFAULT_PATTERN)
+    finally:
+        indexed.close()
+    for path, error in skipped:
+        print('{}: error: {}'.format(path, error))
+    print('{} files parsed, {} unchanged, {} removed, {} skipped.'.format(
+        parsed, unchanged, removed, len(skipped)
+    ))
+    return 2 if skipped else 0
+
+
+def query(requirements, database=None, group=False, matrix=False):
+    """
+    Show the concrete specifications in an index that pin packages
+    meeting the supplied requirements, such as numpy<1.24.
+    """
+    from .index import (
+        Index, default_database, location, pinned, render_groups, render_matrix,
+    )
+    indexed = Index(database or default_database())
+    try:
+        results = OrderedDict((requirement, indexed.query(requirement))
+                              for requirement in requirements)
+    finally:
+        indexed.close()
+    if matrix:
+        lines = render_matrix(results)
+    elif group:
+        lines = [line for pins in results.values() for line in render_groups(pins)]
+    else:
+        lines = ['{}: {}'.format(location(pin), pinned(pin))
+                 for pins in results.values() for pin in pins]
+    for line in lines:
+        print(line)
+    return 0 if any(results.values()) else 1
+
+
+def run_index(args):
+    return index(args.roots, args.database, args.pattern)
+
+
+def run_query(args):
+    return query(args.requirements, args.database, args.group, args.matrix)
+
+
+def restore(explicit_path, prefix, pkgs_dir=None, jobs=None):
+    """
+    Create an environment from the explicit specification written by
+    lock --explicit, without solving, fetching packages in parallel.
+    """
+    from .explicit import restore as restore_explicit
+    packages, pip = restore_explicit(explicit_path, prefix,
+                                     pkgs_dir or os.path.join(default_cache_dir(), 'pkgs'),
+                                     jobs)
+    print('{} conda and {} pip packages installed into {}.'.format(packages, pip, prefix))
+    return 0
+
+
+def run_restore(args):
+    from .explicit import explicit_path
+    platform = args.platform
+    if platform is None and is_multi_platform(args.concrete):
+        platform = current_platform()
+    return restore(args.explicit or explicit_path(args.concrete, platform), args.prefix,
+                   args.pkgs_dir, args.jobs)
+
+
+def run_serve(args):
+    from .server import Server
+    path = socket_path(args.socket) or os.path.join(default_cache_dir(), 'picky.sock')
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    server = Server(path, args.interval, args.cache)
+    print('Listening on {}'.format(path))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise ArgumentTypeError('must be at least 1, not {}'.format(value))
+    return value
+
+
+def add_lock_arguments(command_parser):
+    command_parser.add_argument('--incremental', action='store_true',
+                                help=(
+                                    "Only change the lines of an existing "
+                                    "concrete file that need to change, and "
+                                    "don't write it at all if none do."
+                                ))
+    command_parser.add_argument('--digest', action='store_true',
+                                help=(
+                                    "Add a digest of the environment to the "
+                                    "concrete file so that check can skip "
+                                    "parsing and diffing it when it matches."
+                                ))
+    command_parser.add_argument('--sidecar', action='store_true',
+                                help=(
+                                    "Also write a binary copy of the concrete "
+                                    "file, with a .picky suffix, that check can "
+                                    "use instead of parsing it. Once it exists, "
+                                    "it is kept up to date automatically."
+                                ))
+    command_parser.add_argument('--history', action='store_true',
+                                help=(
+                                    "Also record the environment in a history "
+                                    "kept next to the concrete file, with a "
+                                    ".history suffix. Once it exists, every "
+                                    "lock that changes the environment is "
+                                    "recorded automatically."
+                                ))
+    command_parser.add_argument('--explicit', action='store_true',
+                                help=(
+                                    "Also write the URL and hash of every "
+                                    "package file to a .explicit.txt file next "
+                                    "to the concrete file, for picky restore. "
+                                    "Once it exists, it is kept up to date "
+                                    "automatically."
+                                ))
+
+
+def add_database_argument(command_parser):
+    command_parser.add_argument('--database',
+                                help=(
+                                    "SQLite database holding the index. Defaults "
+                                    "to index.sqlite in the cache directory."
+                                ))
 
 
 def parse_args():
@@ -38,18 +690,196 @@ def parse_args():
                             "Optional picky configuration file. "
                             "Defaults to picky.yaml."
                         ))
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help=(
+                            "Always run conda env export rather than using "
+                            "a cached export of an unchanged environment."
+                        ))
+    parser.add_argument('--backend', choices=BACKENDS,
+                        help=(
+                            "How to find out what is installed: 'export' runs "
+                            "conda env export, 'native' reads conda-meta and "
+                            "site-packages directly. Overrides picky.yaml."
+                        ))
+    parser.add_argument('--timeout', type=float,
+                        help=(
+                            "Seconds to give conda env export before killing "
+                            "it and failing. Defaults to waiting forever."
+                        ))
+    parser.add_argument('--retries', type=int, default=0,
+                        help=(
+                            "Number of times to retry conda env export if "
+                            "it fails or times out. Defaults to 0."
+                        ))
+    parser.add_argument('--socket',
+                        help=(
+                            "Unix socket of a picky server to send lock and "
+                            "check requests to. Defaults to $PICKY_SOCKET."
+                        ))
+    parser.add_argument('--profile', action='store_const', const=STDERR,
+                        default=os.environ.get(PROFILE_ENV) or None,
+                        help=(
+                            "Report the time spent in each phase, including "
+                            "the CPU time used by conda, to stderr."
+                        ))
+    parser.add_argument('--profile-output', dest='profile', metavar='PATH',
+                        help=(
+                            "Report the time spent in each phase to PATH instead. "
+                            "A PATH ending in .json gets a Chrome trace and one "
+                            "ending in .prof or .pstats a cProfile dump. "
+                            "Defaults to $PICKY_PROFILE, where - means stderr."
+                        ))
     commands = parser.add_subparsers(title='commands')
     for command in lock, check:
         command_parser = commands.add_parser(command.__name__, help=command.__doc__)
-        command_parser.set_defaults(func=command)
+        command_parser.set_defaults(func=command, handler=run_command)
+        command_parser.add_argument('--platform',
+                                    help=(
+                                        "Platform, such as linux-64, whose section "
+                                        "of a multi-platform concrete file to use. "
+                                        "Defaults to the current platform."
+                                    ))
+        if command is lock:
+            add_lock_arguments(command_parser)
+        if command is check:
+            command_parser.add_argument('--format', choices=FORMATS, default=TEXT,
+                                        help=(
+                                            "Output format for the result of the "
+                                            "check. json and junit include timings "
+                                            "for each phase."
+                                        ))
+            command_parser.add_argument('--watch', action='store_true',
+                                        help=(
+                                            "Keep running and check again "
+                                            "whenever the environment, the "
+                                            "concrete file or picky.yaml changes."
+                                        ))
+            command_parser.add_argument('--debounce', type=float, default=0.5,
+                                        help=(
+                                            "Seconds without further changes to "
+                                            "wait for before checking again when "
+                                            "watching. Defaults to 0.5."
+                                        ))
+            command_parser.add_argument('--interval', type=float, default=1.0,
+                                        help=(
+                                            "Seconds between looks for changes "
+                                            "when watching on systems without "
+                                            "inotify. Defaults to 1."
+                                        ))
+    command_parser = commands.add_parser('check-all', help=check_all.__doc__)
+    command_parser.add_argument('manifest',
+                                help="Manifest listing the environments to check.")
+    command_parser.add_argument('-j', '--jobs', type=positive_int,
+                                help=(
+                                    "Number of environments to export at once. "
+                                    "Defaults to the number of CPUs."
+                                ))
+    command_parser.set_defaults(handler=run_check_all)
+    command_parser = commands.add_parser('lock-all', help=lock_all.__doc__)
+    command_parser.add_argument('manifest',
+                                help="Manifest listing the environments to lock.")
+    command_parser.add_argument('-j', '--jobs', type=positive_int,
+                                help=(
+                                    "Number of environments to export at once. "
+                                    "Defaults to the number of CPUs."
+                                ))
+    add_lock_arguments(command_parser)
+    command_parser.set_defaults(handler=run_lock_all)
+    command_parser = commands.add_parser('history', help=history.__doc__)
+    command_parser.add_argument('--platform',
+                                help=(
+                                    "Platform whose history to show for a "
+                                    "multi-platform concrete file. Defaults "
+                                    "to the current platform."
+                                ))
+    command_parser.add_argument('--snapshot', type=int,
+                                help="Show the environment recorded in this snapshot.")
+    command_parser.add_argument('--at', metavar='TIME',
+                                help=(
+                                    "Show the environment as it was at this "
+                                    "ISO 8601 time, taken to be UTC if no "
+                                    "offset is given."
+                                ))
+    command_parser.add_argument('--package',
+                                help="Show each change made to this package.")
+    command_parser.add_argument('--section', choices=SECTIONS,
+                                help="Only show changes to --package in this section.")
+    command_parser.set_defaults(handler=run_history)
+    command_parser = commands.add_parser('index', help=index.__doc__)
+    command_parser.add_argument('roots', nargs='*', default=['.'], metavar='PATH',
+                                help=(
+                                    "Concrete files, or directories to search "
+                                    "for them. Defaults to the current directory."
+                                ))
+    command_parser.add_argument('--pattern',
+                                help=(
+                                    "Names of the concrete files to look for in "
+                                    "directories. Defaults to *.lock.yaml."
+                                ))
+    add_database_argument(command_parser)
+    command_parser.set_defaults(handler=run_index)
+    command_parser = commands.add_parser('query', help=query.__doc__)
+    command_parser.add_argument('requirements', nargs='+', metavar='REQUIREMENT',
+                                help=(
+                                    "A package name, optionally with constraints "
+                                    "such as numpy<1.24 or openssl>=1.1,<3."
+                                ))
+    output = command_parser.add_mutually_exclusive_group()
+    output.add_argument('--group', action='store_true',
+                        help=(
+                            "Group the matching files by the exact version and "
+                            "build of each package they pin."
+                        ))
+    output.add_argument('--matrix', action='store_true',
+                        help=(
+                            "Show a table of the version of each package "
+                            "pinned by each matching file."
+                        ))
+    add_database_argument(command_parser)
+    command_parser.set_defaults(handler=run_query)
+    command_parser = commands.add_parser('restore', help=restore.__doc__)
+    command_parser.add_argument('--explicit', metavar='PATH',
+                                help=(
+                                    "Explicit specification to restore from. "
+                                    "Defaults to the one next to the concrete file."
+                                ))
+    command_parser.add_argument('--platform',
+                                help=(
+                                    "Platform whose explicit specification to "
+                                    "restore from for a multi-platform concrete "
+                                    "file. Defaults to the current platform."
+                                ))
+    command_parser.add_argument('--prefix', required=True,
+                                help="Where to create the environment.")
+    command_parser.add_argument('--pkgs-dir',
+                                help=(
+                                    "Package cache to fetch packages into and "
+                                    "install them from. Defaults to pkgs in the "
+                                    "cache directory."
+                                ))
+    command_parser.add_argument('-j', '--jobs', type=positive_int,
+                                help=(
+                                    "Number of packages to fetch at once. "
+                                    "Defaults to the number of packages, up to 32."
+                                ))
+    command_parser.set_defaults(handler=run_restore)
+    command_parser = commands.add_parser(
+        'serve', help="Answer lock and check requests from a long-running process."
+    )
+    command_parser.add_argument('--interval', type=float, default=2.0,
+                                help=(
+                                    "Seconds between checks for changes to the "
+                                    "environments being served. Defaults to 2."
+                                ))
+    command_parser.set_defaults(handler=run_serve)
     args = parser.parse_args()
     return args
 
 
 def main():
     args = parse_args()
-    config = parse_config(args.config)
-    export = conda_env_export(config.detail == BUILD)
-    raw_env = Environment.from_string(export)
-    current_env = modify(raw_env, config.ignore, config.develop)
-    return args.func(current_env, args.concrete)
+    args.timings = Timings()
+    if not args.profile:
+        return args.handler(args)
+    with profile(args.profile, args.timings):
+        return args.handler(args)
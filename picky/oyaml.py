@@ -40,13 +40,26 @@ def map_constructor(loader, node):
     return OrderedDict(loader.construct_pairs(node))
 
 
+# Use libyaml's C loader and dumper for the safe functions when PyYAML
+# was built with it, falling back to the pure-Python ones when it wasn't:
+try:
+    from yaml import CSafeLoader as FastSafeLoader, CSafeDumper as FastSafeDumper
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader as FastSafeLoader, SafeDumper as FastSafeDumper
+
+
 pyyaml.add_representer(dict, map_representer)
 pyyaml.add_representer(OrderedDict, map_representer)
 pyyaml.add_representer(OrderedDict, map_representer, Dumper=pyyaml.dumper.SafeDumper)
+pyyaml.add_representer(OrderedDict, map_representer, Dumper=FastSafeDumper)
 
 
 if sys.version_info < (3, 7):
     pyyaml.add_constructor('tag:yaml.org,2002:map', map_constructor)
+    pyyaml.add_constructor('tag:yaml.org,2002:map', map_constructor,
+                           Loader=pyyaml.loader.SafeLoader)
+    pyyaml.add_constructor('tag:yaml.org,2002:map', map_constructor,
+                           Loader=FastSafeLoader)
 
 
 del map_constructor, map_representer
@@ -56,3 +69,19 @@ del map_constructor, map_representer
 # This allows users a drop-in replacement:
 #   import oyaml as yaml
 from yaml import *
+
+
+def safe_load(stream):
+    """
+    Parse the first YAML document in a stream using the fastest
+    safe loader available.
+    """
+    return load(stream, Loader=FastSafeLoader)
+
+
+def safe_dump(data, stream=None, **kwds):
+    """
+    Serialize a Python object into a YAML stream using the fastest
+    safe dumper available.
+    """
+    return dump_all([data], stream, Dumper=FastSafeDumper, **kwds)
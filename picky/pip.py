@@ -0,0 +1,166 @@
+"""
+Read the ``pip`` and ``develop`` sections of an environment straight from
+the package metadata in its site-packages directories, rather than having
+conda ask pip for them.
+"""
+import json
+import os
+from collections import OrderedDict
+
+from .env import PackageSpec
+
+METADATA_SUFFIXES = '.dist-info', '.egg-info'
+
+
+def site_packages(prefix):
+    """
+    Return the site-packages directories found in the supplied prefix.
+    """
+    paths = []
+    lib = os.path.join(prefix, 'lib')
+    if os.path.isdir(lib):
+        for name in sorted(os.listdir(lib)):
+            if name.startswith('python'):
+                path = os.path.join(lib, name, 'site-packages')
+                if os.path.isdir(path):
+                    paths.append(path)
+    path = os.path.join(prefix, 'Lib', 'site-packages')
+    if os.path.isdir(path):
+        paths.append(path)
+    return paths
+
+
+def normalize_name(name):
+    return name.replace('.', '-').replace('_', '-').lower()
+
+
+def metadata_version(path, default):
+    """
+    Return the version from the metadata headers found at the supplied
+    path, which may be a metadata file or a directory containing one.
+    """
+    if os.path.isdir(path):
+        for name in 'METADATA', 'PKG-INFO':
+            candidate = os.path.join(path, name)
+            if os.path.isfile(candidate):
+                path = candidate
+                break
+        else:
+            return default
+    with open(path, encoding='utf-8') as source:
+        for line in source:
+            if line.startswith('Version:'):
+                return line.split(':', 1)[1].strip()
+            if not line.strip():
+                break
+    return default
+
+
+def editable_location(path):
+    """
+    Return the local source directory recorded in the ``direct_url.json``
+    of the supplied ``.dist-info`` directory if it was installed in
+    editable mode, otherwise ``None``.
+    """
+    # urllib.request imports http.client, email and ssl, which picky
+    # shouldn't pay for at startup:
+    from urllib.parse import urlparse
+    from urllib.request import url2pathname
+    try:
+        with open(os.path.join(path, 'direct_url.json')) as source:
+            data = json.load(source)
+    except (IOError, OSError, ValueError):
+        return None
+    if not (data.get('dir_info') or {}).get('editable'):
+        return None
+    url = urlparse(data.get('url') or '')
+    if url.scheme != 'file':
+        return None
+    return url2pathname(url.path)
+
+
+def archive_hash(path):
+    """
+    Return the hash, such as ``sha256:...``, of the archive that the
+    supplied ``.dist-info`` directory was installed from, as recorded in
+    its ``direct_url.json``, or ``None`` if that wasn't recorded.
+    """
+    try:
+        with open(os.path.join(path, 'direct_url.json')) as source:
+            data = json.load(source)
+    except (IOError, OSError, ValueError):
+        return None
+    info = data.get('archive_info') or {}
+    hashes = info.get('hashes') or {}
+    for name in 'sha256', 'sha384', 'sha512':
+        if name in hashes:
+            return '{}:{}'.format(name, hashes[name])
+    if info.get('hash'):
+        return info['hash'].replace('=', ':', 1)
+    return None
+
+
+def pip_hashes(prefix):
+    """
+    Return a mapping of normalized package name to archive hash for each
+    package in the supplied prefix that has one recorded.
+    """
+    hashes = {}
+    for directory in site_packages(prefix):
+        for entry in os.listdir(directory):
+            if entry.endswith('.dist-info'):
+                found = archive_hash(os.path.join(directory, entry))
+                if found:
+                    name = entry[:-len('.dist-info')].partition('-')[0]
+                    hashes[normalize_name(name)] = found
+    return hashes
+
+
+def conda_owned(records):
+    """
+    Return the names of the metadata directories installed by the
+    supplied conda package records.
+    """
+    owned = set()
+    for record in records:
+        for path in record.get('files', ()):
+            if '-info' in path:
+                for part in path.split('/'):
+                    if part.endswith(METADATA_SUFFIXES):
+                        owned.add(part)
+    return owned
+
+
+def pip_packages(prefix, records):
+    """
+    Return the ``pip`` and ``develop`` sections for the supplied prefix,
+    ignoring anything that was installed by conda. Editable installs are
+    found from both ``.egg-link`` files and the ``direct_url.json`` of
+    ``.dist-info`` directories.
+    """
+    owned = conda_owned(records)
+    pip = OrderedDict()
+    develop = OrderedDict()
+    for directory in site_packages(prefix):
+        for entry in sorted(os.listdir(directory)):
+            path = os.path.join(directory, entry)
+            if entry.endswith(METADATA_SUFFIXES):
+                if entry in owned:
+                    continue
+                source_path = editable_location(path)
+                if source_path is not None:
+                    develop[source_path] = PackageSpec(' ', '-e', source_path)
+                    continue
+                name, _, version = entry.rsplit('.', 1)[0].partition('-')
+                name = normalize_name(name)
+                if name in pip:
+                    continue
+                version = version.split('-')[0]
+                version = metadata_version(path, version)
+                pip[name] = PackageSpec('==', name, version)
+            elif entry.endswith('.egg-link'):
+                with open(path) as source:
+                    source_path = source.readline().strip()
+                develop[source_path] = PackageSpec(' ', '-e', source_path)
+    pip = OrderedDict(sorted(pip.items()))
+    return pip, develop
@@ -0,0 +1,180 @@
+"""
+Lock files holding the environments for several platforms.
+
+The entries shared by every platform are written once, followed by a
+document for each platform containing only what differs. The first line
+is an index of where each document starts and how long it is, in bytes,
+so that only the shared document and that of the current platform need
+to be read::
+
+  # picky-platforms: shared=0000000123+0000000456 linux-64=0000000579+0000000089
+  name: service
+  channels:
+  ...
+  ---
+  # platform: linux-64
+  channels: []
+  dependencies:
+  ...
+"""
+import os
+import sys
+from collections import OrderedDict
+
+from .env import SECTIONS, Environment
+
+PLATFORMS_HEADER = '# picky-platforms: '
+SHARED = 'shared'
+SEPARATOR = '---\n'
+# offsets and lengths are zero-padded so the index's own length is known:
+WIDTH = 10
+
+SYSTEMS = {'linux': 'linux', 'darwin': 'osx', 'win32': 'win'}
+MACHINES = {'x86_64': '64', 'amd64': '64', 'i386': '32', 'i686': '32'}
+
+
+def current_platform():
+    """
+    Return the conda subdir, such as ``linux-64``, for the machine picky
+    is running on, or the one in ``CONDA_SUBDIR`` if that is set.
+    """
+    subdir = os.environ.get('CONDA_SUBDIR')
+    if subdir:
+        return subdir
+    from platform import machine
+    system = SYSTEMS.get(sys.platform, sys.platform)
+    arch = machine().lower()
+    if system == 'linux' and arch == 'arm64':
+        arch = 'aarch64'
+    return '{}-{}'.format(system, MACHINES.get(arch, arch))
+
+
+def split(envs):
+    """
+    Split a mapping of platform name to :class:`~picky.env.Environment`
+    into the environment shared by all of them and a mapping of platform
+    name to the environment containing only what is specific to it.
+    """
+    first = next(iter(envs.values()))
+    shared = Environment(name=first.get('name'), channels=[
+        channel for channel in first['channels']
+        if all(channel in env['channels'] for env in envs.values())
+    ])
+    for section in SECTIONS:
+        shared[section] = OrderedDict(
+            (key, spec) for key, spec in first[section].items()
+            if all(env[section].get(key) == spec for env in envs.values())
+        )
+    specific = OrderedDict()
+    for name, env in envs.items():
+        specific[name] = Environment(name=None, channels=[
+            channel for channel in env['channels'] if channel not in shared['channels']
+        ])
+        for section in SECTIONS:
+            specific[name][section] = OrderedDict(
+                (key, spec) for key, spec in env[section].items()
+                if key not in shared[section]
+            )
+    return shared, specific
+
+
+def merge(shared, specific):
+    """
+    Return the full environment for a platform from the shared
+    environment and the one specific to that platform.
+    """
+    env = shared.copy()
+    for channel in specific['channels']:
+        if channel not in env['channels']:
+            env['channels'].append(channel)
+    for section in SECTIONS:
+        env[section].update(specific[section])
+    return env
+
+
+def render(envs):
+    """
+    Serialize a mapping of platform name to
+    :class:`~picky.env.Environment` as a multi-platform lock file.
+    """
+    shared, specific = split(envs)
+    parts = [(SHARED, b'', shared.to_string().encode('utf-8'))]
+    for name in sorted(specific):
+        parts.append((name,
+                      (SEPARATOR + '# platform: {}\n'.format(name)).encode('utf-8'),
+                      specific[name].to_string().encode('utf-8')))
+    entry = '{}={:0%d}+{:0%d}' % (WIDTH, WIDTH)
+    offset = len(PLATFORMS_HEADER) + sum(
+        len(entry.format(name, 0, 0)) + 1 for name, _, _ in parts
+    )
+    index = []
+    for name, prelude, document in parts:
+        offset += len(prelude)
+        index.append(entry.format(name, offset, len(document)))
+        offset += len(document)
+    header = PLATFORMS_HEADER + ' '.join(index) + '\n'
+    return header + b''.join(
+        prelude + document for _, prelude, document in parts
+    ).decode('utf-8')
+
+
+def read_index(source):
+    """
+    Return the index from the first line of the supplied binary file as
+    a mapping of document name to ``(offset, length)``, or ``None`` if it
+    is not a multi-platform lock file.
+    """
+    line = source.readline().decode('utf-8')
+    if not line.startswith(PLATFORMS_HEADER):
+        return None
+    index = OrderedDict()
+    for entry in line[len(PLATFORMS_HEADER):].split():
+        name, _, location = entry.partition('=')
+        offset, _, length = location.partition('+')
+        index[name] = int(offset), int(length)
+    return index
+
+
+def read_document(source, index, name):
+    offset, length = index[name]
+    source.seek(offset)
+    return Environment.from_string(source.read(length))
+
+
+def is_multi_platform(path):
+    if not os.path.exists(path):
+        return False
+    with open(path, 'rb') as source:
+        return read_index(source) is not None
+
+
+def read_platform(path, platform=None):
+    """
+    Return the environment for the supplied platform, or the current one,
+    from the multi-platform lock file at the supplied path, reading only
+    the parts of the file needed for it. ``None`` is returned if the file
+    is not a multi-platform lock file.
+    """
+    with open(path, 'rb') as source:
+        index = read_index(source)
+        if index is None:
+            return None
+        platform = platform or current_platform()
+        if platform not in index:
+            raise ValueError('{} has no environment for {}'.format(path, platform))
+        return merge(read_document(source, index, SHARED),
+                     read_document(source, index, platform))
+
+
+def read_all(path):
+    """
+    Return a mapping of platform name to environment for every platform
+    in the multi-platform lock file at the supplied path.
+    """
+    with open(path, 'rb') as source:
+        index = read_index(source)
+        shared = read_document(source, index, SHARED)
+        return OrderedDict(
+            (name, merge(shared, read_document(source, index, name)))
+            for name in index if name != SHARED
+        )
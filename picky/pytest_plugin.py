@@ -0,0 +1,136 @@
+"""
+A pytest plugin that checks the currently activated environment against
+its concrete specification once per test session, stopping the session
+before the first test runs if they don't match.
+
+With pytest-xdist, the result is shared with every worker through a
+file in the session's temporary directory, guarded by a file lock, so
+that ``conda env export`` only runs once however many workers there are.
+"""
+import json
+import os
+from contextlib import contextmanager
+from hashlib import sha256
+
+import pytest
+
+RESULT_PREFIX = 'picky-'
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('picky')
+    group.addoption('--picky', action='store_true', default=None,
+                    help="Check the environment against its concrete specification "
+                         "before running any tests.")
+    group.addoption('--picky-concrete',
+                    help="Location of the concrete specification, relative to the "
+                         "rootdir. Defaults to environment.lock.yaml.")
+    group.addoption('--picky-config',
+                    help="Location of the picky configuration file, relative to the "
+                         "rootdir. Defaults to picky.yaml.")
+    parser.addini('picky', type='bool', default=False,
+                  help="Check the environment as if --picky was passed.")
+    parser.addini('picky_concrete', default='environment.lock.yaml',
+                  help="Location of the concrete specification.")
+    parser.addini('picky_config', default='picky.yaml',
+                  help="Location of the picky configuration file.")
+
+
+def setting(config, name):
+    value = config.getoption(name)
+    if value is None:
+        value = config.getini(name)
+    return value
+
+
+@contextmanager
+def locked(path):
+    """
+    Hold an exclusive lock on the file at the supplied path.
+    """
+    with open(path, 'a+') as handle:
+        try:
+            import fcntl
+        except ImportError:  # pragma: no cover - Windows
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+def session_directory(config, tmp_path_factory):
+    """
+    Return the temporary directory shared by the whole session, which
+    for an xdist worker is the parent of its own temporary directory.
+    """
+    basetemp = tmp_path_factory.getbasetemp()
+    if hasattr(config, 'workerinput'):
+        return str(basetemp.parent)
+    return str(basetemp)
+
+
+def shared_result(directory, entry):
+    """
+    Return the result of :func:`~picky.main.check_environment` for the
+    supplied entry, only running the check if no other process in the
+    session already has.
+    """
+    # imported here so that pytest runs that don't use picky don't pay for it:
+    from .main import check_environment
+    key = sha256(json.dumps(entry, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    path = os.path.join(directory, RESULT_PREFIX + key + '.json')
+    with locked(path + '.lock'):
+        if os.path.exists(path):
+            with open(path) as source:
+                data = json.load(source)
+            return data['returncode'], data['output']
+        rc, text = check_environment(entry)
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'w') as target:
+            json.dump({'returncode': rc, 'output': text}, target)
+        os.replace(temp, path)
+        return rc, text
+
+
+@pytest.fixture(scope='session', autouse=True)
+def picky_environment(request, tmp_path_factory):
+    """
+    Check the environment, if asked to, when the first test is set up.
+    """
+    config = request.config
+    if not setting(config, 'picky'):
+        return
+    rootdir = str(config.rootpath)
+    concrete = setting(config, 'picky_concrete')
+    entry = {
+        'prefix': os.environ.get('CONDA_PREFIX'),
+        'concrete': os.path.join(rootdir, concrete),
+        'config': os.path.join(rootdir, setting(config, 'picky_config')),
+    }
+    rc, text = shared_result(session_directory(config, tmp_path_factory), entry)
+    config._picky_result = concrete, rc
+    if rc == 1:
+        message = 'Environment does not match {}:\n{}'
+        returncode = pytest.ExitCode.TESTS_FAILED
+    elif rc:
+        message = 'Could not check environment against {}:\n{}'
+        returncode = pytest.ExitCode.INTERNAL_ERROR
+    else:
+        return
+    pytest.exit(message.format(concrete, text.rstrip()), returncode=returncode)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    result = getattr(config, '_picky_result', None)
+    if result is not None:
+        terminalreporter.write_line('picky: environment matches {}'.format(result[0]))
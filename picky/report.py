@@ -0,0 +1,63 @@
+import json
+
+from .env import render_unified
+
+TEXT = 'text'
+JSON = 'json'
+JUNIT = 'junit'
+FORMATS = TEXT, JSON, JUNIT
+
+
+def change_data(change):
+    data = change._asdict()
+    for key in 'expected', 'actual':
+        if data[key] is not None:
+            data[key] = str(data[key])
+    return data
+
+
+def json_report(concrete_path, expected, actual, changes, timings):
+    """
+    Render the result of a check as a JSON document.
+    """
+    return json.dumps({
+        'concrete': concrete_path,
+        'matches': not changes,
+        'returncode': 1 if changes else 0,
+        'changes': [change_data(change) for change in changes],
+        'timings': timings,
+    }, indent=2)
+
+
+def junit_report(concrete_path, expected, actual, changes, timings):
+    """
+    Render the result of a check as a JUnit XML document containing a
+    single test case, which fails if there are any changes.
+    """
+    from xml.etree import ElementTree
+    total = '{:.6f}'.format(sum(timings.values()))
+    suite = ElementTree.Element('testsuite', {
+        'name': 'picky', 'tests': '1', 'failures': '1' if changes else '0',
+        'errors': '0', 'time': total,
+    })
+    properties = ElementTree.SubElement(suite, 'properties')
+    for phase, seconds in timings.items():
+        ElementTree.SubElement(properties, 'property', {
+            'name': 'time.' + phase, 'value': '{:.6f}'.format(seconds),
+        })
+    case = ElementTree.SubElement(suite, 'testcase', {
+        'classname': 'picky.check', 'name': concrete_path, 'time': total,
+    })
+    if changes:
+        failure = ElementTree.SubElement(case, 'failure', {
+            'message': 'Expected environment does not match actual: '
+                       '{} changes'.format(len(changes)),
+        })
+        failure.text = render_unified(expected, actual)
+    return ElementTree.tostring(suite).decode('utf-8')
+
+
+REPORTS = {
+    JSON: json_report,
+    JUNIT: junit_report,
+}
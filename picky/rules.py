@@ -0,0 +1,114 @@
+"""
+Rules matching package names, as used for ``ignore`` and ``develop`` in
+``picky.yaml``.
+
+A rule is either an exact name, a glob such as ``r-*`` or a regular
+expression prefixed with ``re:``, which must match the whole name. Rules
+can be scoped to one section by putting them in a mapping such as
+``{conda: '*-cpu'}``; otherwise they apply to both ``conda`` and ``pip``.
+"""
+import re
+from fnmatch import translate
+
+SCOPES = 'conda', 'pip'
+REGEX_PREFIX = 're:'
+GLOB_CHARACTERS = re.compile(r'[*?[]')
+
+# indexes into the parts of a section's matcher:
+NAME, PREFIX, SUFFIX, EXPRESSION, REGEX = range(5)
+
+
+def classify(rule):
+    """
+    Return the kind of the supplied rule and the value used to match it.
+    """
+    if rule.startswith(REGEX_PREFIX):
+        try:
+            return REGEX, re.compile(rule[len(REGEX_PREFIX):]).fullmatch
+        except re.error as e:
+            raise ValueError('Invalid rule {!r}: {}'.format(rule, e))
+    if not GLOB_CHARACTERS.search(rule):
+        return NAME, rule
+    if rule.endswith('*') and not GLOB_CHARACTERS.search(rule[:-1]):
+        return PREFIX, rule[:-1]
+    if rule.startswith('*') and not GLOB_CHARACTERS.search(rule[1:]):
+        return SUFFIX, rule[1:]
+    return EXPRESSION, translate(rule)
+
+
+class Rules(object):
+    """
+    A compiled set of rules. For each section, exact names are kept in a
+    set, globs that only have a ``*`` at the start or end, such as
+    ``jupyterlab-*`` and ``*-cpu``, in sets of suffixes and prefixes keyed
+    by length and other globs in a single regular expression, so that
+    matching takes a few passes over the names whatever the number of
+    globs. ``re:`` rules are compiled separately, as their flags and
+    backreferences would change meaning if they were combined.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = []
+        if isinstance(rules, str):
+            rules = [rules]
+        for rule in rules:
+            if isinstance(rule, dict):
+                for section, scoped in rule.items():
+                    if section not in SCOPES:
+                        raise ValueError('Unknown section for rule: {!r}'.format(section))
+                    if isinstance(scoped, str):
+                        scoped = [scoped]
+                    self.rules.extend((section, str(pattern)) for pattern in scoped)
+            else:
+                self.rules.append((None, str(rule)))
+        kinds = {section: ([], {}, {}, [], []) for section in SCOPES}
+        for scope, rule in self.rules:
+            kind, value = classify(rule)
+            for section in SCOPES if scope is None else (scope,):
+                target = kinds[section][kind]
+                if kind in (PREFIX, SUFFIX):
+                    target.setdefault(len(value), set()).add(value)
+                else:
+                    target.append(value)
+        self.matchers = {}
+        for section, (names, prefixes, suffixes, expressions, regexes) in kinds.items():
+            self.matchers[section] = (
+                set(names),
+                sorted(prefixes.items()),
+                sorted(suffixes.items()),
+                re.compile('|'.join(expressions)).match if expressions else None,
+                regexes,
+            )
+
+    def matching(self, section, names):
+        """
+        Return the set of the supplied names in the supplied section that
+        match any of these rules.
+        """
+        exact, prefixes, suffixes, expression, regexes = self.matchers[section]
+        found = exact.intersection(names)
+        for length, options in prefixes:
+            found.update(name for name in names if name[:length] in options)
+        for length, options in suffixes:
+            found.update(name for name in names
+                         if len(name) >= length and name[-length:] in options)
+        if expression is not None:
+            found.update(filter(expression, names))
+        for regex in regexes:
+            found.update(filter(regex, names))
+        return found
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def __repr__(self):
+        return '<Rules {!r}>'.format(self.rules)
+
+
+def compiled(rules):
+    """
+    Return the supplied rules as :class:`Rules`, compiling them if needed.
+    """
+    if isinstance(rules, Rules):
+        return rules
+    return Rules(rules or ())
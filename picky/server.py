@@ -0,0 +1,127 @@
+"""
+A long-running server that keeps the environments it has been asked about
+in memory, so that ``check`` and ``lock`` can be answered without starting
+conda or re-parsing anything that hasn't changed.
+"""
+from __future__ import print_function
+
+import json
+import os
+import socketserver
+import threading
+from collections import namedtuple
+
+from .cache import fingerprint
+from .config import BUILD, parse_config
+from .env import modify
+from .main import check_result, load_environment, lock
+from .timing import Timings
+
+State = namedtuple('State', 'fingerprint env records')
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            response = self.server.respond(request)
+        except Exception as e:
+            response = {'returncode': 2, 'output': 'Error: {}\n'.format(e)}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Answer requests from :mod:`picky.client` over a Unix socket.
+    Environments are re-read when their :func:`~picky.cache.fingerprint`
+    changes, both when a request arrives and by polling every
+    ``interval`` seconds so that they are ready before they're needed.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, interval=2.0, cache=True):
+        self.path = path
+        self.interval = interval
+        self.cache = cache
+        self.states = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        if os.path.exists(path):
+            os.remove(path)
+        socketserver.UnixStreamServer.__init__(self, path, Handler)
+
+    def key_lock(self, key):
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def environment(self, prefix, include_build, backend, cache=True, timeout=None,
+                    retries=0, timings=None):
+        """
+        Return the unmodified environment at the supplied prefix, only
+        reading it again if it has changed or ``cache`` is false. Exports
+        are timed out, retried and timed as they are by
+        :func:`~picky.main.load_environment`.
+        """
+        timings = Timings() if timings is None else timings
+        key = prefix, include_build, backend
+        with self.key_lock(key):
+            with timings.phase('export'):
+                state = self.states.get(key)
+                print_ = fingerprint(prefix)
+                if (cache and state is not None and print_ is not None and
+                        state.fingerprint == print_):
+                    return state.env
+                records = state.records if state is not None and cache else {}
+            env = load_environment(include_build, backend, self.cache and cache, prefix,
+                                   records, timeout, retries, timings)
+            self.states[key] = State(print_, env, records)
+            return env
+
+    def respond(self, request):
+        timings = Timings()
+        with timings.phase('config'):
+            config = parse_config(request['config'])
+        backend = request.get('backend') or config.backend
+        raw_env = self.environment(request['prefix'], config.detail == BUILD, backend,
+                                   request.get('cache', True), request.get('timeout'),
+                                   request.get('retries', 0), timings)
+        with timings.phase('modify'):
+            current_env = modify(raw_env, config.ignore, config.develop)
+        if request['command'] == 'lock':
+            # the sidecar and history are updated in several steps, so
+            # locks of the same file must not overlap:
+            with self.key_lock(('lock', request['concrete'])):
+                lock(current_env, request['concrete'], request.get('incremental', False),
+                     request.get('digest', False), request.get('platform'),
+                     request.get('sidecar', False), request.get('history', False),
+                     request.get('explicit', False), request['prefix'],
+                     modify(raw_env, develop=config.develop))
+            return {'returncode': None, 'output': ''}
+        rc, text = check_result(current_env, request['concrete'],
+                                request.get('format', 'text'), timings,
+                                platform=request.get('platform'))
+        return {'returncode': rc, 'output': text}
+
+    def watch(self):
+        while not self.stopped.wait(self.interval):
+            for key in list(self.states):
+                try:
+                    self.environment(*key)
+                except Exception:
+                    # the next request for it will report the problem:
+                    pass
+
+    def serve(self):
+        watcher = threading.Thread(target=self.watch)
+        watcher.daemon = True
+        watcher.start()
+        try:
+            self.serve_forever()
+        finally:
+            self.stopped.set()
+            self.server_close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,166 @@
+"""
+A compact binary copy of a concrete specification, kept next to it, that
+:func:`~picky.main.check` can memory-map and compare against instead of
+parsing the YAML.
+
+The file starts with a header containing a magic number, the sha256 of
+the YAML it was made from and the number of entries. A table of
+fixed-size entries follows, sorted by section and key, each holding the
+offset and length of its key, version and build in the UTF-8 string pool
+that makes up the rest of the file. Offsets and lengths are in characters
+so that the pool can be decoded once and sliced.
+"""
+import mmap
+import os
+import struct
+from collections import OrderedDict
+from hashlib import sha256
+
+from .env import SECTIONS, Environment, PackageSpec
+
+SUFFIX = '.picky'
+MAGIC = b'PICKY\x00\x00\x01'
+HEADER = struct.Struct('<8s32sI')
+# section, then offset and length of key, version and build:
+ENTRY = struct.Struct('<B3xIIIIII')
+# the length used for a version or build of None:
+NONE = 0xFFFFFFFF
+
+CHANNELS = 'channels'
+CODES = (CHANNELS,) + SECTIONS
+SEPARATORS = {'conda': '=', 'pip': '=='}
+
+
+def sidecar_path(concrete_path):
+    return concrete_path + SUFFIX
+
+
+def text_hash(text):
+    return sha256(text.encode('utf-8')).digest()
+
+
+def entries(env):
+    """
+    Yield ``(section code, key, version, build)`` for everything in the
+    environment that :func:`~picky.env.changes` compares, in table order.
+    """
+    for channel in sorted(set(env.get('channels') or ())):
+        yield 0, channel, None, None
+    for code, section in enumerate(SECTIONS, 1):
+        specs = env.get(section) or {}
+        for key in sorted(specs):
+            spec = specs[key]
+            yield code, key, spec.version, spec.build
+
+
+def write(concrete_path, env, text):
+    """
+    Write the sidecar for the supplied environment, which is what the
+    supplied text of the concrete specification describes.
+    """
+    table = []
+    pool = []
+    offset = 0
+    for code, key, version, build in entries(env):
+        fields = [code]
+        for value in key, version, build:
+            if value is None:
+                fields.extend((0, NONE))
+                continue
+            pool.append(value)
+            fields.extend((offset, len(value)))
+            offset += len(value)
+        table.append(ENTRY.pack(*fields))
+    path = sidecar_path(concrete_path)
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp, 'wb') as target:
+        target.write(HEADER.pack(MAGIC, text_hash(text), len(table)))
+        target.write(b''.join(table))
+        target.write(''.join(pool).encode('utf-8'))
+    # readers may have the old one mapped, so replace rather than rewrite it:
+    os.replace(temp, path)
+
+
+class Sidecar(object):
+    """
+    A memory-mapped sidecar that has been checked against the text of
+    its concrete specification.
+    """
+
+    def __init__(self, mapped, count):
+        self.mapped = mapped
+        self.count = count
+        self.table = memoryview(mapped)[HEADER.size:HEADER.size + count * ENTRY.size]
+        self.pool = memoryview(mapped)[HEADER.size + count * ENTRY.size:]
+
+    def close(self):
+        self.table.release()
+        self.pool.release()
+        self.mapped.close()
+
+    def rows(self):
+        pool = str(self.pool, 'utf-8')
+        for code, key, key_length, version, version_length, build, build_length \
+                in ENTRY.iter_unpack(self.table):
+            yield (
+                code,
+                pool[key:key + key_length],
+                None if version_length == NONE else pool[version:version + version_length],
+                None if build_length == NONE else pool[build:build + build_length],
+            )
+
+    def matches(self, env):
+        """
+        Return ``True`` if there would be no changes between the
+        environment stored here and the supplied one.
+        """
+        sections = [set(env.get('channels') or ())] + [env.get(s) or {} for s in SECTIONS]
+        if sum(len(section) for section in sections) != self.count:
+            return False
+        for code, key, version, build in self.rows():
+            if code == 0:
+                if key not in sections[0]:
+                    return False
+                continue
+            spec = sections[code].get(key)
+            if spec is None or spec.version != version or spec.build != build:
+                return False
+        return True
+
+    def environment(self):
+        """
+        Return the :class:`~picky.env.Environment` stored here.
+        """
+        env = Environment(name=None, channels=[], conda=OrderedDict(),
+                          pip=OrderedDict(), develop=OrderedDict())
+        for code, key, version, build in self.rows():
+            section = CODES[code]
+            if section == CHANNELS:
+                env['channels'].append(key)
+            elif section == 'develop':
+                env[section][key] = PackageSpec(' ', '-e', version)
+            else:
+                env[section][key] = PackageSpec(SEPARATORS[section], key, version, build)
+        return env
+
+
+def load(concrete_path, text):
+    """
+    Return the :class:`Sidecar` for the concrete specification at the
+    supplied path, or ``None`` if there isn't one or if it was not made
+    from the supplied text of that specification.
+    """
+    try:
+        with open(sidecar_path(concrete_path), 'rb') as source:
+            mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        magic, stored, count = HEADER.unpack_from(mapped)
+    except struct.error:
+        magic = None
+    if (magic != MAGIC or stored != text_hash(text) or
+            len(mapped) < HEADER.size + count * ENTRY.size):
+        mapped.close()
+        return None
+    return Sidecar(mapped, count)
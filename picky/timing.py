@@ -0,0 +1,124 @@
+from __future__ import print_function
+
+import json
+import os
+import sys
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from timeit import default_timer
+
+PROFILE_ENV = 'PICKY_PROFILE'
+STDERR = '-'
+
+Event = namedtuple('Event', 'name start wall cpu child_cpu')
+
+
+def cpu_times():
+    """
+    Return the CPU time, in seconds, used so far by this process and by
+    any of its child processes that have finished. Child times are always
+    zero on Windows.
+    """
+    times = os.times()
+    return times[0] + times[1], times[2] + times[3]
+
+
+class Timings(OrderedDict):
+    """
+    The wall-clock time, in seconds, spent in each phase of a run,
+    in the order the phases started.
+
+    Each phase is also recorded in :attr:`events`, along with when it
+    started relative to the first phase and the CPU time used by this
+    process and by any child processes, such as conda, during it.
+    """
+
+    def __init__(self, *args, **kw):
+        super(Timings, self).__init__(*args, **kw)
+        self.events = []
+        self.origin = None
+
+    @contextmanager
+    def phase(self, name):
+        cpu, child_cpu = cpu_times()
+        start = default_timer()
+        if self.origin is None:
+            self.origin = start
+        try:
+            yield
+        finally:
+            wall = default_timer() - start
+            end_cpu, end_child_cpu = cpu_times()
+            self[name] = self.get(name, 0) + wall
+            self.events.append(Event(
+                name, start - self.origin, wall, end_cpu - cpu, end_child_cpu - child_cpu
+            ))
+
+
+def summary(timings):
+    """
+    Render a table of the time spent in each phase.
+    """
+    totals = OrderedDict()
+    for event in timings.events:
+        total = totals.get(event.name, (0, 0, 0))
+        totals[event.name] = tuple(
+            a + b for a, b in zip(total, (event.wall, event.cpu, event.child_cpu))
+        )
+    lines = ['{:<10} {:>10} {:>10} {:>10}'.format('phase', 'wall', 'cpu', 'child cpu')]
+    for name, times in totals.items():
+        lines.append('{:<10} {:>10.3f} {:>10.3f} {:>10.3f}'.format(name, *times))
+    lines.append('{:<10} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+        'total', *[sum(column) for column in zip(*totals.values())] or (0, 0, 0)
+    ))
+    return '\n'.join(lines) + '\n'
+
+
+def chrome_trace(timings):
+    """
+    Render the phases as a Chrome trace that can be loaded into
+    ``chrome://tracing`` or Perfetto.
+    """
+    pid = os.getpid()
+    events = []
+    for event in timings.events:
+        events.append(OrderedDict((
+            ('name', event.name),
+            ('ph', 'X'),
+            ('ts', event.start * 1e6),
+            ('dur', event.wall * 1e6),
+            ('pid', pid),
+            ('tid', 0),
+            ('args', OrderedDict((('cpu', event.cpu), ('child_cpu', event.child_cpu)))),
+        )))
+    return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}, indent=2)
+
+
+@contextmanager
+def profile(destination, timings):
+    """
+    Report the timings recorded while the block runs. ``destination`` is
+    ``-`` for a summary on stderr, a path ending in ``.json`` for a Chrome
+    trace, a path ending in ``.prof`` or ``.pstats`` for a :mod:`cProfile`
+    dump of the whole run, with a summary on stderr, or any other path to
+    write the summary to that file.
+    """
+    profiler = None
+    if destination.endswith(('.prof', '.pstats')):
+        from cProfile import Profile
+        profiler = Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(destination)
+        if destination == STDERR or profiler is not None:
+            print(summary(timings), end='', file=sys.stderr)
+        elif destination.endswith('.json'):
+            with open(destination, 'w') as target:
+                target.write(chrome_trace(timings) + '\n')
+        else:
+            with open(destination, 'w') as target:
+                target.write(summary(timings))
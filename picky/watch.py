@@ -0,0 +1,172 @@
+"""
+Notice changes to an environment and the files describing it, using
+inotify where the C library provides it and polling everywhere else.
+
+A watcher is given a list of ``(directory, names)`` targets: a change to
+anything in a directory counts if ``names`` is ``None``, otherwise only
+changes to the named files in it do.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from timeit import default_timer
+from time import sleep
+
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+           IN_CREATE | IN_DELETE)
+EVENT = struct.Struct('iIII')
+
+
+class PollingWatcher(object):
+    """
+    Notice changes by comparing the modification times and sizes of the
+    targets every ``interval`` seconds.
+    """
+
+    def __init__(self, targets, interval=1.0):
+        self.targets = [(directory, names) for directory, names in targets
+                        if os.path.isdir(directory)]
+        self.interval = interval
+        self.state = self.snapshot()
+
+    def snapshot(self):
+        state = {}
+        paths = []
+        for directory, names in self.targets:
+            if names is None:
+                paths.append(directory)
+            else:
+                paths.extend(os.path.join(directory, name) for name in names)
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                state[path] = None
+            else:
+                state[path] = stat.st_mtime, stat.st_size
+        return state
+
+    def wait(self, timeout=None):
+        """
+        Return ``True`` as soon as a change is noticed, or ``False`` if
+        there has been none after ``timeout`` seconds.
+        """
+        deadline = None if timeout is None else default_timer() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, deadline - default_timer())
+                if delay <= 0:
+                    return False
+            sleep(delay)
+            state = self.snapshot()
+            if state != self.state:
+                self.state = state
+                return True
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """
+    Notice changes using the Linux inotify API through :mod:`ctypes`.
+    """
+
+    def __init__(self, targets, libc):
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.names = {}
+        for directory, names in targets:
+            if not os.path.isdir(directory):
+                continue
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_MASK)
+            if wd < 0:
+                self.close()
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed', directory)
+            self.names[wd] = None if names is None else set(names)
+
+    def relevant(self, data):
+        offset = 0
+        found = False
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            names = self.names.get(wd)
+            if names is None or name in names:
+                found = True
+        return found
+
+    def wait(self, timeout=None):
+        """
+        Return ``True`` as soon as a change is noticed, or ``False`` if
+        there has been none after ``timeout`` seconds.
+        """
+        deadline = None if timeout is None else default_timer() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - default_timer(), 0)
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                return False
+            if self.relevant(os.read(self.fd, 65536)):
+                return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+def inotify():
+    """
+    Return the C library if it provides inotify, otherwise ``None``.
+    """
+    name = ctypes.util.find_library('c')
+    if not name:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def watcher(targets, interval=1.0):
+    """
+    Return the best available watcher for the supplied targets.
+    """
+    libc = inotify()
+    if libc is not None:
+        try:
+            return InotifyWatcher(targets, libc)
+        except OSError:
+            # for example, when the limit on watches has been reached:
+            pass
+    return PollingWatcher(targets, interval)
+
+
+def bursts(watcher, debounce=0.5):
+    """
+    Yield once for each burst of changes, as soon as there have been no
+    further changes for ``debounce`` seconds.
+    """
+    while True:
+        watcher.wait()
+        while watcher.wait(debounce):
+            pass
+        yield
@@ -15,12 +15,17 @@ setup(
     description=description,
     long_description=description,
     url='https://github.com/Simplistix/picky-conda',
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['tests', 'benchmarks']),
     zip_safe=False,
     include_package_data=True,
+    python_requires='>=3.7',
     install_requires=['PyYAML'],
     entry_points = {
         'console_scripts': [
             'picky = picky.main:main',
-    ]}
+        ],
+        'pytest11': [
+            'picky = picky.pytest_plugin',
+        ],
+    }
 )
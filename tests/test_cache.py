@@ -0,0 +1,156 @@
+import os
+
+from testfixtures import Replacer, compare
+
+from picky.cache import ExportCache, fingerprint
+
+
+class Exporter(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, include_build=True, prefix=None):
+        self.calls.append(include_build)
+        return 'export {}\n'.format(len(self.calls))
+
+
+def make_prefix(tmpdir):
+    prefix = tmpdir.mkdir('env')
+    meta = prefix.mkdir('conda-meta')
+    meta.join('python-3.6.5-0.json').write('{}')
+    meta.join('history').write('==> 2018-10-17 <==\n')
+    prefix.mkdir('lib').mkdir('python3.6').mkdir('site-packages')
+    return prefix
+
+
+def test_fingerprint_not_an_env(tmpdir):
+    compare(fingerprint(str(tmpdir)), expected=None)
+
+
+def test_fingerprint_file_removed_while_reading(tmpdir):
+    prefix = make_prefix(tmpdir)
+    names = os.listdir(str(prefix.join('conda-meta'))) + ['gone-1.0-0.json']
+    with Replacer() as r:
+        r.replace('picky.cache.os.listdir', lambda path: list(names))
+        compare(fingerprint(str(prefix)), expected=None)
+
+
+def test_export_file_removed_while_reading(tmpdir):
+    prefix = make_prefix(tmpdir)
+    exporter = Exporter()
+    cache = ExportCache(str(tmpdir.join('cache')))
+    with Replacer() as r:
+        r.replace('picky.cache.fingerprint', lambda path: None)
+        compare(cache.export(exporter, prefix=str(prefix)), expected='export 1\n')
+        compare(cache.export(exporter, prefix=str(prefix)), expected='export 2\n')
+
+
+def test_fingerprint_stable(tmpdir):
+    prefix = str(make_prefix(tmpdir))
+    compare(fingerprint(prefix), expected=fingerprint(prefix))
+
+
+def test_fingerprint_conda_install(tmpdir):
+    prefix = make_prefix(tmpdir)
+    before = fingerprint(str(prefix))
+    prefix.join('conda-meta', 'six-1.11.0-py36_1.json').write('{}')
+    assert fingerprint(str(prefix)) != before
+
+
+def test_fingerprint_history_grows(tmpdir):
+    prefix = make_prefix(tmpdir)
+    before = fingerprint(str(prefix))
+    history = prefix.join('conda-meta', 'history')
+    mtime = history.mtime()
+    history.write('==> 2018-10-18 <==\n', mode='a')
+    history.setmtime(mtime)
+    assert fingerprint(str(prefix)) != before
+
+
+def test_fingerprint_pip_install(tmpdir):
+    prefix = make_prefix(tmpdir)
+    before = fingerprint(str(prefix))
+    site_packages = prefix.join('lib', 'python3.6', 'site-packages')
+    site_packages.mkdir('attrs-17.4.0.dist-info')
+    site_packages.setmtime(site_packages.mtime() + 10)
+    assert fingerprint(str(prefix)) != before
+
+
+class TestExportCache(object):
+
+    def test_miss_then_hit(self, tmpdir):
+        prefix = str(make_prefix(tmpdir))
+        cache = ExportCache(str(tmpdir.join('cache')))
+        export = Exporter()
+        compare(cache.export(export, prefix=prefix), expected='export 1\n')
+        compare(cache.export(export, prefix=prefix), expected=b'export 1\n')
+        compare(export.calls, expected=[True])
+
+    def test_include_build_is_part_of_key(self, tmpdir):
+        prefix = str(make_prefix(tmpdir))
+        cache = ExportCache(str(tmpdir.join('cache')))
+        export = Exporter()
+        cache.export(export, include_build=True, prefix=prefix)
+        cache.export(export, include_build=False, prefix=prefix)
+        cache.export(export, include_build=False, prefix=prefix)
+        compare(export.calls, expected=[True, False])
+
+    def test_invalidated_by_install(self, tmpdir):
+        prefix = make_prefix(tmpdir)
+        cache = ExportCache(str(tmpdir.join('cache')))
+        export = Exporter()
+        cache.export(export, prefix=str(prefix))
+        prefix.join('conda-meta', 'six-1.11.0-py36_1.json').write('{}')
+        compare(cache.export(export, prefix=str(prefix)), expected='export 2\n')
+        compare(cache.export(export, prefix=str(prefix)), expected=b'export 2\n')
+
+    def test_not_an_env(self, tmpdir):
+        cache = ExportCache(str(tmpdir.join('cache')))
+        export = Exporter()
+        cache.export(export, prefix=str(tmpdir))
+        cache.export(export, prefix=str(tmpdir))
+        compare(export.calls, expected=[True, True])
+        assert not os.path.exists(str(tmpdir.join('cache')))
+
+    def test_unwritable(self, tmpdir):
+        prefix = str(make_prefix(tmpdir))
+        blocker = tmpdir.join('cache')
+        blocker.write('not a directory')
+        cache = ExportCache(str(blocker))
+        export = Exporter()
+        compare(cache.export(export, prefix=prefix), expected='export 1\n')
+        compare(cache.export(export, prefix=prefix), expected='export 2\n')
+
+
+class Streamer(Exporter):
+
+    def __call__(self, include_build=True, prefix=None):
+        for line in Exporter.__call__(self, include_build, prefix).splitlines(True):
+            yield line
+
+
+class TestStream(object):
+
+    def test_miss_then_hit(self, tmpdir):
+        prefix = str(make_prefix(tmpdir))
+        cache = ExportCache(str(tmpdir.join('cache')))
+        stream = Streamer()
+        compare(list(cache.stream(stream, prefix=prefix)), expected=['export 1\n'])
+        compare(list(cache.stream(stream, prefix=prefix)), expected=['export 1\n'])
+        compare(stream.calls, expected=[True])
+
+    def test_not_stored_if_abandoned(self, tmpdir):
+        prefix = str(make_prefix(tmpdir))
+        cache = ExportCache(str(tmpdir.join('cache')))
+        stream = Streamer()
+        lines = cache.stream(stream, prefix=prefix)
+        next(lines)
+        lines.close()
+        compare(list(cache.stream(stream, prefix=prefix)), expected=['export 2\n'])
+
+    def test_not_an_env(self, tmpdir):
+        cache = ExportCache(str(tmpdir.join('cache')))
+        stream = Streamer()
+        compare(list(cache.stream(stream, prefix=str(tmpdir))), expected=['export 1\n'])
+        compare(list(cache.stream(stream, prefix=str(tmpdir))), expected=['export 2\n'])
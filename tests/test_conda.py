@@ -1,10 +1,16 @@
+import json
 import os
+import sys
+from subprocess import CalledProcessError
 
 import pytest
-from testfixtures import compare
+from testfixtures import Replacer, ShouldRaise, compare, not_there
 
-from picky.conda import conda_env_export
+from picky.conda import (
+    canonical_channel, conda_env_export, conda_env_stream, conda_meta_environment
+)
 from picky.env import Environment
+from tests.test_env import sample_env, sample_serialized
 
 
 class TestRunCommand(object):
@@ -26,3 +32,127 @@ class TestRunCommand(object):
     def test_no_build(self):
         env = Environment.from_string(conda_env_export(include_build=False))
         assert env['conda']['python'].build is None
+
+
+def write_record(meta, name, version, build, channel, files=()):
+    meta.join('{}-{}-{}.json'.format(name, version, build)).write(json.dumps({
+        'name': name,
+        'version': version,
+        'build': build,
+        'channel': channel,
+        'subdir': 'osx-64',
+        'files': list(files),
+    }))
+
+
+def make_prefix(prefix):
+    """
+    Populate the supplied directory so it looks like a conda environment
+    containing the packages in :data:`sample_env`.
+    """
+    meta = prefix.mkdir('conda-meta')
+    meta.join('history').write('')
+    write_record(meta, 'ca-certificates', '2018.03.07', '0',
+                 'https://repo.anaconda.com/pkgs/main/osx-64')
+    write_record(meta, 'certifi', '2018.1.18', 'py36_0',
+                 'https://conda.anaconda.org/conda-forge/osx-64',
+                 files=['lib/python3.6/site-packages/certifi-2018.1.18-py3.6.egg-info'])
+    write_record(meta, 'libcxx', '4.0.1', 'h579ed51_0',
+                 'https://conda.anaconda.org/conda-forge/osx-64')
+    site_packages = prefix.mkdir('lib').mkdir('python3.6').mkdir('site-packages')
+    site_packages.join('certifi-2018.1.18-py3.6.egg-info').write('')
+    site_packages.mkdir('alabaster-0.7.10.dist-info').join('METADATA').write(
+        'Metadata-Version: 2.0\nName: alabaster\nVersion: 0.7.10\n\nalabaster\n'
+    )
+    site_packages.mkdir('attrs-17.4.0.dist-info')
+    site_packages.mkdir('urllib3-1.22.dist-info')
+    site_packages.join('package.egg-link').write('.\n.')
+    return str(prefix)
+
+
+class TestCondaMeta(object):
+
+    @pytest.fixture(autouse=True)
+    def isolated(self, tmpdir):
+        with Replacer() as r:
+            r.in_environ('HOME', str(tmpdir))
+            r.in_environ('CONDARC', not_there)
+            r.in_environ('CONDA_ROOT', not_there)
+            r.in_environ('CONDA_PREFIX', not_there)
+            yield
+
+    @pytest.fixture()
+    def prefix(self, tmpdir):
+        return make_prefix(tmpdir.mkdir('package'))
+
+    def test_matches_export(self, prefix):
+        compare(conda_meta_environment(prefix=prefix),
+                strict=True,
+                expected=sample_env)
+
+    def test_no_build(self, prefix):
+        env = conda_meta_environment(include_build=False, prefix=prefix)
+        compare(env.to_string(), expected=Environment.from_string(
+            sample_serialized.replace('=0\n', '\n').replace('=py36_0', '')
+            .replace('=h579ed51_0', '')
+        ).to_string())
+
+    def test_activated(self, prefix):
+        with Replacer() as r:
+            r.in_environ('CONDA_PREFIX', prefix)
+            r.in_environ('CONDA_DEFAULT_ENV', 'myenv')
+            env = conda_meta_environment()
+        compare(env['name'], expected='myenv')
+
+    def test_configured_channels(self, prefix, tmpdir):
+        tmpdir.join('.condarc').write('channels:\n- simplistix\n- defaults\n')
+        env = conda_meta_environment(prefix=prefix)
+        compare(env['channels'], expected=['conda-forge', 'simplistix', 'defaults'])
+
+    def test_channel_not_on_anaconda(self):
+        compare(canonical_channel({
+            'channel': 'https://example.com/conda/linux-64', 'subdir': 'linux-64'
+        }), expected='https://example.com/conda')
+
+    def test_channel_name_only(self):
+        compare(canonical_channel({'channel': 'conda-forge'}),
+                expected='conda-forge')
+
+
+class TestStream(object):
+
+    @pytest.fixture()
+    def conda(self, tmpdir):
+        script = tmpdir.join('conda.py')
+        script.write(
+            'import sys\n'
+            'sys.stdout.write("args: " + " ".join(sys.argv[1:]) + "\\n")\n'
+            'sys.stdout.write("channels:\\n- defaults\\n")\n'
+            'sys.exit(int(sys.argv[-1]) if sys.argv[-1].isdigit() else 0)\n'
+        )
+        wrapper = tmpdir.join('conda')
+        wrapper.write('#!/bin/sh\nexec {} {} "$@"\n'.format(sys.executable, script))
+        wrapper.chmod(0o755)
+        with Replacer() as r:
+            r.in_environ('CONDA_EXE', str(wrapper))
+            yield
+
+    @pytest.mark.skipif(sys.platform == 'win32', reason='needs a shell script')
+    def test_lines(self, conda):
+        compare(list(conda_env_stream(include_build=False, prefix='/some/env')),
+                expected=['args: env export --no-builds --prefix /some/env\n',
+                          'channels:\n', '- defaults\n'])
+
+    @pytest.mark.skipif(sys.platform == 'win32', reason='needs a shell script')
+    def test_failure(self, conda):
+        lines = []
+        with ShouldRaise(CalledProcessError):
+            for line in conda_env_stream(prefix='3'):
+                lines.append(line)
+        compare(len(lines), expected=3)
+
+    @pytest.mark.skipif(sys.platform == 'win32', reason='needs a shell script')
+    def test_abandoned(self, conda):
+        stream = conda_env_stream()
+        compare(next(stream), expected='args: env export\n')
+        stream.close()
@@ -1,13 +1,14 @@
-from testfixtures import compare
+from testfixtures import ShouldRaise, compare
 
-from picky.config import parse_config, VERSION, BUILD
+from picky.config import parse_config, VERSION, BUILD, EXPORT, NATIVE
 
 
 def test_not_present(tmpdir):
     config = parse_config(str(tmpdir.join('picky.yaml')))
-    compare(config.ignore, expected=set(), strict=True)
+    compare(config.ignore.rules, expected=[])
     compare(config.develop, expected={})
     compare(config.detail, expected=BUILD)
+    compare(config.backend, expected=EXPORT)
 
 
 def test_minimal(tmpdir):
@@ -26,6 +27,7 @@ ignore:
 develop:
   mypackage: .
 detail: version
+backend: native
 """
 
 
@@ -33,6 +35,35 @@ def test_maximal(tmpdir):
     p = tmpdir.join('picky.yaml')
     p.write(sample_config)
     config = parse_config(str(p))
-    compare(config.ignore, expected={'appnope'}, strict=True)
+    compare(config.ignore.rules, expected=[(None, 'appnope')])
     compare(config.develop, expected={'mypackage': '.'})
     compare(config.detail, expected=VERSION)
+    compare(config.backend, expected=NATIVE)
+
+
+def test_ignore_rules(tmpdir):
+    p = tmpdir.join('picky.yaml')
+    p.write("""
+ignore:
+  - appnope
+  - r-*
+  - re:jupyterlab(-.+)?
+  - conda: '*-cpu'
+  - pip: [pytest, 'pytest-*']
+""")
+    config = parse_config(str(p))
+    compare(config.ignore.rules, expected=[
+        (None, 'appnope'),
+        (None, 'r-*'),
+        (None, 're:jupyterlab(-.+)?'),
+        ('conda', '*-cpu'),
+        ('pip', 'pytest'),
+        ('pip', 'pytest-*'),
+    ])
+
+
+def test_ignore_unknown_section(tmpdir):
+    p = tmpdir.join('picky.yaml')
+    p.write("ignore:\n  - develop: [foo]\n")
+    with ShouldRaise(ValueError("Unknown section for rule: 'develop'")):
+        parse_config(str(p))
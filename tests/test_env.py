@@ -1,9 +1,19 @@
+import pickle
 from collections import OrderedDict
+from functools import lru_cache
 from textwrap import dedent
 
-from testfixtures import compare, OutputCapture
+import pytest
+from testfixtures import compare, OutputCapture, ShouldRaise, Replacer
+from testfixtures.mock import Mock, call
 
-from picky.env import Environment, PackageSpec, modify, diff
+from picky.oyaml import safe_load
+from picky.rules import Rules
+from picky.env import (
+    LineParser, Environment, update_text, PackageSpec, modify, diff, changes, Change,
+    add_digest, split_digest, SpecStore, unquote, develop_rules,
+    ADDED, REMOVED, VERSION_CHANGED, BUILD_CHANGED, CHANNEL_CHANGED,
+)
 
 sample_serialized = """\
 name: package
@@ -45,6 +55,36 @@ sample_env = Environment({
 })
 
 
+class TestPackageSpec(object):
+
+    def test_immutable(self):
+        spec = PackageSpec('=', 'python', '3.6.5', '0')
+        with ShouldRaise(AttributeError):
+            spec.version = '3.7.0'
+
+    def test_equality_and_hash(self):
+        spec = PackageSpec('=', 'python', '3.6.5', '0')
+        same = PackageSpec('=', 'python', '3.6.5', '0')
+        assert spec == same
+        assert spec != PackageSpec('=', 'python', '3.6.5', '1')
+        assert spec != PackageSpec('==', 'python', '3.6.5', '0')
+        compare(len({spec, same}), expected=1)
+
+    def test_interned(self):
+        name = ''.join(['pyt', 'hon'])
+        assert PackageSpec('=', name).name is PackageSpec('=', 'python').name
+
+    def test_sort(self):
+        specs = [PackageSpec('=', 'b', '1', 'x'), PackageSpec('=', 'a', '2', 'y'),
+                 PackageSpec('=', 'a', '1', 'z')]
+        compare([str(s) for s in sorted(specs)],
+                expected=['a=1=z', 'a=2=y', 'b=1=x'])
+
+    def test_pickle(self):
+        spec = PackageSpec('=', 'python', '3.6.5', '0')
+        compare(pickle.loads(pickle.dumps(spec)), expected=spec, strict=True)
+
+
 class TestEnvironment(object):
 
     def test_from_string(self):
@@ -84,6 +124,91 @@ class TestEnvironment(object):
                 expected=sample_serialized)
 
 
+conda_style_export = """\
+name: package
+channels:
+  - conda-forge
+  - defaults
+dependencies:
+  - ca-certificates=2018.03.07=0
+  - certifi=2018.1.18=py36_0
+  - libcxx=4.0.1=h579ed51_0
+  - pip:
+    - alabaster==0.7.10
+    - attrs==17.4.0
+    - urllib3==1.22
+    - -e .
+prefix: /Users/chris/anaconda2/envs/picky-conda
+
+"""
+
+
+class TestLineParser(object):
+
+    def parse(self, text):
+        parser = LineParser()
+        for line in text.splitlines(True):
+            if not parser.feed(line):
+                return None
+        return parser.environment(Environment)
+
+    @pytest.mark.parametrize('text', [sample_export, sample_serialized,
+                                      conda_style_export])
+    def test_supported(self, text):
+        compare(self.parse(text), strict=True, expected=sample_env)
+
+    def test_empty_lists(self):
+        compare(self.parse('channels: []\ndependencies: []\n'),
+                strict=True,
+                expected=Environment.from_data(safe_load(
+                    'channels: []\ndependencies: []\n'
+                )))
+
+    def test_comment(self):
+        compare(self.parse('# digest\n' + sample_serialized), expected=sample_env)
+
+    @pytest.mark.parametrize('text', [
+        "name: 'quoted'\n",
+        'name: package\nvariables:\n  FOO: bar\n',
+        'channels: [defaults]\n',
+        'channels:\n- 1.0\n',
+        'channels:\n- yes\n',
+        'dependencies:\n- "python=3.6"\n',
+        'dependencies:\n- python=3.6 # comment\n',
+        'dependencies:\n- pip:\n    - attrs==17.4.0\n',
+        'dependencies:\n- pip: [attrs==17.4.0]\n',
+        'dependencies:\n- - python\n',
+        '---\nname: package\n',
+        '  - python\n',
+    ])
+    def test_unsupported(self, text):
+        compare(self.parse(text), expected=None)
+
+    @pytest.mark.parametrize('text', [
+        "name: 'package'\n" + sample_serialized[len('name: package\n'):],
+        sample_serialized.replace('- defaults', '- "defaults"'),
+        sample_serialized.replace('  - -e .', "  - '-e .'"),
+    ])
+    def test_fallback(self, text):
+        with Replacer() as r:
+            calls = []
+
+            def load(text):
+                calls.append(text)
+                return safe_load(text)
+            r.replace('picky.oyaml.safe_load', load)
+            compare(Environment.from_string(text), strict=True, expected=sample_env)
+        compare(calls, expected=[text])
+
+    def test_from_lines_generator(self):
+        compare(Environment.from_lines(line for line in conda_style_export.splitlines(True)),
+                strict=True, expected=sample_env)
+
+    def test_from_bytes(self):
+        compare(Environment.from_string(sample_export.encode('utf-8')),
+                strict=True, expected=sample_env)
+
+
 class TestFilter(object):
 
     def test_pass_through(self):
@@ -107,6 +232,31 @@ class TestFilter(object):
                     ]),
                 }))
 
+    def test_ignore_rules(self):
+        env = modify(sample_env, ignore=['ca-*', {'pip': 're:a.+'}, {'conda': 'urllib3'}])
+        compare(list(env['conda']), expected=['certifi', 'libcxx'])
+        compare(list(env['pip']), expected=['urllib3'])
+
+    def test_does_not_alter_original(self):
+        original = sample_env.copy()
+        modify(original, ignore={'certifi', 'attrs'}, develop={'urllib3': '../urllib3'})
+        compare(original, expected=sample_env)
+
+    def test_develop_pattern(self):
+        env = modify(sample_env, develop={'a*': '../monorepo'})
+        compare(list(env['pip']), expected=['urllib3'])
+        compare(list(env['develop']), expected=['.', '../monorepo'])
+
+    def test_develop_rules_compiled_once(self):
+        with Replacer() as r:
+            rules = Mock(side_effect=Rules)
+            r.replace('picky.env.Rules', rules)
+            r.replace('picky.env.develop_rules', lru_cache()(develop_rules.__wrapped__))
+            for _ in range(3):
+                env = modify(sample_env, develop={'at*': '../attrs'})
+        compare(list(env['pip']), expected=['alabaster', 'urllib3'])
+        compare(rules.mock_calls, expected=[call(['at*'])])
+
     def test_develop(self):
         compare(modify(sample_env, develop={'attrs': '.'}),
                 expected=Environment({
@@ -186,3 +336,248 @@ class TestDiff(object):
                - urllib3==1.22
             -  - -e .
             """))
+
+
+class TestChanges(object):
+
+    def test_same(self):
+        compare(changes(sample_env, sample_env.copy()), expected=[])
+
+    def test_name_and_channel_order_ignored(self):
+        other_env = sample_env.copy()
+        other_env['name'] = 'other'
+        other_env['channels'].reverse()
+        compare(changes(sample_env, other_env), expected=[])
+
+    def test_all_kinds(self):
+        other_env = Environment({
+            'name': 'package',
+            'channels': ['conda-forge', 'simplistix'],
+            'conda': OrderedDict([
+                ('ca-certificates', PackageSpec('=', 'ca-certificates', '2018.03.07', '1')),
+                ('certifi', PackageSpec('=', 'certifi', '2018.4.16', 'py36_0')),
+                ('libcxx', PackageSpec('=', 'libcxx', '4.0.1', 'h579ed51_0')),
+                ('python', PackageSpec('=', 'python', '3.6.5', 'hc3d631a_2')),
+            ]),
+            'pip': OrderedDict([
+                ('alabaster', PackageSpec('==', 'alabaster', '0.7.10', None)),
+                ('urllib3', PackageSpec('==', 'urllib3', '1.22', None)),
+            ]),
+            'develop': OrderedDict([
+                ('.', PackageSpec(' ', '-e', '.', None)),
+            ]),
+        })
+        result = changes(sample_env, other_env)
+        compare(result, expected=[
+            Change(CHANNEL_CHANGED, 'channels', 'defaults', 'defaults', None),
+            Change(CHANNEL_CHANGED, 'channels', 'simplistix', None, 'simplistix'),
+            Change(BUILD_CHANGED, 'conda', 'ca-certificates',
+                   sample_env['conda']['ca-certificates'],
+                   other_env['conda']['ca-certificates']),
+            Change(VERSION_CHANGED, 'conda', 'certifi',
+                   sample_env['conda']['certifi'],
+                   other_env['conda']['certifi']),
+            Change(ADDED, 'conda', 'python', None, other_env['conda']['python']),
+            Change(REMOVED, 'pip', 'attrs', sample_env['pip']['attrs'], None),
+        ])
+        compare([str(change) for change in result], expected=[
+            'channel defaults removed',
+            'channel simplistix added',
+            'conda build-changed: ca-certificates=2018.03.07=0 -> ca-certificates=2018.03.07=1',
+            'conda version-changed: certifi=2018.1.18=py36_0 -> certifi=2018.4.16=py36_0',
+            'conda added: python=3.6.5=hc3d631a_2',
+            'pip removed: attrs==17.4.0',
+        ])
+
+    def test_sections_missing(self):
+        env = Environment({
+            'name': 'test',
+            'channels': ['defaults'],
+            'conda': OrderedDict([('python', PackageSpec('=', 'python'))]),
+        })
+        compare(changes(env, sample_env)[:2], expected=[
+            Change(CHANNEL_CHANGED, 'channels', 'conda-forge', None, 'conda-forge'),
+            Change(ADDED, 'conda', 'ca-certificates',
+                   None, sample_env['conda']['ca-certificates']),
+        ])
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('"-e ."', '-e .'),
+    ("'defaults'", 'defaults'),
+    ('plain', 'plain'),
+    ('"', '"'),
+    ('"a\\tb"', '"a\\tb"'),
+    ("'it''s'", "'it''s'"),
+    ('"mixed\'', '"mixed\''),
+])
+def test_unquote(value, expected):
+    compare(unquote(value), expected=expected)
+
+
+class TestUpdateText(object):
+
+    def test_unchanged(self):
+        compare(update_text(sample_serialized, sample_env), expected=sample_serialized)
+
+    def test_name_ignored_by_changes_but_updated(self):
+        env = sample_env.copy()
+        env['name'] = 'other'
+        compare(update_text(sample_serialized, env),
+                expected=sample_serialized.replace('name: package', 'name: other'))
+
+    def test_every_kind_of_change(self):
+        env = sample_env.copy()
+        env['channels'] = ['conda-forge', 'bioconda']
+        env['conda']['ca-certificates'] = PackageSpec('=', 'ca-certificates', '2018.03.07', '1')
+        del env['conda']['certifi']
+        env['conda']['zlib'] = PackageSpec('=', 'zlib', '1.2.11', '0')
+        env['conda']['a'] = PackageSpec('=', 'a', '1', '0')
+        env['pip']['attrs'] = PackageSpec('==', 'attrs', '18.1.0')
+        env['pip']['six'] = PackageSpec('==', 'six', '1.11.0')
+        env['develop']['../other'] = PackageSpec(' ', '-e', '../other')
+        compare(update_text(sample_serialized, env), expected=env.to_string())
+
+    def test_keeps_existing_order_and_indentation(self):
+        existing = dedent("""\
+            name: package
+            channels:
+              - defaults
+              - conda-forge
+            dependencies:
+              - libcxx=4.0.1=h579ed51_0
+              - ca-certificates=2018.03.07=0
+              - certifi=2018.1.18=py36_0
+              - pip:
+                - urllib3==1.22
+                - alabaster==0.7.10
+                - attrs==17.4.0
+                - -e .
+            """)
+        env = sample_env.copy()
+        env['conda']['certifi'] = PackageSpec('=', 'certifi', '2018.4.16', 'py36_0')
+        env['conda']['python'] = PackageSpec('=', 'python', '3.6.5', '0')
+        compare(update_text(existing, env), expected=dedent("""\
+            name: package
+            channels:
+              - defaults
+              - conda-forge
+            dependencies:
+              - libcxx=4.0.1=h579ed51_0
+              - ca-certificates=2018.03.07=0
+              - certifi=2018.4.16=py36_0
+              - python=3.6.5=0
+              - pip:
+                - urllib3==1.22
+                - alabaster==0.7.10
+                - attrs==17.4.0
+                - -e .
+            """))
+
+    def test_first_develop_entry(self):
+        env = sample_env.copy()
+        env['develop'] = OrderedDict()
+        text = env.to_string()
+        compare(update_text(text, sample_env), expected=sample_serialized)
+
+    def test_first_pip_entry(self):
+        env = sample_env.copy()
+        env['pip'] = OrderedDict()
+        compare(update_text(env.to_string(), sample_env), expected=sample_serialized)
+
+    def test_no_pip_section(self):
+        env = sample_env.copy()
+        env['pip'] = OrderedDict()
+        env['develop'] = OrderedDict()
+        compare(update_text(env.to_string(), sample_env), expected=None)
+
+    def test_needs_quoting(self):
+        env = sample_env.copy()
+        env['channels'] = ['conda-forge', 'defaults', '@odd']
+        compare(update_text(sample_serialized, env), expected=None)
+
+    def test_unsupported_text(self):
+        compare(update_text("name: 'package'\n", sample_env), expected=None)
+
+    def test_quoted_develop_entry(self):
+        existing = sample_serialized.replace('  - -e .', '  - "-e ."')
+        env = sample_env.copy()
+        env['conda']['certifi'] = PackageSpec('=', 'certifi', '2018.4.16', 'py36_0')
+        compare(update_text(existing, env),
+                expected=existing.replace('2018.1.18', '2018.4.16'))
+
+    def test_quoted_entries_changed(self):
+        existing = sample_serialized.replace(
+            '- certifi=2018.1.18=py36_0', "- 'certifi=2018.1.18=py36_0'"
+        ).replace('  - -e .', '  - "-e ."')
+        env = sample_env.copy()
+        env['conda']['certifi'] = PackageSpec('=', 'certifi', '2018.4.16', 'py36_0')
+        env['develop']['../other'] = PackageSpec(' ', '-e', '../other')
+        compare(update_text(existing, env), expected=(
+            existing.replace("'certifi=2018.1.18=py36_0'", 'certifi=2018.4.16=py36_0')
+            .replace('  - "-e ."\n', '  - "-e ."\n  - -e ../other\n')
+        ))
+
+
+class TestSpecStore(object):
+
+    def test_shares_specs(self):
+        store = SpecStore()
+        first = store.add(Environment.from_string(sample_serialized))
+        second = store.add(Environment.from_string(
+            sample_serialized.replace('2018.1.18', '2018.1.17')
+        ))
+        compare(first, strict=True, expected=sample_env)
+        for section in 'conda', 'pip', 'develop':
+            for key, spec in second[section].items():
+                if key == 'certifi':
+                    assert spec is not first[section][key]
+                else:
+                    assert spec is first[section][key]
+        compare(len(store), expected=8)
+
+
+class TestDigest(object):
+
+    def test_same_when_no_changes(self):
+        other = sample_env.copy()
+        other['name'] = 'other'
+        other['channels'] = list(reversed(other['channels']))
+        compare(other.digest(), expected=sample_env.digest())
+
+    @pytest.mark.parametrize('section, spec', [
+        ('conda', PackageSpec('=', 'certifi', '2018.1.17', 'py36_0')),
+        ('conda', PackageSpec('=', 'certifi', '2018.1.18', 'py36_1')),
+        ('conda', PackageSpec('=', 'python', '3.6.5', '0')),
+        ('pip', PackageSpec('==', 'six', '1.11.0')),
+        ('develop', PackageSpec(' ', '-e', '../other')),
+    ])
+    def test_differs_when_changed(self, section, spec):
+        other = sample_env.copy()
+        key = spec.version if section == 'develop' else spec.name
+        other[section][key] = spec
+        assert changes(sample_env, other)
+        assert other.digest() != sample_env.digest()
+
+    def test_differs_when_channel_changed(self):
+        other = sample_env.copy()
+        other['channels'] = ['conda-forge']
+        assert other.digest() != sample_env.digest()
+
+    def test_round_trip(self):
+        text = add_digest(sample_serialized, sample_env)
+        assert text.startswith('# picky-digest: ' + sample_env.digest() + ' ')
+        compare(split_digest(text), expected=(sample_env.digest(), sample_serialized))
+        compare(Environment.from_string(text), strict=True, expected=sample_env)
+
+    def test_no_header(self):
+        compare(split_digest(sample_serialized), expected=(None, sample_serialized))
+
+    def test_edited(self):
+        text = add_digest(sample_serialized, sample_env).replace('1.22', '1.23')
+        compare(split_digest(text),
+                expected=(None, sample_serialized.replace('1.22', '1.23')))
+
+    def test_malformed_header(self):
+        compare(split_digest('# picky-digest: foo\n' + sample_serialized),
+                expected=(None, sample_serialized))
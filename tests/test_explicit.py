@@ -0,0 +1,332 @@
+import json
+import os
+from hashlib import md5, sha256
+
+import pytest
+from testfixtures import Replacer, ShouldRaise, compare
+from testfixtures.mock import Mock, call
+
+from picky.explicit import (
+    HEADER, Package, explicit_path, fetch, fetch_all, parse, python_path, render, restore,
+)
+from picky.main import lock
+from tests.test_main import run as main_run
+from tests.test_env import sample_env
+
+CONTENT = {
+    'ca-certificates-2018.03.07-0.tar.bz2': b'ca-certificates',
+    'certifi-2018.1.18-py36_0.tar.bz2': b'certifi',
+    'libcxx-4.0.1-h579ed51_0.conda': b'libcxx',
+}
+
+
+@pytest.fixture()
+def channel(tmpdir):
+    """
+    A local file:// channel holding a package file for each conda package
+    in :data:`sample_env`.
+    """
+    subdir = tmpdir.mkdir('channel').mkdir('osx-64')
+    for name, content in CONTENT.items():
+        subdir.join(name).write_binary(content)
+    return 'file://' + str(subdir.dirpath())
+
+
+def write_record(meta, fn, **fields):
+    name, version, build = fn.rsplit('.tar.bz2', 1)[0].rsplit('.conda', 1)[0].rsplit('-', 2)
+    record = dict(name=name, version=version, build=build, fn=fn, subdir='osx-64', **fields)
+    meta.join('{}-{}-{}.json'.format(name, version, build)).write(json.dumps(record))
+
+
+PIP_HASHES = [
+    ('alabaster', '0.7.10', 'a1a'),
+    ('attrs', '17.4.0', 'abc'),
+    ('urllib3', '1.22', 'u22'),
+]
+
+
+@pytest.fixture()
+def prefix(tmpdir, channel):
+    """
+    A prefix with records for the packages in :data:`sample_env` that
+    were installed from :func:`channel`.
+    """
+    prefix = tmpdir.mkdir('prefix')
+    meta = prefix.mkdir('conda-meta')
+    write_record(meta, 'ca-certificates-2018.03.07-0.tar.bz2',
+                 url=channel + '/osx-64/ca-certificates-2018.03.07-0.tar.bz2',
+                 md5=md5(b'ca-certificates').hexdigest())
+    write_record(meta, 'certifi-2018.1.18-py36_0.tar.bz2', channel=channel,
+                 md5=md5(b'certifi').hexdigest())
+    write_record(meta, 'libcxx-4.0.1-h579ed51_0.conda', channel=channel + '/osx-64',
+                 sha256=sha256(b'libcxx').hexdigest())
+    site_packages = prefix.mkdir('lib').mkdir('python3.6').mkdir('site-packages')
+    for name, version, digest in PIP_HASHES:
+        info = site_packages.mkdir('{}-{}.dist-info'.format(name, version))
+        info.join('direct_url.json').write(json.dumps({
+            'url': 'https://example.com/{}-{}-py2.py3-none-any.whl'.format(name, version),
+            'archive_info': {'hashes': {'sha256': digest}},
+        }))
+    return str(prefix)
+
+
+def expected_text(channel):
+    return HEADER + (
+        '@EXPLICIT\n'
+        '{channel}/osx-64/ca-certificates-2018.03.07-0.tar.bz2#{ca}\n'
+        '{channel}/osx-64/certifi-2018.1.18-py36_0.tar.bz2#{certifi}\n'
+        '{channel}/osx-64/libcxx-4.0.1-h579ed51_0.conda#sha256:{libcxx}\n'
+        '# pip: alabaster==0.7.10 --hash=sha256:a1a\n'
+        '# pip: attrs==17.4.0 --hash=sha256:abc\n'
+        '# pip: urllib3==1.22 --hash=sha256:u22\n'
+        '# pip: -e .\n'
+    ).format(channel=channel, ca=md5(b'ca-certificates').hexdigest(),
+             certifi=md5(b'certifi').hexdigest(), libcxx=sha256(b'libcxx').hexdigest())
+
+
+class TestExplicitPath(object):
+
+    def test_yaml(self):
+        compare(explicit_path('env/environment.lock.yaml'),
+                expected='env/environment.lock.explicit.txt')
+
+    def test_platform(self):
+        compare(explicit_path('environment.lock.yaml', 'linux-64'),
+                expected='environment.lock.linux-64.explicit.txt')
+
+    def test_other_extension(self):
+        compare(explicit_path('environment.lock'),
+                expected='environment.lock.explicit.txt')
+
+
+class TestRender(object):
+
+    def test_urls_and_hashes(self, prefix, channel):
+        compare(render(sample_env, prefix), expected=expected_text(channel))
+
+    def test_pip_hash_missing(self, prefix):
+        os.remove(os.path.join(prefix, 'lib', 'python3.6', 'site-packages',
+                               'urllib3-1.22.dist-info', 'direct_url.json'))
+        text = render(sample_env, prefix)
+        # a hash for some requirements but not others would make pip fail:
+        assert '--hash' not in text, text
+        compare(text.splitlines()[-4:], expected=[
+            '# pip: alabaster==0.7.10',
+            '# pip: attrs==17.4.0',
+            '# pip: urllib3==1.22',
+            '# pip: -e .',
+        ])
+
+    def test_missing_record(self, prefix):
+        env = sample_env.copy()
+        env['conda']['python'] = None
+        with ShouldRaise(ValueError('No conda-meta record for python in ' + prefix)):
+            render(env, prefix)
+
+
+class TestParse(object):
+
+    def test_round_trip(self, channel):
+        packages, pip = parse(expected_text(channel))
+        compare(packages, expected=[
+            Package(channel + '/osx-64/ca-certificates-2018.03.07-0.tar.bz2', 'md5',
+                    md5(b'ca-certificates').hexdigest()),
+            Package(channel + '/osx-64/certifi-2018.1.18-py36_0.tar.bz2', 'md5',
+                    md5(b'certifi').hexdigest()),
+            Package(channel + '/osx-64/libcxx-4.0.1-h579ed51_0.conda', 'sha256',
+                    sha256(b'libcxx').hexdigest()),
+        ])
+        compare(pip, expected=[
+            'alabaster==0.7.10 --hash=sha256:a1a',
+            'attrs==17.4.0 --hash=sha256:abc',
+            'urllib3==1.22 --hash=sha256:u22',
+            '-e .',
+        ])
+
+    def test_no_hash(self):
+        compare(parse('@EXPLICIT\nfile:///x/a-1-0.tar.bz2\n')[0],
+                expected=[Package('file:///x/a-1-0.tar.bz2', None, None)])
+
+    def test_not_explicit(self):
+        with ShouldRaise(ValueError('Not an explicit specification, no @EXPLICIT line')):
+            parse('python=3.6\n')
+
+
+def package(channel, name, algorithm='md5'):
+    digest = md5 if algorithm == 'md5' else sha256
+    return Package('{}/osx-64/{}'.format(channel, name), algorithm,
+                   digest(CONTENT[name]).hexdigest())
+
+
+class TestFetch(object):
+
+    def test_download(self, tmpdir, channel):
+        pkgs = tmpdir.mkdir('pkgs')
+        path = fetch(package(channel, 'certifi-2018.1.18-py36_0.tar.bz2'), str(pkgs))
+        compare(path, expected=str(pkgs.join('certifi-2018.1.18-py36_0.tar.bz2')))
+        compare(pkgs.join('certifi-2018.1.18-py36_0.tar.bz2').read_binary(),
+                expected=b'certifi')
+        compare(pkgs.listdir(), expected=[pkgs.join('certifi-2018.1.18-py36_0.tar.bz2')])
+
+    def test_already_cached(self, tmpdir, channel):
+        pkgs = tmpdir.mkdir('pkgs')
+        pkgs.join('libcxx-4.0.1-h579ed51_0.conda').write_binary(b'libcxx')
+        with Replacer() as r:
+            urlopen = Mock()
+            r.replace('picky.explicit.urlopen', urlopen)
+            fetch(package(channel, 'libcxx-4.0.1-h579ed51_0.conda', 'sha256'), str(pkgs))
+        compare(urlopen.mock_calls, expected=[])
+
+    def test_cached_copy_corrupt(self, tmpdir, channel):
+        pkgs = tmpdir.mkdir('pkgs')
+        pkgs.join('libcxx-4.0.1-h579ed51_0.conda').write_binary(b'truncated')
+        fetch(package(channel, 'libcxx-4.0.1-h579ed51_0.conda', 'sha256'), str(pkgs))
+        compare(pkgs.join('libcxx-4.0.1-h579ed51_0.conda').read_binary(), expected=b'libcxx')
+
+    def test_hash_mismatch(self, tmpdir, channel):
+        pkgs = tmpdir.mkdir('pkgs')
+        url = channel + '/osx-64/certifi-2018.1.18-py36_0.tar.bz2'
+        with ShouldRaise(ValueError('{} has md5 {}, expected bad'.format(
+            url, md5(b'certifi').hexdigest()
+        ))):
+            fetch(Package(url, 'md5', 'bad'), str(pkgs))
+        compare(pkgs.listdir(), expected=[])
+
+    def test_all_in_parallel(self, tmpdir, channel):
+        pkgs = tmpdir.join('pkgs')
+        names = sorted(CONTENT)
+        paths = fetch_all([package(channel, name) for name in names[:2]] +
+                          [package(channel, names[2], 'sha256')], str(pkgs), jobs=2)
+        compare(paths, expected=[str(pkgs.join(name)) for name in names])
+
+
+def test_restore(tmpdir, prefix, channel):
+    explicit = tmpdir.join('environment.lock.explicit.txt')
+    explicit.write(expected_text(channel))
+    pkgs = tmpdir.join('pkgs')
+    target = str(tmpdir.join('restored'))
+    requirements = []
+
+    def check_call(command, **kw):
+        # the files passed are removed once each command has finished:
+        if '-e' not in command:
+            requirements.append(open(command[-1]).read())
+
+    with Replacer() as r:
+        mock = Mock(side_effect=check_call)
+        r.replace('picky.explicit.check_call', mock)
+        r.in_environ('CONDA_EXE', '/conda/bin/conda')
+        compare(restore(str(explicit), target, str(pkgs)), expected=(3, 4))
+    local = str(pkgs.join('picky-restore-{}.txt'.format(os.getpid())))
+    pip = str(pkgs.join('picky-pip-{}.txt'.format(os.getpid())))
+    compare(mock.mock_calls, expected=[
+        call(['/conda/bin/conda', 'create', '--yes', '--offline', '--prefix', target,
+              '--file', local], env=mock.mock_calls[0].kwargs['env']),
+        call([python_path(target), '-m', 'pip', 'install', '--no-deps', '-r', pip]),
+        call([python_path(target), '-m', 'pip', 'install', '--no-deps', '-e', '.'],
+             cwd=str(tmpdir)),
+    ])
+    compare(mock.mock_calls[0].kwargs['env']['CONDA_PKGS_DIRS'], expected=str(pkgs))
+    compare(requirements, expected=[
+        '@EXPLICIT\n'
+        'file://{pkgs}/ca-certificates-2018.03.07-0.tar.bz2#{ca}\n'
+        'file://{pkgs}/certifi-2018.1.18-py36_0.tar.bz2#{certifi}\n'
+        'file://{pkgs}/libcxx-4.0.1-h579ed51_0.conda#sha256:{libcxx}\n'.format(
+            pkgs=pkgs, ca=md5(b'ca-certificates').hexdigest(),
+            certifi=md5(b'certifi').hexdigest(), libcxx=sha256(b'libcxx').hexdigest()
+        ),
+        # develop packages are kept out of pip's hash-checking mode:
+        'alabaster==0.7.10 --hash=sha256:a1a\n'
+        'attrs==17.4.0 --hash=sha256:abc\n'
+        'urllib3==1.22 --hash=sha256:u22\n',
+    ])
+    compare(sorted(pkgs.listdir()), expected=[pkgs.join(name) for name in sorted(CONTENT)])
+
+
+class TestLock(object):
+
+    def test_explicit(self, tmpdir, prefix, channel):
+        concrete = str(tmpdir.join('environment.lock.yaml'))
+        lock(sample_env, concrete, write_explicit=True, prefix=prefix)
+        compare(tmpdir.join('environment.lock.explicit.txt').read(),
+                expected=expected_text(channel))
+
+    def test_kept_up_to_date(self, tmpdir, prefix):
+        concrete = str(tmpdir.join('environment.lock.yaml'))
+        explicit = tmpdir.join('environment.lock.explicit.txt')
+        explicit.write('')
+        lock(sample_env, concrete, prefix=prefix)
+        assert explicit.read().startswith(HEADER)
+
+    def test_not_by_default(self, tmpdir, prefix):
+        lock(sample_env, str(tmpdir.join('environment.lock.yaml')), prefix=prefix)
+        compare(tmpdir.listdir(lambda path: path.ext == '.txt'), expected=[])
+
+    def test_ignored_packages_kept(self, tmpdir, prefix, channel):
+        # what is ignored when checking must still be installed when restoring:
+        tmpdir.join('picky.yaml').write('ignore: [libcxx, alabaster]\n')
+        manifest = tmpdir.join('manifest.yaml')
+        manifest.write('- prefix: {}\n'.format(prefix))
+        main_run(['lock-all', '--explicit', str(manifest)], expected_output=(
+            '{0} ({1}): locked\n'
+            '1 environments locked, 0 failed.\n'
+        ).format(prefix, tmpdir.join('environment.lock.yaml')))
+        assert 'libcxx' not in tmpdir.join('environment.lock.yaml').read()
+        compare(tmpdir.join('environment.lock.explicit.txt').read(),
+                expected=expected_text(channel))
+
+    def test_platform(self, tmpdir, prefix):
+        concrete = str(tmpdir.join('environment.lock.yaml'))
+        lock(sample_env, concrete, platform='osx-64', write_explicit=True, prefix=prefix)
+        assert tmpdir.join('environment.lock.osx-64.explicit.txt').exists()
+
+
+def test_pip_hash_names_normalized(prefix):
+    env = sample_env.copy()
+    env['pip'] = {'Attrs': env['pip']['attrs']}
+    assert '--hash=sha256:abc' in render(env, prefix)
+
+
+def test_restore_mixed(tmpdir, channel):
+    # pip packages without hashes and several develop packages:
+    explicit = tmpdir.join('environment.lock.explicit.txt')
+    explicit.write(
+        '@EXPLICIT\n'
+        '# pip: alabaster==0.7.10\n'
+        '# pip: -e ./src\n'
+        '# pip: urllib3==1.22\n'
+        '# pip: -e ../other\n'
+    )
+    target = str(tmpdir.join('restored'))
+    requirements = []
+
+    def check_call(command, **kw):
+        if '-r' in command:
+            requirements.append(open(command[-1]).read())
+
+    with Replacer() as r:
+        mock = Mock(side_effect=check_call)
+        r.replace('picky.explicit.check_call', mock)
+        r.in_environ('CONDA_EXE', '/conda/bin/conda')
+        compare(restore(str(explicit), target, str(tmpdir.join('pkgs'))), expected=(0, 4))
+    pip = str(tmpdir.join('pkgs', 'picky-pip-{}.txt'.format(os.getpid())))
+    compare(mock.mock_calls[1:], expected=[
+        call([python_path(target), '-m', 'pip', 'install', '--no-deps', '-r', pip]),
+        call([python_path(target), '-m', 'pip', 'install', '--no-deps',
+              '-e', './src', '-e', '../other'], cwd=str(tmpdir)),
+    ])
+    compare(requirements, expected=['alabaster==0.7.10\nurllib3==1.22\n'])
+
+
+def test_restore_only_develop(tmpdir):
+    explicit = tmpdir.join('environment.lock.explicit.txt')
+    explicit.write('@EXPLICIT\n# pip: -e .\n')
+    target = str(tmpdir.join('restored'))
+    with Replacer() as r:
+        mock = Mock()
+        r.replace('picky.explicit.check_call', mock)
+        restore(str(explicit), target, str(tmpdir.join('pkgs')))
+    compare(mock.mock_calls[1:], expected=[
+        call([python_path(target), '-m', 'pip', 'install', '--no-deps', '-e', '.'],
+             cwd=str(tmpdir)),
+    ])
@@ -0,0 +1,147 @@
+import asyncio
+import sys
+from subprocess import CalledProcessError, TimeoutExpired
+from timeit import default_timer
+
+import pytest
+from testfixtures import Replacer, ShouldRaise, compare
+
+from picky.conda import conda_env_export, conda_env_stream
+from picky.export import export, export_all, export_many, export_sync
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='needs a shell script')
+
+# the last argument, the prefix, says what the fake conda should do:
+fake_conda = '''\
+import os, sys, time
+prefix = sys.argv[-1]
+log = os.path.join(os.path.dirname(sys.argv[0]), 'log')
+with open(log, 'a') as target:
+    target.write('start ' + prefix + '\\n')
+if prefix == 'hang':
+    time.sleep(30)
+if prefix.startswith('fail-'):
+    attempts = os.path.join(os.path.dirname(sys.argv[0]), prefix)
+    with open(attempts, 'a') as target:
+        target.write('x')
+    if os.path.getsize(attempts) <= int(prefix[5:]):
+        sys.exit(1)
+if prefix.startswith('sleep'):
+    time.sleep(0.2)
+if prefix.isdigit():
+    sys.exit(int(prefix))
+sys.stdout.write('args: ' + ' '.join(sys.argv[1:]) + '\\n')
+with open(log, 'a') as target:
+    target.write('end ' + prefix + '\\n')
+'''
+
+
+@pytest.fixture()
+def conda(tmpdir):
+    script = tmpdir.join('conda.py')
+    script.write(fake_conda)
+    wrapper = tmpdir.join('conda')
+    wrapper.write('#!/bin/sh\nexec {} {} "$@"\n'.format(sys.executable, script))
+    wrapper.chmod(0o755)
+    with Replacer() as r:
+        r.in_environ('CONDA_EXE', str(wrapper))
+        r.replace('picky.export.RETRY_DELAY', 0)
+        yield tmpdir.join('log')
+
+
+def test_export(conda):
+    compare(export_sync(include_build=False, prefix='/some/env'),
+            expected=b'args: env export --no-builds --prefix /some/env\n')
+
+
+def test_sync_api(conda):
+    compare(conda_env_export(prefix='/some/env'),
+            expected=b'args: env export --prefix /some/env\n')
+
+
+def test_stream_timeout(conda):
+    start = default_timer()
+    with ShouldRaise(TimeoutExpired):
+        list(conda_env_stream(prefix='hang', timeout=0.5))
+    assert default_timer() - start < 5
+
+
+def test_stream_within_timeout(conda):
+    compare(list(conda_env_stream(prefix='sleep', timeout=10)),
+            expected=['args: env export --prefix sleep\n'])
+
+
+def test_stream_failure_within_timeout(conda):
+    with ShouldRaise(CalledProcessError):
+        list(conda_env_stream(prefix='3', timeout=10))
+
+
+def test_failure(conda):
+    with ShouldRaise(CalledProcessError) as s:
+        export_sync(prefix='3')
+    compare(s.raised.returncode, expected=3)
+
+
+def test_timeout(conda):
+    start = default_timer()
+    with ShouldRaise(TimeoutExpired):
+        export_sync(prefix='hang', timeout=0.5)
+    assert default_timer() - start < 5
+
+
+def test_retries(conda):
+    compare(export_sync(prefix='fail-2', retries=2),
+            expected=b'args: env export --prefix fail-2\n')
+    compare(conda.read().count('start fail-2'), expected=3)
+
+
+def test_retries_exhausted(conda):
+    with ShouldRaise(CalledProcessError):
+        export_sync(prefix='fail-2', retries=1)
+    compare(conda.read().count('start fail-2'), expected=2)
+
+
+def test_retry_after_timeout(conda):
+    with ShouldRaise(TimeoutExpired):
+        export_sync(prefix='hang', timeout=0.2, retries=1)
+    compare(conda.read().count('start hang'), expected=2)
+
+
+def test_cancelled(conda):
+
+    async def cancel():
+        task = asyncio.ensure_future(export(prefix='hang'))
+        while not conda.exists():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with ShouldRaise(asyncio.CancelledError):
+            await task
+
+    start = default_timer()
+    asyncio.run(cancel())
+    assert default_timer() - start < 5
+
+
+def test_many(conda):
+    results = export_all([(True, 'sleep-a'), (True, '3'), (False, 'sleep-b')], limit=1)
+    compare(results[0], expected=b'args: env export --prefix sleep-a\n')
+    assert isinstance(results[1], CalledProcessError)
+    compare(results[2], expected=b'args: env export --no-builds --prefix sleep-b\n')
+    # with a limit of one, each export finishes before the next starts:
+    events = conda.read().splitlines()
+    compare(events, expected=[
+        'start sleep-a', 'end sleep-a', 'start 3', 'start sleep-b', 'end sleep-b',
+    ])
+
+
+def test_many_concurrent(conda):
+    asyncio.run(export_many([(True, 'sleep-a'), (True, 'sleep-b')]))
+    compare(sorted(conda.read().splitlines()[:2]),
+            expected=['start sleep-a', 'start sleep-b'])
+
+
+def test_many_timeout_and_retries(conda):
+    results = export_all([(True, 'hang'), (True, 'fail-1')], timeout=0.5, retries=1)
+    assert isinstance(results[0], TimeoutExpired)
+    compare(results[1], expected=b'args: env export --prefix fail-1\n')
+    compare(conda.read().count('start hang'), expected=2)
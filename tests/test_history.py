@@ -0,0 +1,163 @@
+import pytest
+from testfixtures import ShouldRaise, compare
+
+from picky import history
+from picky.env import ADDED, BUILD_CHANGED, REMOVED, VERSION_CHANGED, PackageSpec
+from picky.history import History, history_path
+from tests.test_env import sample_env
+
+
+def versions(count):
+    """
+    Yield environments in which certifi is upgraded each time and,
+    every third time, urllib3 is added or removed.
+    """
+    for i in range(count):
+        env = sample_env.copy()
+        env['conda']['certifi'] = PackageSpec('=', 'certifi', '2018.{}'.format(i), 'py36_0')
+        if i % 3 == 2:
+            del env['pip']['urllib3']
+        yield env
+
+
+@pytest.fixture()
+def recorded(tmpdir):
+    return History(history_path(str(tmpdir.join('environment.lock.yaml'))))
+
+
+class TestHistory(object):
+
+    def test_empty(self, recorded):
+        compare(len(recorded), expected=0)
+        compare(recorded.log('certifi'), expected=[])
+        compare(recorded.at(100), expected=None)
+        with ShouldRaise(ValueError('{} has no snapshot 0'.format(recorded.path))):
+            recorded.state(0)
+
+    def test_round_trip(self, recorded):
+        compare(recorded.record(sample_env, 1.0), expected=0)
+        compare(recorded.state(0), strict=True, expected=sample_env)
+
+    def test_unchanged_not_recorded(self, recorded):
+        recorded.record(sample_env, 1.0)
+        env = sample_env.copy()
+        env['channels'] = list(reversed(env['channels']))
+        compare(recorded.record(env, 2.0), expected=None)
+        compare(len(recorded), expected=1)
+
+    def test_states_across_checkpoints(self, recorded, monkeypatch):
+        monkeypatch.setattr(history, 'CHECKPOINT_INTERVAL', 4)
+        envs = list(versions(10))
+        for i, env in enumerate(envs):
+            compare(recorded.record(env, float(i)), expected=i)
+        for i, env in enumerate(envs):
+            compare(recorded.state(i), expected=env)
+        with open(recorded.path) as source:
+            checkpoints = ['"environment"' in line for line in source]
+        compare(checkpoints, expected=[i % 4 == 0 for i in range(10)])
+
+    def test_state_reads_from_checkpoint(self, recorded, monkeypatch):
+        monkeypatch.setattr(history, 'CHECKPOINT_INTERVAL', 4)
+        for i, env in enumerate(versions(10)):
+            recorded.record(env, float(i))
+        read = []
+        records = recorded.records
+        monkeypatch.setattr(recorded, 'records',
+                            lambda first, last: read.append((first, last)) or
+                            records(first, last))
+        recorded.state(9)
+        compare(read, expected=[(8, 9)])
+
+    def test_channels_and_name(self, recorded):
+        recorded.record(sample_env, 1.0)
+        env = sample_env.copy()
+        env['name'] = 'renamed'
+        env['channels'] = ['bioconda', 'defaults']
+        recorded.record(env, 2.0)
+        compare(recorded.state(1), strict=True, expected=env)
+
+    def test_rename_recorded(self, recorded):
+        recorded.record(sample_env, 1.0)
+        env = sample_env.copy()
+        env['name'] = 'renamed'
+        compare(recorded.record(env, 2.0), expected=1)
+        compare(recorded.state(1)['name'], expected='renamed')
+        del env['name']
+        compare(recorded.record(env, 3.0), expected=2)
+        compare(recorded.state(2).get('name'), expected=None)
+
+    def test_at(self, recorded):
+        for i, env in enumerate(versions(5)):
+            recorded.record(env, 10.0 * i)
+        compare(recorded.at(-1), expected=None)
+        compare(recorded.at(0), expected=0)
+        compare(recorded.at(25), expected=2)
+        compare(recorded.at(40), expected=4)
+        compare(recorded.at(1000), expected=4)
+        compare(recorded.times(), expected=[0.0, 10.0, 20.0, 30.0, 40.0])
+
+    def test_log(self, recorded):
+        for i, env in enumerate(versions(4)):
+            recorded.record(env, float(i))
+        log = recorded.log('urllib3')
+        compare([(event.snapshot, event.change.kind) for event in log],
+                expected=[(0, ADDED), (2, REMOVED), (3, ADDED)])
+        compare(str(log[1].change), expected='pip removed: urllib3==1.22')
+        log = recorded.log('certifi')
+        compare([(event.snapshot, event.change.kind) for event in log],
+                expected=[(0, ADDED)] + [(i, VERSION_CHANGED) for i in range(1, 4)])
+        compare(str(log[1].change),
+                expected='conda version-changed: certifi=2018.0=py36_0 -> certifi=2018.1=py36_0')
+
+    def test_log_shared_bucket(self, recorded, monkeypatch):
+        monkeypatch.setattr(history, 'BUCKETS', 1)
+        for i, env in enumerate(versions(4)):
+            recorded.record(env, float(i))
+        compare([(event.snapshot, event.change.kind) for event in recorded.log('urllib3')],
+                expected=[(0, ADDED), (2, REMOVED), (3, ADDED)])
+        compare(recorded.log('numpy'), expected=[])
+
+    def test_log_only_reads_its_bucket(self, recorded):
+        for i, env in enumerate(versions(4)):
+            recorded.record(env, float(i))
+        assert history.bucket('certifi') != history.bucket('urllib3')
+        # lines for other packages are never read, so mangling them makes no difference:
+        with open(recorded.packages_path, 'rb') as source:
+            lines = source.readlines()
+        with open(recorded.packages_path, 'wb') as target:
+            for line in lines:
+                if b'\tcertifi\t' in line:
+                    line = b'x' * (len(line) - 1) + b'\n'
+                target.write(line)
+        compare([event.snapshot for event in recorded.log('urllib3')], expected=[0, 2, 3])
+
+    def test_log_build_changed_and_section(self, recorded):
+        recorded.record(sample_env, 1.0)
+        env = sample_env.copy()
+        env['conda']['certifi'] = PackageSpec('=', 'certifi', '2018.1.18', 'py36_1')
+        recorded.record(env, 2.0)
+        compare([event.change.kind for event in recorded.log('certifi', 'conda')],
+                expected=[ADDED, BUILD_CHANGED])
+        compare(recorded.log('certifi', 'pip'), expected=[])
+
+    def test_interrupted_write(self, recorded):
+        recorded.record(sample_env, 1.0)
+        # a record and package line written without its index entry:
+        with open(recorded.path, 'a') as target:
+            target.write('{"snapshot": 1, "changes": [')
+        recorded.link([['conda', 'certifi', None, None]], 1)
+        compare(len(recorded), expected=1)
+        compare([event.snapshot for event in recorded.log('certifi')], expected=[0])
+        env = sample_env.copy()
+        del env['conda']['certifi']
+        compare(recorded.record(env, 2.0), expected=1)
+        compare(recorded.state(1), expected=env)
+        compare(recorded.state(0), expected=sample_env)
+        compare([(event.snapshot, event.change.kind) for event in recorded.log('certifi')],
+                expected=[(0, ADDED), (1, REMOVED)])
+
+
+def test_history_path():
+    compare(history_path('env.lock.yaml'), expected='env.lock.yaml.history')
+    compare(history_path('env.lock.yaml', 'linux-64'),
+            expected='env.lock.yaml.linux-64.history')
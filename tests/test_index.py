@@ -0,0 +1,193 @@
+import os
+
+import pytest
+from testfixtures import ShouldRaise, compare
+
+from picky.env import PackageSpec
+from picky.index import (
+    Index, Pin, compare_versions, find, parse_requirement, render_groups, render_matrix,
+    satisfies,
+)
+from picky.platforms import render
+from tests.test_env import sample_env, sample_serialized
+
+
+class TestVersions(object):
+
+    @pytest.mark.parametrize('left, right, expected', [
+        ('1.24', '1.24', 0),
+        ('1.24', '1.24.0', 0),
+        ('1.23.5', '1.24', -1),
+        ('1.100', '1.24', 1),
+        ('1.0rc1', '1.0', -1),
+        ('1.0a1', '1.0b1', -1),
+        ('2018.1.18', '2018.03.07', -1),
+    ])
+    def test_compare(self, left, right, expected):
+        compare(compare_versions(left, right), expected=expected)
+        compare(compare_versions(right, left), expected=-expected)
+
+    @pytest.mark.parametrize('text, expected', [
+        ('numpy', ('numpy', [])),
+        ('numpy<1.24', ('numpy', [('<', '1.24')])),
+        ('openssl >=1.1, <3', ('openssl', [('>=', '1.1'), ('<', '3')])),
+        ('python=3.6', ('python', [('=', '3.6')])),
+        ('python=3.6.*', ('python', [('=', '3.6')])),
+        ('attrs==17.*', ('attrs', [('==', '17.*')])),
+    ])
+    def test_parse_requirement(self, text, expected):
+        compare(parse_requirement(text), expected=expected)
+
+    def test_invalid_requirement(self):
+        with ShouldRaise(ValueError("Invalid requirement: 'numpy<'")):
+            parse_requirement('numpy<')
+
+    @pytest.mark.parametrize('version, requirement, expected', [
+        ('1.23.5', 'numpy<1.24', True),
+        ('1.24.0', 'numpy<1.24', False),
+        ('3.6.5', 'python=3.6', True),
+        ('3.6', 'python=3.6', True),
+        ('3.60', 'python=3.6', False),
+        ('17.4.0', 'attrs==17.*', True),
+        ('17.4.0', 'attrs!=17.*', False),
+        ('2.0', 'x>=1.1,<3', True),
+        ('3.0', 'x>=1.1,<3', False),
+        (None, 'x>1', False),
+    ])
+    def test_satisfies(self, version, requirement, expected):
+        compare(satisfies(version, parse_requirement(requirement)[1]), expected=expected)
+
+
+def lock_files(tmpdir):
+    one = tmpdir.mkdir('one').join('environment.lock.yaml')
+    one.write(sample_serialized)
+    two = tmpdir.mkdir('two').join('environment.lock.yaml')
+    two.write(sample_serialized.replace('2018.1.18=py36_0', '2018.1.17=py36_1'))
+    return str(one), str(two)
+
+
+@pytest.fixture()
+def indexed(tmpdir):
+    index = Index(str(tmpdir.join('cache', 'index.sqlite')))
+    yield index
+    index.close()
+
+
+class TestIndex(object):
+
+    def test_find(self, tmpdir):
+        one, two = lock_files(tmpdir)
+        tmpdir.mkdir('.git').join('x.lock.yaml').write('')
+        tmpdir.join('one', 'picky.yaml').write('')
+        compare(list(find([str(tmpdir)])), expected=[one, two])
+
+    def test_update(self, tmpdir, indexed):
+        one, two = lock_files(tmpdir)
+        compare(indexed.update([str(tmpdir)]), expected=(2, 0, 0, []))
+        compare(indexed.paths(), expected=[one, two])
+        compare(indexed.pins('certifi'), expected=[
+            Pin(one, '', 'conda', 'certifi', '2018.1.18', 'py36_0'),
+            Pin(two, '', 'conda', 'certifi', '2018.1.17', 'py36_1'),
+        ])
+
+    def test_only_changed_files_parsed(self, tmpdir, indexed):
+        one, two = lock_files(tmpdir)
+        indexed.update([str(tmpdir)])
+        compare(indexed.update([str(tmpdir)]), expected=(0, 2, 0, []))
+        # touched, but the same content:
+        os.utime(one, (0, 0))
+        compare(indexed.update([str(tmpdir)]), expected=(0, 2, 0, []))
+        with open(two, 'w') as target:
+            target.write(sample_serialized.replace('certifi=2018.1.18', 'certifi=2019.1.1'))
+        compare(indexed.update([str(tmpdir)]), expected=(1, 1, 0, []))
+        compare([pin.version for pin in indexed.pins('certifi')],
+                expected=['2018.1.18', '2019.1.1'])
+
+    def test_removed(self, tmpdir, indexed):
+        one, two = lock_files(tmpdir)
+        indexed.update([str(tmpdir)])
+        os.remove(two)
+        # files outside the roots being updated are left alone:
+        compare(indexed.update([str(tmpdir.join('two'))]), expected=(0, 0, 1, []))
+        compare(indexed.update([str(tmpdir.join('two'))]), expected=(0, 0, 0, []))
+        compare(indexed.paths(), expected=[one])
+        compare([pin.path for pin in indexed.pins('certifi')], expected=[one])
+
+    def test_bad_file_skipped(self, tmpdir, indexed):
+        one, two = lock_files(tmpdir)
+        bad = tmpdir.mkdir('bad').join('environment.lock.yaml')
+        bad.write_binary(b'dependencies:\n- \xff\n')
+        parsed, unchanged, removed, skipped = indexed.update([str(tmpdir)])
+        compare((parsed, unchanged, removed), expected=(2, 0, 0))
+        compare([path for path, _ in skipped], expected=[str(bad)])
+        assert isinstance(skipped[0][1], UnicodeDecodeError)
+        # the good files are still indexed and the bad one left out:
+        compare(indexed.paths(), expected=[one, two])
+        # once fixed, the bad file is picked up:
+        bad.write(sample_serialized)
+        compare(indexed.update([str(tmpdir)]), expected=(1, 2, 0, []))
+        compare(len(indexed.pins('certifi')), expected=3)
+
+    def test_bad_file_keeps_previous_entries(self, tmpdir, indexed):
+        one, two = lock_files(tmpdir)
+        indexed.update([str(tmpdir)])
+        with open(two, 'w') as target:
+            target.write('dependencies: [')
+        parsed, unchanged, removed, skipped = indexed.update([str(tmpdir)])
+        compare((parsed, unchanged, removed, len(skipped)), expected=(0, 1, 0, 1))
+        compare([pin.path for pin in indexed.pins('certifi')], expected=[one, two])
+
+    def test_query(self, tmpdir, indexed):
+        one, two = lock_files(tmpdir)
+        indexed.update([str(tmpdir)])
+        compare([pin.path for pin in indexed.query('certifi<2018.1.18')], expected=[two])
+        compare([pin.path for pin in indexed.query('certifi')], expected=[one, two])
+        compare(indexed.query('numpy'), expected=[])
+
+    def test_multi_platform(self, tmpdir, indexed):
+        other = sample_env.copy()
+        other['conda']['libcxx'] = PackageSpec('=', 'libcxx', '5.0.0', 'h0_0')
+        path = tmpdir.join('environment.lock.yaml')
+        path.write(render({'linux-64': sample_env, 'osx-64': other}))
+        indexed.update([str(tmpdir)])
+        compare(indexed.pins('libcxx'), expected=[
+            Pin(str(path), 'linux-64', 'conda', 'libcxx', '4.0.1', 'h579ed51_0'),
+            Pin(str(path), 'osx-64', 'conda', 'libcxx', '5.0.0', 'h0_0'),
+        ])
+
+    def test_digest_header(self, tmpdir, indexed):
+        from picky.env import add_digest
+        tmpdir.join('environment.lock.yaml').write(add_digest(sample_serialized, sample_env))
+        indexed.update([str(tmpdir)])
+        compare(len(indexed.pins('certifi')), expected=1)
+
+
+class TestRender(object):
+
+    pins = [
+        Pin('/a.lock.yaml', '', 'conda', 'openssl', '1.1.1', 'h1'),
+        Pin('/b.lock.yaml', 'linux-64', 'conda', 'openssl', '1.1.1', 'h1'),
+        Pin('/c.lock.yaml', '', 'conda', 'openssl', '1.1.1', 'h2'),
+    ]
+
+    def test_groups(self):
+        compare(render_groups(self.pins), expected=[
+            'openssl=1.1.1=h1 (2)',
+            '  /a.lock.yaml',
+            '  /b.lock.yaml [linux-64]',
+            'openssl=1.1.1=h2 (1)',
+            '  /c.lock.yaml',
+        ])
+
+    def test_matrix(self):
+        results = {
+            'openssl': self.pins,
+            'numpy': [Pin('/c.lock.yaml', '', 'pip', 'numpy', '1.23.5', None)],
+            'scipy': [],
+        }
+        compare(render_matrix(results), expected=[
+            'environment              openssl  numpy   scipy',
+            '/a.lock.yaml             1.1.1    -       -',
+            '/b.lock.yaml [linux-64]  1.1.1    -       -',
+            '/c.lock.yaml             1.1.1    1.23.5  -',
+        ])
@@ -1,7 +1,21 @@
+import json
+import os
+import pstats
+import subprocess
+from subprocess import CalledProcessError
+import sys
+
 import pytest
-from testfixtures import OutputCapture, Replacer, compare
+from testfixtures import OutputCapture, Replacer, compare, mock_time, not_there
+from testfixtures.mock import Mock
 
-from picky.main import main
+import picky
+from picky import sidecar
+from picky.env import Environment, add_digest, diff_text
+from picky.main import load_environment, main
+from picky.timing import Timings
+from picky.platforms import read_platform
+from tests.test_conda import make_prefix
 from tests.test_env import sample_serialized
 
 
@@ -21,18 +35,44 @@ dependencies:
 """
 
 
-def mock_conda_env_export(include_build=True):
+def mock_conda_env_export(include_build=True, prefix=None):
     if include_build:
         return sample_serialized
     else:
         return sample_serialized_no_build
 
 
-def run(argv, expected_output=''):
+def mock_conda_env_stream(include_build=True, prefix=None, timeout=None):
+    for line in mock_conda_env_export(include_build, prefix).splitlines(True):
+        yield line
+
+
+def mock_export_all(exports, timeout=None, retries=0, limit=None):
+    return [mock_conda_env_export(include_build, prefix).encode('utf-8')
+            for include_build, prefix in exports]
+
+
+def mock_conda_meta_environment(include_build=True, prefix=None, cache=None):
+    return Environment.from_string(mock_conda_env_export(include_build, prefix))
+
+
+def mock_cpu_times():
+    return 0.5, 2.0
+
+
+def run(argv, expected_output='', profile=not_there):
     with Replacer() as r:
+        r.replace('picky.timing.default_timer', mock_time(delta=0.25))
+        r.replace('picky.timing.cpu_times', mock_cpu_times)
         r.replace('sys.argv', ['x']+argv)
-        r.replace('picky.main.conda_env_export',
-                  mock_conda_env_export)
+        r.in_environ('CONDA_PREFIX', not_there)
+        r.in_environ('PICKY_SOCKET', not_there)
+        r.in_environ('PICKY_PROFILE', profile)
+        r.replace('picky.main.conda_env_stream',
+                  mock_conda_env_stream)
+        r.replace('picky.main.conda_meta_environment',
+                  mock_conda_meta_environment)
+        r.replace('picky.export.export_all', mock_export_all)
         with OutputCapture() as output:
             rc = main()
     output.compare(expected_output)
@@ -51,6 +91,89 @@ def test_lock_simple(tmpdir):
     compare(tmpdir.join('environment.lock.yaml').read(),
             expected=sample_serialized)
 
+
+def test_lock_no_cache(tmpdir):
+    rc = run(['--no-cache', 'lock'])
+    compare(rc, expected=None)
+    compare(tmpdir.join('environment.lock.yaml').read(),
+            expected=sample_serialized)
+
+
+def test_lock_native(tmpdir):
+    rc = run(['--backend', 'native', 'lock'])
+    compare(rc, expected=None)
+    compare(tmpdir.join('environment.lock.yaml').read(),
+            expected=sample_serialized)
+
+
+def test_lock_native_from_config(tmpdir):
+    tmpdir.join('picky.yaml').write('backend: native\ndetail: version\n')
+    rc = run(['lock'])
+    compare(rc, expected=None)
+    compare(tmpdir.join('environment.lock.yaml').read(),
+            expected=sample_serialized_no_build)
+
+
+def test_lock_timeout(tmpdir):
+    calls = []
+
+    def export(include_build=True, prefix=None, timeout=None, retries=0):
+        calls.append((timeout, retries))
+        return mock_conda_env_export(include_build, prefix)
+
+    with Replacer() as r:
+        r.replace('picky.main.conda_env_export', export)
+        rc = run(['--no-cache', '--timeout', '30', '--retries', '2', 'lock'])
+    compare(rc, expected=None)
+    compare(calls, expected=[(30, 2)])
+    compare(tmpdir.join('environment.lock.yaml').read(),
+            expected=sample_serialized)
+
+
+def test_lock_timeout_streams(tmpdir):
+    calls = []
+
+    original = mock_conda_env_stream
+
+    def stream(include_build=True, prefix=None, timeout=None):
+        calls.append(timeout)
+        return original(include_build, prefix)
+
+    with Replacer() as r:
+        r.replace('tests.test_main.mock_conda_env_stream', stream)
+        r.replace('picky.main.conda_env_export', None)
+        rc = run(['--no-cache', '--timeout', '30', 'lock'])
+    compare(rc, expected=None)
+    compare(calls, expected=[30])
+    compare(tmpdir.join('environment.lock.yaml').read(),
+            expected=sample_serialized)
+
+
+def test_lock_incremental_unchanged(tmpdir):
+    lock_file = tmpdir.join('environment.lock.yaml')
+    lock_file.write(sample_serialized)
+    lock_file.setmtime(1000000000)
+    rc = run(['lock', '--incremental'])
+    compare(rc, expected=None)
+    compare(lock_file.mtime(), expected=1000000000)
+
+
+def test_lock_incremental_changed(tmpdir):
+    lock_file = tmpdir.join('environment.lock.yaml')
+    lock_file.write(sample_serialized.replace('- defaults\n', '- bioconda\n- defaults\n')
+                                     .replace('attrs==17.4.0', 'attrs==17.3.0'))
+    rc = run(['lock', '--incremental'])
+    compare(rc, expected=None)
+    compare(lock_file.read(),
+            expected=sample_serialized)
+
+
+def test_lock_incremental_missing(tmpdir):
+    rc = run(['lock', '--incremental'])
+    compare(rc, expected=None)
+    compare(tmpdir.join('environment.lock.yaml').read(), expected=sample_serialized)
+
+
 sample_config = """
 ignore:
   - attrs
@@ -117,3 +240,760 @@ def test_check_not_okay(tmpdir):
     p.write('')
     rc = run(['check'], expected_output=not_okay_output)
     compare(rc, expected=1)
+
+
+json_output = """\
+{
+  "concrete": "environment.lock.yaml",
+  "matches": false,
+  "returncode": 1,
+  "changes": [
+    {
+      "kind": "channel-changed",
+      "section": "channels",
+      "name": "defaults",
+      "expected": null,
+      "actual": "defaults"
+    },
+    {
+      "kind": "version-changed",
+      "section": "conda",
+      "name": "certifi",
+      "expected": "certifi=2018.1.17=py36_0",
+      "actual": "certifi=2018.1.18=py36_0"
+    },
+    {
+      "kind": "added",
+      "section": "develop",
+      "name": ".",
+      "expected": null,
+      "actual": "-e ."
+    }
+  ],
+  "timings": {
+    "config": 0.25,
+    "export": 0.25,
+    "modify": 0.25,
+    "concrete": 0.25,
+    "diff": 0.25
+  }
+}
+"""
+
+
+different_serialized = (
+    sample_serialized
+    .replace('- defaults\n', '')
+    .replace('2018.1.18', '2018.1.17')
+    .replace('  - -e .\n', '')
+)
+
+
+def different_lock(tmpdir):
+    tmpdir.join('environment.lock.yaml').write(different_serialized)
+
+
+def test_check_json(tmpdir):
+    different_lock(tmpdir)
+    rc = run(['check', '--format', 'json'], expected_output=json_output)
+    compare(rc, expected=1)
+
+
+def test_check_json_okay(tmpdir):
+    tmpdir.join('environment.lock.yaml').write(sample_serialized)
+    with Replacer() as r:
+        r.replace('sys.argv', ['x', 'check', '--format', 'json'])
+        r.in_environ('CONDA_PREFIX', not_there)
+        r.replace('picky.main.conda_env_stream', mock_conda_env_stream)
+        with OutputCapture() as output:
+            rc = main()
+    compare(rc, expected=0)
+    data = json.loads(output.captured)
+    compare(data['changes'], expected=[])
+    compare(data['matches'], expected=True)
+    compare(list(data['timings']), expected=['config', 'export', 'modify', 'concrete', 'diff'])
+
+
+junit_output = """\
+<testsuite name="picky" tests="1" failures="1" errors="0" time="1.250000">\
+<properties>\
+<property name="time.config" value="0.250000" />\
+<property name="time.export" value="0.250000" />\
+<property name="time.modify" value="0.250000" />\
+<property name="time.concrete" value="0.250000" />\
+<property name="time.diff" value="0.250000" />\
+</properties>\
+<testcase classname="picky.check" name="environment.lock.yaml" time="1.250000">\
+<failure message="Expected environment does not match actual: 3 changes">\
+Expected environment does not match actual:
+--- expected
++++ actual
+@@ -1,11 +1,13 @@
+ channels:
+ - conda-forge
++- defaults
+ dependencies:
+ - ca-certificates=2018.03.07=0
+-- certifi=2018.1.17=py36_0
++- certifi=2018.1.18=py36_0
+ - libcxx=4.0.1=h579ed51_0
+ - pip:
+   - alabaster==0.7.10
+   - attrs==17.4.0
+   - urllib3==1.22
++  - -e .
+\x20
+</failure></testcase></testsuite>
+"""
+
+
+def test_check_junit(tmpdir):
+    different_lock(tmpdir)
+    rc = run(['check', '--format', 'junit'], expected_output=junit_output)
+    compare(rc, expected=1)
+
+
+def test_lock_digest(tmpdir):
+    rc = run(['lock', '--digest'])
+    compare(rc, expected=None)
+    text = tmpdir.join('environment.lock.yaml').read()
+    compare(text, expected=add_digest(sample_serialized, Environment.from_string(sample_serialized)))
+
+
+def test_lock_incremental_digest_unchanged(tmpdir):
+    lock_file = tmpdir.join('environment.lock.yaml')
+    lock_file.write(add_digest(sample_serialized, Environment.from_string(sample_serialized)))
+    lock_file.setmtime(1000000000)
+    rc = run(['lock', '--incremental', '--digest'])
+    compare(rc, expected=None)
+    compare(lock_file.mtime(), expected=1000000000)
+
+
+def test_lock_incremental_replaces_stale_digest(tmpdir):
+    lock_file = tmpdir.join('environment.lock.yaml')
+    old = sample_serialized.replace('attrs==17.4.0', 'attrs==17.3.0')
+    lock_file.write(add_digest(old, Environment.from_string(old)))
+    rc = run(['lock', '--incremental', '--digest'])
+    compare(rc, expected=None)
+    compare(lock_file.read(),
+            expected=add_digest(sample_serialized, Environment.from_string(sample_serialized)))
+
+
+@pytest.mark.parametrize('options', [[], ['--incremental']])
+def test_lock_keeps_digest(tmpdir, options):
+    lock_file = tmpdir.join('environment.lock.yaml')
+    run(['lock', '--digest'])
+    lock_file.setmtime(1000000000)
+    run(['lock'] + options)
+    expected = add_digest(sample_serialized, Environment.from_string(sample_serialized))
+    compare(lock_file.read(), expected=expected)
+    # nothing changed, so nothing was written:
+    compare(lock_file.mtime(), expected=1000000000)
+    with Replacer() as r:
+        r.replace('tests.test_main.sample_serialized', different_serialized)
+        run(['lock'] + options)
+    compare(lock_file.read(),
+            expected=add_digest(different_serialized,
+                                Environment.from_string(different_serialized)))
+
+
+def test_lock_no_digest_after_edit(tmpdir):
+    lock_file = tmpdir.join('environment.lock.yaml')
+    run(['lock', '--digest'])
+    lock_file.write(lock_file.read() + '# edited\n')
+    run(['lock'])
+    compare(lock_file.read(), expected=sample_serialized)
+
+
+def test_check_digest_matches(tmpdir):
+    tmpdir.join('environment.lock.yaml').write(
+        add_digest(sample_serialized, Environment.from_string(sample_serialized))
+    )
+    with Replacer() as r:
+        r.replace('picky.main.Environment.from_string', None)
+        rc = run(['check'])
+    compare(rc, expected=0)
+
+
+digest_json_output = """\
+{
+  "concrete": "environment.lock.yaml",
+  "matches": true,
+  "returncode": 0,
+  "changes": [],
+  "timings": {
+    "config": 0.25,
+    "export": 0.25,
+    "modify": 0.25,
+    "concrete": 0.25,
+    "diff": 0.25
+  }
+}
+"""
+
+
+def test_check_digest_json(tmpdir):
+    tmpdir.join('environment.lock.yaml').write(
+        add_digest(sample_serialized, Environment.from_string(sample_serialized))
+    )
+    with Replacer() as r:
+        r.replace('picky.main.changes', None)
+        rc = run(['check', '--format', 'json'], expected_output=digest_json_output)
+    compare(rc, expected=0)
+
+
+def test_check_digest_stale(tmpdir):
+    old = sample_serialized.replace('2018.1.18', '2018.1.17')
+    tmpdir.join('environment.lock.yaml').write(add_digest(old, Environment.from_string(old)))
+    diff_text = Mock(return_value='different\n')
+    with Replacer() as r:
+        r.replace('picky.main.diff_text', diff_text)
+        rc = run(['check'], expected_output='different')
+    compare(rc, expected=1)
+    expected_env, current_env = diff_text.call_args[0]
+    compare(expected_env, strict=True, expected=Environment.from_string(old))
+
+
+def test_lock_and_check_platforms(tmpdir):
+    lock_file = tmpdir.join('environment.lock.yaml')
+    run(['lock', '--platform', 'linux-aarch64'])
+    with Replacer() as r:
+        r.replace('tests.test_main.sample_serialized',
+                  sample_serialized.replace('h579ed51_0', 'h0000000_0'))
+        run(['lock', '--platform', 'linux-64'])
+        # the existing file is multi-platform, so the current platform is used:
+        r.in_environ('CONDA_SUBDIR', 'linux-64')
+        run(['lock'])
+    assert lock_file.read().startswith('# picky-platforms: shared=')
+    compare(run(['check', '--platform', 'linux-aarch64']), expected=0)
+    run(['check', '--platform', 'linux-64'], expected_output=(
+        'Expected environment does not match actual:\n'
+        '--- expected\n'
+        '+++ actual\n'
+        '@@ -4,7 +4,7 @@\n'
+        ' dependencies:\n'
+        ' - ca-certificates=2018.03.07=0\n'
+        ' - certifi=2018.1.18=py36_0\n'
+        '-- libcxx=4.0.1=h0000000_0\n'
+        '+- libcxx=4.0.1=h579ed51_0\n'
+        ' - pip:\n'
+        '   - alabaster==0.7.10\n'
+        '   - attrs==17.4.0\n'
+    ))
+
+
+@pytest.mark.parametrize('option', ['--digest', '--sidecar'])
+def test_lock_platform_unsupported_options(tmpdir, option):
+    with pytest.raises(ValueError) as info:
+        run(['lock', '--platform', 'linux-64', option])
+    compare(str(info.value), expected=(
+        'Digests and sidecars are not supported for multi-platform '
+        'concrete files such as environment.lock.yaml'
+    ))
+    assert not tmpdir.join('environment.lock.yaml').exists()
+
+
+def test_lock_platform_incremental(tmpdir):
+    lock_file = tmpdir.join('environment.lock.yaml')
+    run(['lock', '--platform', 'linux-64'])
+    lock_file.setmtime(0)
+    run(['lock', '--platform', 'linux-64', '--incremental'])
+    compare(lock_file.mtime(), expected=0)
+    with Replacer() as r:
+        r.replace('tests.test_main.sample_serialized', different_serialized)
+        run(['lock', '--platform', 'linux-64', '--incremental'])
+    assert lock_file.mtime() != 0
+    compare(read_platform(str(lock_file), 'linux-64'),
+            expected=Environment.from_string(different_serialized))
+
+
+different_output = diff_text(Environment.from_string(different_serialized),
+                             Environment.from_string(sample_serialized))
+
+
+def test_lock_sidecar(tmpdir):
+    rc = run(['lock', '--sidecar'])
+    compare(rc, expected=None)
+    path = str(tmpdir.join('environment.lock.yaml'))
+    table = sidecar.load(path, sample_serialized)
+    assert table.matches(Environment.from_string(sample_serialized))
+    table.close()
+
+
+def test_check_watch(tmpdir):
+    concrete = tmpdir.join('environment.lock.yaml')
+    concrete.write(sample_serialized)
+
+    def mock_bursts(watcher, debounce):
+        compare(debounce, expected=0.5)
+        concrete.write(different_serialized)
+        yield
+        # a burst that leaves the result the same prints nothing:
+        yield
+        concrete.write(sample_serialized)
+        yield
+        raise KeyboardInterrupt
+
+    with Replacer() as r:
+        r.replace('picky.watch.bursts', mock_bursts)
+        rc = run(['check', '--watch'], expected_output=(
+            'environment.lock.yaml: OK\n'
+            'environment.lock.yaml: does not match\n' +
+            different_output +
+            'environment.lock.yaml: OK\n'
+        ))
+    compare(rc, expected=0)
+
+
+def test_check_watch_error(tmpdir):
+    def mock_bursts(watcher, debounce):
+        raise KeyboardInterrupt
+        yield
+
+    with Replacer() as r:
+        r.replace('picky.watch.bursts', mock_bursts)
+        rc = run(['check', '--watch'], expected_output=(
+            "environment.lock.yaml: error\n"
+            "Error: [Errno 2] No such file or directory: 'environment.lock.yaml'\n"
+        ))
+    compare(rc, expected=2)
+
+
+def test_check_sidecar(tmpdir):
+    run(['lock', '--sidecar'])
+    with Replacer() as r:
+        r.replace('picky.main.Environment.from_string', None)
+        compare(run(['check']), expected=0)
+        different_lock(tmpdir)
+        lock_file = str(tmpdir.join('environment.lock.yaml'))
+        with open(lock_file) as source:
+            text = source.read()
+        sidecar.write(lock_file, Environment.from_lines(text.splitlines(True)), text)
+        rc = run(['check'], expected_output=different_output)
+    compare(rc, expected=1)
+
+
+def test_check_stale_sidecar_rebuilt(tmpdir):
+    run(['lock', '--sidecar'])
+    different_lock(tmpdir)
+    lock_file = str(tmpdir.join('environment.lock.yaml'))
+    compare(sidecar.load(lock_file, tmpdir.join('environment.lock.yaml').read()),
+            expected=None)
+    rc = run(['check'], expected_output=different_output)
+    compare(rc, expected=1)
+    table = sidecar.load(lock_file, tmpdir.join('environment.lock.yaml').read())
+    assert not table.matches(Environment.from_string(sample_serialized))
+    table.close()
+
+
+profile_output = """\
+phase            wall        cpu  child cpu
+config          0.250      0.000      0.000
+export          0.250      0.000      0.000
+modify          0.250      0.000      0.000
+lock            0.250      0.000      0.000
+total           1.000      0.000      0.000
+"""
+
+
+def test_profile_stderr(tmpdir):
+    rc = run(['--profile', 'lock'], expected_output=profile_output)
+    compare(rc, expected=None)
+    compare(tmpdir.join('environment.lock.yaml').read(),
+            expected=sample_serialized)
+
+
+def test_profile_text_file_from_environment(tmpdir):
+    rc = run(['lock'], profile='profile.txt')
+    compare(rc, expected=None)
+    compare(tmpdir.join('profile.txt').read(), expected=profile_output)
+
+
+def test_profile_chrome_trace(tmpdir):
+    tmpdir.join('environment.lock.yaml').write(sample_serialized)
+    rc = run(['--profile-output', 'trace.json', 'check'])
+    compare(rc, expected=0)
+    trace = json.loads(tmpdir.join('trace.json').read())
+    compare([(event['name'], event['ph'], event['ts'], event['dur'])
+             for event in trace['traceEvents']], expected=[
+        ('config', 'X', 0, 250000),
+        ('export', 'X', 500000, 250000),
+        ('modify', 'X', 1000000, 250000),
+        ('concrete', 'X', 1500000, 250000),
+        ('diff', 'X', 2000000, 250000),
+    ])
+    compare(trace['traceEvents'][0]['args'], expected={'cpu': 0, 'child_cpu': 0})
+
+
+def test_profile_pstats(tmpdir):
+    rc = run(['--profile-output', 'picky.pstats', 'lock'], expected_output=profile_output)
+    compare(rc, expected=None)
+    stats = pstats.Stats(str(tmpdir.join('picky.pstats')))
+    assert any(name == 'lock' for _, _, name in stats.stats)
+
+
+def test_profile_skips_server(tmpdir):
+    request = Mock()
+    with Replacer() as r:
+        r.replace('picky.main.request', request)
+        rc = run(['--profile', 'lock'], expected_output=profile_output)
+    compare(rc, expected=None)
+    request.assert_not_called()
+
+
+def write_manifest(tmpdir, *entries):
+    manifest = tmpdir.join('manifest.yaml')
+    manifest.write(''.join(
+        '- prefix: {}\n  concrete: {}\n'.format(prefix, concrete)
+        for prefix, concrete in entries
+    ))
+    return str(manifest)
+
+
+check_all_output = """\
+{tmpdir}/env-a ({tmpdir}/a.lock.yaml): OK
+{tmpdir}/env-b ({tmpdir}/b.lock.yaml): does not match
+Expected environment does not match actual:
+--- expected
++++ actual
+@@ -1,3 +1,13 @@
+-channels: []
+-dependencies: []
++channels:
++- conda-forge
++- defaults
++dependencies:
++- ca-certificates=2018.03.07=0
++- certifi=2018.1.18=py36_0
++- libcxx=4.0.1=h579ed51_0
++- pip:
++  - alabaster==0.7.10
++  - attrs==17.4.0
++  - urllib3==1.22
++  - -e .
+\x20
+{tmpdir}/env-c ({tmpdir}/c.lock.yaml): error
+Error: [Errno 2] No such file or directory: '{tmpdir}/c.lock.yaml'
+3 environments checked, 2 failed.
+"""
+
+
+def test_check_all_serial(tmpdir):
+    tmpdir.join('a.lock.yaml').write(sample_serialized)
+    tmpdir.join('b.lock.yaml').write('')
+    manifest = write_manifest(tmpdir,
+                              ('env-a', 'a.lock.yaml'),
+                              ('env-b', 'b.lock.yaml'),
+                              ('env-c', 'c.lock.yaml'))
+    rc = run(['check-all', '--jobs', '1', manifest],
+             expected_output=check_all_output.format(tmpdir=tmpdir))
+    compare(rc, expected=2)
+
+
+def test_check_all_pool(tmpdir):
+    with Replacer() as r:
+        r.in_environ('HOME', str(tmpdir))
+        r.in_environ('CONDARC', not_there)
+        r.in_environ('CONDA_ROOT', not_there)
+        entries = []
+        for name in 'a', 'b', 'c':
+            make_prefix(tmpdir.mkdir(name).mkdir('package'))
+            tmpdir.join(name, 'environment.lock.yaml').write(sample_serialized)
+            entries.append((name+'/package', name+'/environment.lock.yaml'))
+        manifest = write_manifest(tmpdir, *entries)
+        rc = run(['--backend', 'native', 'check-all', '--jobs', '2', manifest],
+                 expected_output=''.join(
+                     '{0}/{1}/package ({0}/{1}/environment.lock.yaml): OK\n'.format(
+                         tmpdir, name
+                     ) for name in 'abc'
+                 ) + '3 environments checked, 0 failed.\n')
+    compare(rc, expected=0)
+
+
+def test_check_all_exports_together(tmpdir):
+    tmpdir.join('a.lock.yaml').write(sample_serialized)
+    tmpdir.join('b.lock.yaml').write(sample_serialized)
+    tmpdir.join('picky.yaml').write('detail: version\n')
+    manifest = tmpdir.join('manifest.yaml')
+    manifest.write('- prefix: env-a\n  concrete: a.lock.yaml\n'
+                   '- prefix: env-b\n  concrete: b.lock.yaml\n  config: missing.yaml\n')
+    calls = []
+
+    def export_all(exports, timeout=None, retries=0, limit=None):
+        calls.append((exports, timeout, retries, limit))
+        return [CalledProcessError(1, ['conda']),
+                sample_serialized.encode('utf-8')]
+
+    with Replacer() as r:
+        r.replace('tests.test_main.mock_export_all', export_all)
+        rc = run(['--no-cache', '--timeout', '5', '--retries', '1',
+                  'check-all', '-j', '3', str(manifest)], expected_output=(
+            "{0}/env-a ({0}/a.lock.yaml): error\n"
+            "Error: Command '['conda']' returned non-zero exit status 1.\n"
+            "{0}/env-b ({0}/b.lock.yaml): OK\n"
+            "2 environments checked, 1 failed.\n"
+        ).format(tmpdir))
+    compare(rc, expected=2)
+    compare(calls, expected=[(
+        [(False, str(tmpdir.join('env-a'))), (True, str(tmpdir.join('env-b')))], 5, 1, 3
+    )])
+
+
+def test_lock_all_uses_export_cache(tmpdir):
+    with Replacer() as r:
+        r.in_environ('PICKY_CACHE_DIR', str(tmpdir.join('cache')))
+        make_prefix(tmpdir.mkdir('a'))
+        manifest = write_manifest(tmpdir, ('a', 'a.lock.yaml'))
+        export_all = Mock(side_effect=mock_export_all)
+        r.replace('tests.test_main.mock_export_all', export_all)
+        for _ in range(2):
+            run(['lock-all', manifest], expected_output=(
+                '{0}/a ({0}/a.lock.yaml): locked\n'
+                '1 environments locked, 0 failed.\n'
+            ).format(tmpdir))
+    compare(len(export_all.mock_calls), expected=1)
+    compare(tmpdir.join('a.lock.yaml').read(), expected=sample_serialized)
+
+
+class TestLoadTimings(object):
+
+    @pytest.fixture(autouse=True)
+    def environ(self, tmpdir):
+        with Replacer() as r:
+            r.in_environ('PICKY_CACHE_DIR', str(tmpdir.join('cache')))
+            r.replace('picky.main.conda_env_stream', mock_conda_env_stream)
+            yield r
+
+    def load(self, **kw):
+        timings = Timings()
+        env = load_environment(timings=timings, **kw)
+        compare(env, expected=Environment.from_string(sample_serialized))
+        return list(timings)
+
+    def test_streamed(self, tmpdir):
+        # parsed as it is exported, so there's no separate parse phase:
+        prefix = make_prefix(tmpdir.mkdir('a'))
+        compare(self.load(prefix=prefix), expected=['export'])
+        compare(self.load(prefix=prefix, cache=False), expected=['export'])
+
+    def test_cached(self, tmpdir):
+        prefix = make_prefix(tmpdir.mkdir('a'))
+        self.load(prefix=prefix)
+        compare(self.load(prefix=prefix), expected=['export', 'parse'])
+
+    def test_retries(self, environ):
+        export = Mock(return_value=sample_serialized.encode('utf-8'))
+        environ.replace('picky.main.conda_env_export', export)
+        compare(self.load(cache=False, retries=1), expected=['export', 'parse'])
+
+
+@pytest.mark.parametrize('command', ['check-all', 'lock-all', 'restore'])
+def test_jobs_must_be_positive(tmpdir, command):
+    with OutputCapture() as output:
+        with pytest.raises(SystemExit) as info:
+            with Replacer() as r:
+                r.replace('sys.argv', ['picky', command, '--jobs', '0', 'manifest.yaml'])
+                main()
+    compare(info.value.code, expected=2)
+    assert "argument -j/--jobs: must be at least 1, not 0" in output.captured, output.captured
+
+
+def test_check_all_manifest_missing_prefix(tmpdir):
+    manifest = tmpdir.join('manifest.yaml')
+    manifest.write('- concrete: a.lock.yaml\n')
+    with pytest.raises(ValueError) as info:
+        run(['check-all', str(manifest)])
+    compare(str(info.value),
+            expected='{} has an entry with no prefix'.format(manifest))
+
+
+def test_lock_history(tmpdir):
+    with Replacer() as r:
+        r.replace('picky.main.time', Mock(side_effect=[86400.0, 90000.0]))
+        run(['lock', '--history'])
+        # once the history exists, it is kept up to date:
+        r.replace('tests.test_main.sample_serialized', different_serialized)
+        run(['lock'])
+    run(['history'], expected_output=(
+        '#0 1970-01-02 00:00:00\n'
+        '#1 1970-01-02 01:00:00\n'
+    ))
+    run(['history', '--snapshot', '0'], expected_output=sample_serialized)
+    run(['history', '--at', '1970-01-02T00:30:00'], expected_output=sample_serialized)
+    run(['history', '--at', '1970-01-02T02:30:00+01:00'], expected_output=different_serialized)
+    run(['history', '--package', 'certifi'], expected_output=(
+        '1970-01-02 00:00:00 #0 conda added: certifi=2018.1.18=py36_0\n'
+        '1970-01-02 01:00:00 #1 conda version-changed: '
+        'certifi=2018.1.18=py36_0 -> certifi=2018.1.17=py36_0\n'
+    ))
+
+
+def test_history_multi_platform(tmpdir):
+    with Replacer() as r:
+        r.replace('picky.main.time', Mock(return_value=86400.0))
+        r.in_environ('CONDA_SUBDIR', 'linux-64')
+        run(['lock', '--platform', 'linux-64', '--history'])
+        # the current platform is used, as it is by check and lock:
+        rc = run(['history'], expected_output='#0 1970-01-02 00:00:00\n')
+        compare(rc, expected=0)
+    run(['history', '--platform', 'linux-64', '--snapshot', '0'],
+        expected_output=sample_serialized)
+    rc = run(['history', '--platform', 'osx-64'], expected_output=(
+        'No history found at environment.lock.yaml.osx-64.history\n'
+    ))
+    compare(rc, expected=1)
+
+
+def test_history_missing(tmpdir):
+    rc = run(['history'], expected_output='No history found at environment.lock.yaml.history\n')
+    compare(rc, expected=1)
+
+
+def test_history_before_first_snapshot(tmpdir):
+    with Replacer() as r:
+        r.replace('picky.main.time', Mock(return_value=86400.0))
+        run(['lock', '--history'])
+    rc = run(['history', '--at', '1970-01-01'],
+             expected_output='No snapshot at or before 1970-01-01\n')
+    compare(rc, expected=1)
+
+
+def test_lock_no_history_by_default(tmpdir):
+    run(['lock'])
+    assert not tmpdir.join('environment.lock.yaml.history').exists()
+
+
+def test_restore(tmpdir):
+    channel = tmpdir.mkdir('channel').mkdir('noarch')
+    channel.join('six-1.11.0-py_0.tar.bz2').write('six')
+    tmpdir.join('environment.lock.explicit.txt').write(
+        '@EXPLICIT\nfile://{}/six-1.11.0-py_0.tar.bz2\n'.format(channel)
+    )
+    pkgs = tmpdir.join('pkgs')
+    with Replacer() as r:
+        check_call = Mock()
+        r.replace('picky.explicit.check_call', check_call)
+        rc = run(['restore', '--prefix', 'restored', '--pkgs-dir', str(pkgs), '-j', '1'],
+                 expected_output='1 conda and 0 pip packages installed into restored.\n')
+    compare(rc, expected=0)
+    compare(len(check_call.mock_calls), expected=1)
+    compare(pkgs.join('six-1.11.0-py_0.tar.bz2').read(), expected='six')
+
+
+def test_restore_platform(tmpdir):
+    run(['lock', '--platform', 'linux-64'])
+    for platform in 'linux-64', 'osx-64':
+        channel = tmpdir.mkdir(platform)
+        channel.join('six-1.11.0-py_0.tar.bz2').write(platform)
+        tmpdir.join('environment.lock.{}.explicit.txt'.format(platform)).write(
+            '@EXPLICIT\nfile://{}/six-1.11.0-py_0.tar.bz2\n'.format(channel)
+        )
+    with Replacer() as r:
+        r.replace('picky.explicit.check_call', Mock())
+        r.in_environ('CONDA_SUBDIR', 'linux-64')
+        run(['restore', '--prefix', 'restored', '--pkgs-dir', 'linux'],
+            expected_output='1 conda and 0 pip packages installed into restored.\n')
+        run(['restore', '--prefix', 'restored', '--pkgs-dir', 'osx', '--platform', 'osx-64'],
+            expected_output='1 conda and 0 pip packages installed into restored.\n')
+    compare(tmpdir.join('linux', 'six-1.11.0-py_0.tar.bz2').read(), expected='linux-64')
+    compare(tmpdir.join('osx', 'six-1.11.0-py_0.tar.bz2').read(), expected='osx-64')
+
+
+def test_index_and_query(tmpdir):
+    one = tmpdir.mkdir('one').join('environment.lock.yaml')
+    one.write(sample_serialized)
+    two = tmpdir.mkdir('two').join('environment.lock.yaml')
+    two.write(different_serialized)
+    database = str(tmpdir.join('index.sqlite'))
+    run(['index', '--database', database],
+        expected_output='2 files parsed, 0 unchanged, 0 removed, 0 skipped.\n')
+    run(['index', '--database', database, str(tmpdir)],
+        expected_output='0 files parsed, 2 unchanged, 0 removed, 0 skipped.\n')
+    rc = run(['query', '--database', database, 'certifi<2018.1.18'],
+             expected_output='{}: certifi=2018.1.17=py36_0\n'.format(two))
+    compare(rc, expected=0)
+    run(['query', '--database', database, '--group', 'libcxx'], expected_output=(
+        'libcxx=4.0.1=h579ed51_0 (2)\n'
+        '  {}\n'
+        '  {}\n'.format(one, two)
+    ))
+    run(['query', '--database', database, '--matrix', 'certifi', 'attrs'], expected_output=(
+        'environment{}  certifi    attrs\n'
+        '{}  2018.1.18  17.4.0\n'
+        '{}  2018.1.17  17.4.0\n'
+    ).format(' ' * (len(str(one)) - len('environment')), one, two))
+
+
+def test_index_bad_file(tmpdir):
+    tmpdir.mkdir('one').join('environment.lock.yaml').write(sample_serialized)
+    bad = tmpdir.mkdir('two').join('environment.lock.yaml')
+    bad.write_binary(b'\xff')
+    database = str(tmpdir.join('index.sqlite'))
+    rc = run(['index', '--database', database], expected_output=(
+        "{}: error: 'utf-8' codec can't decode byte 0xff in position 0: "
+        "invalid start byte\n"
+        "1 files parsed, 0 unchanged, 0 removed, 1 skipped.\n"
+    ).format(bad))
+    compare(rc, expected=2)
+
+
+def test_query_no_matches(tmpdir):
+    database = str(tmpdir.join('index.sqlite'))
+    rc = run(['query', '--database', database, 'numpy'])
+    compare(rc, expected=1)
+
+
+def test_lock_all(tmpdir):
+    with Replacer() as r:
+        r.in_environ('HOME', str(tmpdir))
+        r.in_environ('CONDARC', not_there)
+        r.in_environ('CONDA_ROOT', not_there)
+        for name in 'a', 'b':
+            make_prefix(tmpdir.mkdir(name).mkdir('package'))
+        tmpdir.join('b', 'environment.lock.yaml').write(sample_serialized)
+        manifest = write_manifest(tmpdir,
+                                  ('a/package', 'a/environment.lock.yaml'),
+                                  ('b/package', 'b/environment.lock.yaml'),
+                                  ('c/package', 'c/environment.lock.yaml'))
+        rc = run(['--backend', 'native', 'lock-all', '--jobs', '2', manifest],
+                 expected_output=(
+                     '{0}/a/package ({0}/a/environment.lock.yaml): locked\n'
+                     '{0}/b/package ({0}/b/environment.lock.yaml): locked\n'
+                     '{0}/c/package ({0}/c/environment.lock.yaml): error: '
+                     "[Errno 2] No such file or directory: '{0}/c/environment.lock.yaml'\n"
+                     '3 environments locked, 1 failed.\n'
+                 ).format(tmpdir))
+    compare(rc, expected=2)
+    for name in 'a', 'b':
+        compare(tmpdir.join(name, 'environment.lock.yaml').read(),
+                expected=sample_serialized)
+    assert not tmpdir.join('c', 'environment.lock.yaml').exists()
+
+
+def test_lock_all_digest(tmpdir):
+    manifest = write_manifest(tmpdir, ('env-a', 'a.lock.yaml'))
+    rc = run(['lock-all', '--digest', manifest], expected_output=(
+        '{0}/env-a ({0}/a.lock.yaml): locked\n'
+        '1 environments locked, 0 failed.\n'
+    ).format(tmpdir))
+    compare(rc, expected=0)
+    compare(tmpdir.join('a.lock.yaml').read(),
+            expected=add_digest(sample_serialized, Environment.from_string(sample_serialized)))
+
+
+def test_startup_imports():
+    # picky runs in git hooks, so anything only some commands need
+    # should be imported when it's used rather than at startup:
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', 'import picky.main'],
+        stderr=subprocess.PIPE, universal_newlines=True,
+        cwd=os.path.dirname(os.path.dirname(picky.__file__)),
+    )
+    _, stderr = process.communicate()
+    compare(process.returncode, expected=0)
+    imported = set(line.rsplit('|', 1)[-1].strip() for line in stderr.splitlines())
+    compare(imported & {'yaml', 'picky.oyaml', 'multiprocessing', 'difflib',
+                        'xml.etree.ElementTree', 'cProfile', 'picky.server',
+                        'picky.watch', 'sqlite3', 'picky.explicit',
+                        'urllib.request'},
+            expected=set())
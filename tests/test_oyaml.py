@@ -0,0 +1,24 @@
+from collections import OrderedDict
+
+from testfixtures import compare
+
+from picky import oyaml
+from tests.test_env import sample_export
+
+
+def test_load_matches_pure_python():
+    compare(oyaml.safe_load(sample_export),
+            expected=oyaml.load(sample_export, Loader=oyaml.SafeLoader))
+
+
+def test_dump_matches_pure_python():
+    data = OrderedDict([('name', 'x'), ('channels', ['b', 'a'])])
+    compare(oyaml.safe_dump(data, default_flow_style=False),
+            expected=oyaml.dump_all([data], Dumper=oyaml.SafeDumper,
+                                    default_flow_style=False))
+
+
+def test_dump_keeps_order():
+    data = OrderedDict([('z', 1), ('a', 2)])
+    compare(oyaml.safe_dump(data, default_flow_style=False),
+            expected='z: 1\na: 2\n')
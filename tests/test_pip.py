@@ -0,0 +1,134 @@
+import json
+from collections import OrderedDict
+
+import pytest
+from testfixtures import compare
+
+from picky.env import PackageSpec
+from picky.pip import (
+    archive_hash, editable_location, metadata_version, pip_hashes, pip_packages,
+)
+
+
+@pytest.fixture()
+def site_packages(tmpdir):
+    return tmpdir.mkdir('lib').mkdir('python3.7').mkdir('site-packages')
+
+
+def write_direct_url(dist_info, url, editable):
+    dist_info.join('direct_url.json').write(json.dumps({
+        'url': url, 'dir_info': {'editable': editable},
+    }))
+
+
+class TestPipPackages(object):
+
+    def test_empty(self, tmpdir):
+        compare(pip_packages(str(tmpdir), []), expected=(OrderedDict(), OrderedDict()))
+
+    def test_names_and_versions(self, tmpdir, site_packages):
+        site_packages.mkdir('Foo.Bar-1.0.dist-info').join('METADATA').write(
+            'Metadata-Version: 2.1\nName: Foo.Bar\nVersion: 1.0.post1\n\n'
+        )
+        site_packages.join('baz_qux-2.0-py3.7.egg-info').write(
+            'Metadata-Version: 1.1\nName: baz_qux\nVersion: 2.0\n'
+        )
+        pip, develop = pip_packages(str(tmpdir), [])
+        compare(pip, expected=OrderedDict([
+            ('baz-qux', PackageSpec('==', 'baz-qux', '2.0')),
+            ('foo-bar', PackageSpec('==', 'foo-bar', '1.0.post1')),
+        ]))
+        compare(develop, expected=OrderedDict())
+
+    def test_owned_by_conda(self, tmpdir, site_packages):
+        site_packages.mkdir('six-1.11.0.dist-info')
+        records = [{'files': ['lib/python3.7/site-packages/six-1.11.0.dist-info/RECORD']}]
+        compare(pip_packages(str(tmpdir), records), expected=(OrderedDict(), OrderedDict()))
+
+    def test_editable_direct_url(self, tmpdir, site_packages):
+        source = tmpdir.mkdir('src')
+        write_direct_url(site_packages.mkdir('mypackage-0.1.dist-info'),
+                         'file://' + str(source), editable=True)
+        pip, develop = pip_packages(str(tmpdir), [])
+        compare(pip, expected=OrderedDict())
+        compare(develop, expected=OrderedDict([
+            (str(source), PackageSpec(' ', '-e', str(source))),
+        ]))
+
+    def test_egg_link(self, tmpdir, site_packages):
+        site_packages.join('mypackage.egg-link').write('/src/mypackage\n.')
+        compare(pip_packages(str(tmpdir), [])[1], expected=OrderedDict([
+            ('/src/mypackage', PackageSpec(' ', '-e', '/src/mypackage')),
+        ]))
+
+    def test_first_site_packages_wins(self, tmpdir, site_packages):
+        site_packages.mkdir('six-1.11.0.dist-info')
+        tmpdir.join('lib').mkdir('python3.8').mkdir('site-packages').mkdir(
+            'six-1.10.0.dist-info'
+        )
+        compare(pip_packages(str(tmpdir), [])[0], expected=OrderedDict([
+            ('six', PackageSpec('==', 'six', '1.11.0')),
+        ]))
+
+
+class TestEditableLocation(object):
+
+    def test_not_editable(self, tmpdir):
+        write_direct_url(tmpdir, 'file:///src/package', editable=False)
+        compare(editable_location(str(tmpdir)), expected=None)
+
+    def test_not_local(self, tmpdir):
+        write_direct_url(tmpdir, 'https://example.com/package.git', editable=True)
+        compare(editable_location(str(tmpdir)), expected=None)
+
+    def test_missing(self, tmpdir):
+        compare(editable_location(str(tmpdir)), expected=None)
+
+    def test_invalid(self, tmpdir):
+        tmpdir.join('direct_url.json').write('{')
+        compare(editable_location(str(tmpdir)), expected=None)
+
+
+def write_archive_info(dist_info, archive_info):
+    dist_info.join('direct_url.json').write(json.dumps({
+        'url': 'https://example.com/package.whl', 'archive_info': archive_info,
+    }))
+
+
+class TestArchiveHash(object):
+
+    def test_hashes(self, tmpdir):
+        write_archive_info(tmpdir, {'hashes': {'md5': 'abc', 'sha256': 'def'}})
+        compare(archive_hash(str(tmpdir)), expected='sha256:def')
+
+    def test_legacy_hash(self, tmpdir):
+        write_archive_info(tmpdir, {'hash': 'sha256=def'})
+        compare(archive_hash(str(tmpdir)), expected='sha256:def')
+
+    def test_no_hash(self, tmpdir):
+        write_archive_info(tmpdir, {})
+        compare(archive_hash(str(tmpdir)), expected=None)
+
+    def test_not_archive(self, tmpdir):
+        write_direct_url(tmpdir, 'file:///src/package', editable=False)
+        compare(archive_hash(str(tmpdir)), expected=None)
+
+    def test_missing(self, tmpdir):
+        compare(archive_hash(str(tmpdir)), expected=None)
+
+
+def test_pip_hashes(tmpdir, site_packages):
+    write_archive_info(site_packages.mkdir('Foo.Bar-1.0.dist-info'),
+                       {'hashes': {'sha256': 'abc'}})
+    site_packages.mkdir('six-1.11.0.dist-info')
+    compare(pip_hashes(str(tmpdir)), expected={'foo-bar': 'sha256:abc'})
+
+
+class TestMetadataVersion(object):
+
+    def test_no_metadata(self, tmpdir):
+        compare(metadata_version(str(tmpdir), '1.0'), expected='1.0')
+
+    def test_only_headers_read(self, tmpdir):
+        tmpdir.join('PKG-INFO').write('Name: x\n\nVersion: 2.0\n')
+        compare(metadata_version(str(tmpdir), '1.0'), expected='1.0')
@@ -0,0 +1,131 @@
+from collections import OrderedDict
+
+import pytest
+from testfixtures import Replacer, ShouldRaise, compare, not_there
+
+from picky.env import PackageSpec
+from picky.platforms import current_platform, read_all, read_platform, render, split
+from tests.test_env import sample_env, sample_serialized
+
+
+@pytest.fixture()
+def envs():
+    aarch64 = sample_env.copy()
+    aarch64['channels'].append('arm')
+    aarch64['conda']['libcxx'] = PackageSpec('=', 'libcxx', '4.0.1', 'hbeef000_0')
+    aarch64['conda']['libgcc'] = PackageSpec('=', 'libgcc', '7.2.0', '0')
+    return OrderedDict([('linux-aarch64', aarch64), ('linux-64', sample_env.copy())])
+
+
+expected_render = """\
+# picky-platforms: shared=0000000115+0000000195 linux-64=0000000335+0000000053 \
+linux-aarch64=0000000418+0000000073
+name: package
+channels:
+- conda-forge
+- defaults
+dependencies:
+- ca-certificates=2018.03.07=0
+- certifi=2018.1.18=py36_0
+- pip:
+  - alabaster==0.7.10
+  - attrs==17.4.0
+  - urllib3==1.22
+  - -e .
+---
+# platform: linux-64
+channels: []
+dependencies:
+- libcxx=4.0.1=h579ed51_0
+---
+# platform: linux-aarch64
+channels:
+- arm
+dependencies:
+- libcxx=4.0.1=hbeef000_0
+- libgcc=7.2.0=0
+"""
+
+
+class TestSplit(object):
+
+    def test_shared(self, envs):
+        shared, specific = split(envs)
+        compare(shared['channels'], expected=['conda-forge', 'defaults'])
+        compare(list(shared['conda']), expected=['ca-certificates', 'certifi'])
+        compare(shared['pip'], expected=sample_env['pip'])
+        compare(shared['develop'], expected=sample_env['develop'])
+        compare(specific['linux-64']['conda'], expected=OrderedDict([
+            ('libcxx', sample_env['conda']['libcxx']),
+        ]))
+        compare(specific['linux-aarch64']['channels'], expected=['arm'])
+
+    def test_single(self):
+        shared, specific = split({'linux-64': sample_env})
+        compare(shared, strict=True, expected=sample_env)
+        compare(specific['linux-64']['conda'], expected=OrderedDict())
+
+
+class TestReadWrite(object):
+
+    def test_render(self, envs):
+        compare(render(envs), expected=expected_render)
+
+    def test_read_platform(self, envs, tmpdir):
+        path = tmpdir.join('environment.lock.yaml')
+        path.write(render(envs))
+        for name, env in envs.items():
+            compare(read_platform(str(path), name), strict=True, expected=env)
+
+    def test_read_only_what_is_needed(self, envs, tmpdir):
+        path = tmpdir.join('environment.lock.yaml')
+        path.write(render(envs).replace('libgcc=7.2.0=0', 'not: [valid'))
+        compare(read_platform(str(path), 'linux-64'), strict=True, expected=envs['linux-64'])
+
+    def test_read_current_platform(self, envs, tmpdir):
+        path = tmpdir.join('environment.lock.yaml')
+        path.write(render(envs))
+        with Replacer() as r:
+            r.in_environ('CONDA_SUBDIR', 'linux-aarch64')
+            compare(read_platform(str(path)), strict=True, expected=envs['linux-aarch64'])
+
+    def test_missing_platform(self, envs, tmpdir):
+        path = tmpdir.join('environment.lock.yaml')
+        path.write(render(envs))
+        with ShouldRaise(ValueError('{} has no environment for osx-64'.format(path))):
+            read_platform(str(path), 'osx-64')
+
+    def test_not_multi_platform(self, tmpdir):
+        path = tmpdir.join('environment.lock.yaml')
+        path.write(sample_serialized)
+        compare(read_platform(str(path), 'linux-64'), expected=None)
+
+    def test_read_all(self, envs, tmpdir):
+        path = tmpdir.join('environment.lock.yaml')
+        path.write(render(envs))
+        compare(read_all(str(path)), expected=OrderedDict([
+            ('linux-64', envs['linux-64']), ('linux-aarch64', envs['linux-aarch64']),
+        ]))
+
+
+class TestCurrentPlatform(object):
+
+    @pytest.mark.parametrize('platform, machine, expected', [
+        ('linux', 'x86_64', 'linux-64'),
+        ('linux', 'aarch64', 'linux-aarch64'),
+        ('linux', 'ppc64le', 'linux-ppc64le'),
+        ('darwin', 'x86_64', 'osx-64'),
+        ('darwin', 'arm64', 'osx-arm64'),
+        ('win32', 'AMD64', 'win-64'),
+    ])
+    def test_detected(self, platform, machine, expected):
+        with Replacer() as r:
+            r.in_environ('CONDA_SUBDIR', not_there)
+            r.replace('sys.platform', platform)
+            r.replace('platform.machine', lambda: machine)
+            compare(current_platform(), expected=expected)
+
+    def test_conda_subdir(self):
+        with Replacer() as r:
+            r.in_environ('CONDA_SUBDIR', 'linux-aarch64')
+            compare(current_platform(), expected='linux-aarch64')
@@ -0,0 +1,157 @@
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from time import sleep
+
+import pytest
+from testfixtures import Replacer, compare
+from testfixtures.mock import Mock
+
+# the plugin imports this lazily, so it is imported here for it to be replaced in
+# the same module pytester's in-process runs use:
+import picky.main  # noqa: F401
+from picky.pytest_plugin import session_directory, shared_result
+
+pytest_plugins = ['pytester']
+
+different_output = """\
+--- environment.lock.yaml
++++ current
+@@ -1 +1 @@
+-- certifi=2018.1.18=py36_0
++- certifi=2018.1.17=py36_0
+"""
+
+
+@pytest.fixture()
+def checked(pytester):
+    pytester.makepyfile(test_sample='def test_it():\n    pass\n')
+    with Replacer() as r:
+        check = Mock(return_value=(0, ''))
+        r.replace('picky.main.check_environment', check)
+        r.in_environ('CONDA_PREFIX', '/envs/sample')
+        yield check
+
+
+def run(pytester, *args):
+    return pytester.runpytest_inprocess('-p', 'picky.pytest_plugin', *args)
+
+
+class TestPlugin(object):
+
+    def test_matches(self, pytester, checked):
+        result = run(pytester, '--picky')
+        result.assert_outcomes(passed=1)
+        result.stdout.fnmatch_lines(['picky: environment matches environment.lock.yaml'])
+        compare(checked.call_count, expected=1)
+        compare(checked.call_args[0][0], expected={
+            'prefix': '/envs/sample',
+            'concrete': str(pytester.path / 'environment.lock.yaml'),
+            'config': str(pytester.path / 'picky.yaml'),
+        })
+
+    def test_does_not_match(self, pytester, checked):
+        checked.return_value = 1, different_output
+        result = run(pytester, '--picky')
+        compare(result.ret, expected=1)
+        result.stdout.fnmatch_lines([
+            '*Environment does not match environment.lock.yaml:',
+            '-- certifi=2018.1.18=py36_0',
+            '+- certifi=2018.1.17=py36_0*',
+        ])
+        result.stdout.no_fnmatch_line('*test_it*')
+
+    def test_error(self, pytester, checked):
+        checked.return_value = 2, 'Error: boom\n'
+        result = run(pytester, '--picky')
+        compare(result.ret, expected=3)
+        result.stdout.fnmatch_lines(['*Could not check environment against *', 'Error: boom*'])
+
+    def test_not_enabled(self, pytester, checked):
+        result = run(pytester)
+        result.assert_outcomes(passed=1)
+        compare(checked.call_count, expected=0)
+
+    def test_ini(self, pytester, checked):
+        pytester.makeini('[pytest]\npicky = true\npicky_concrete = env/lock.yaml\n')
+        result = run(pytester, '--picky-config', 'ci/picky.yaml')
+        result.assert_outcomes(passed=1)
+        entry = checked.call_args[0][0]
+        compare(entry['concrete'], expected=str(pytester.path / 'env' / 'lock.yaml'))
+        compare(entry['config'], expected=str(pytester.path / 'ci' / 'picky.yaml'))
+
+
+entry = {'prefix': '/envs/sample', 'concrete': 'environment.lock.yaml', 'config': 'picky.yaml'}
+
+
+class TestSharedResult(object):
+
+    def test_once(self, tmpdir):
+        with Replacer() as r:
+            check = Mock(return_value=(1, different_output))
+            r.replace('picky.main.check_environment', check)
+            for _ in range(3):
+                compare(shared_result(str(tmpdir), entry), expected=(1, different_output))
+        compare(check.call_count, expected=1)
+
+    def test_different_entries(self, tmpdir):
+        with Replacer() as r:
+            check = Mock(return_value=(0, ''))
+            r.replace('picky.main.check_environment', check)
+            shared_result(str(tmpdir), entry)
+            shared_result(str(tmpdir), dict(entry, concrete='other.lock.yaml'))
+        compare(check.call_count, expected=2)
+
+    def test_concurrent(self, tmpdir):
+        calls = []
+
+        def slow_check(entry):
+            calls.append(entry)
+            sleep(0.1)
+            return 0, ''
+
+        results = []
+        with Replacer() as r:
+            r.replace('picky.main.check_environment', slow_check)
+            threads = [threading.Thread(target=lambda: results.append(
+                shared_result(str(tmpdir), entry)
+            )) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        compare(len(calls), expected=1)
+        compare(results, expected=[(0, '')] * 8)
+
+
+class TestSessionDirectory(object):
+
+    def factory(self, tmpdir):
+        factory = Mock()
+        factory.getbasetemp.return_value = Path(str(tmpdir)) / 'popen-gw3'
+        return factory
+
+    def test_controller(self, tmpdir):
+        config = Mock(spec=[])
+        compare(session_directory(config, self.factory(tmpdir)),
+                expected=str(tmpdir.join('popen-gw3')))
+
+    def test_worker(self, tmpdir):
+        config = Mock(spec=['workerinput'], workerinput={})
+        compare(session_directory(config, self.factory(tmpdir)), expected=str(tmpdir))
+
+
+def test_plugin_imports():
+    # the plugin is loaded by every pytest run in an environment with
+    # picky installed, whether or not it is used:
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', 'import picky.pytest_plugin'],
+        stderr=subprocess.PIPE, universal_newlines=True,
+        cwd=os.path.dirname(os.path.dirname(picky.__file__)),
+    )
+    _, stderr = process.communicate()
+    compare(process.returncode, expected=0)
+    imported = set(line.rsplit('|', 1)[-1].strip() for line in stderr.splitlines())
+    compare(imported & {'picky.main', 'picky.env', 'picky.conda'}, expected=set())
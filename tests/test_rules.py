@@ -0,0 +1,64 @@
+import pytest
+from testfixtures import ShouldRaise, compare
+
+from picky.rules import Rules, compiled
+
+
+class TestRules(object):
+
+    @pytest.mark.parametrize('rule, name, expected', [
+        ('appnope', 'appnope', True),
+        ('appnope', 'appnope2', False),
+        ('r-*', 'r-base', True),
+        ('r-*', 'rr-base', False),
+        ('*-cpu', 'pytorch-cpu', True),
+        ('*-cpu', 'pytorch-cpus', False),
+        ('py*-cpu', 'pytorch-cpu', True),
+        ('py*-cpu', 'tensorflow-cpu', False),
+        ('lib?', 'libz', True),
+        ('lib[xy]', 'libz', False),
+        ('re:jupyterlab(-.+)?', 'jupyterlab', True),
+        ('re:jupyterlab(-.+)?', 'jupyterlab-git', True),
+        ('re:jupyterlab(-.+)?', 'jupyterlab_server', False),
+        # regular expressions must match the whole name:
+        ('re:lib', 'libxml2', False),
+        ('re:li|libxml2', 'libxml2', True),
+        # flags apply to the whole expression:
+        ('re:(?i)pyqt', 'PyQt', True),
+    ])
+    def test_match(self, rule, name, expected):
+        rules = Rules([rule])
+        compare(rules.matching('conda', [name]), expected={name} if expected else set())
+        compare(rules.matching('pip', [name]), expected={name} if expected else set())
+
+    def test_scoped(self):
+        rules = Rules([{'conda': '*-cpu'}, {'pip': ['pytest', 'pytest-*']}])
+        names = ['pytorch-cpu', 'pytest-cov', 'pytest']
+        compare(rules.matching('conda', names), expected={'pytorch-cpu'})
+        compare(rules.matching('pip', names), expected={'pytest-cov', 'pytest'})
+
+    def test_mixed(self):
+        rules = Rules(['a', 'b-*', '*-c', 'd?', 're:e+'])
+        compare(rules.matching('conda', ['a', 'b-1', '1-c', 'd1', 'eee', 'f']),
+                expected={'a', 'b-1', '1-c', 'd1', 'eee'})
+
+    def test_regexes_kept_apart(self):
+        # each has its own flags and group numbers, whatever else is there:
+        rules = Rules(['re:(?i)foo', 're:(a)\\1', 're:(b)\\1', 'x*y', 'z?'])
+        compare(rules.matching('conda', ['FOO', 'aa', 'bb', 'ab', 'xay', 'zz', 'X']),
+                expected={'FOO', 'aa', 'bb', 'xay', 'zz'})
+
+    def test_empty(self):
+        rules = Rules()
+        compare(bool(rules), expected=False)
+        compare(rules.matching('conda', ['anything']), expected=set())
+
+    def test_invalid_regex(self):
+        with ShouldRaise(ValueError):
+            Rules(['re:(unclosed'])
+
+    def test_compiled(self):
+        rules = Rules(['a'])
+        assert compiled(rules) is rules
+        compare(compiled({'a'}).rules, expected=rules.rules)
+        compare(compiled(None).rules, expected=[])
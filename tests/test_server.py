@@ -0,0 +1,217 @@
+import json
+import os
+import socket
+import threading
+from time import sleep
+from timeit import default_timer
+
+import pytest
+from testfixtures import OutputCapture, Replacer, compare, not_there
+from testfixtures.mock import Mock
+
+from picky.client import request, send
+from picky.main import load_environment, main
+from picky.server import Server
+from tests.test_conda import make_prefix, write_record
+from tests.test_env import sample_serialized
+
+
+@pytest.fixture()
+def prefix(tmpdir):
+    with Replacer() as r:
+        r.in_environ('HOME', str(tmpdir))
+        r.in_environ('CONDARC', not_there)
+        r.in_environ('CONDA_ROOT', not_there)
+        r.in_environ('CONDA_PREFIX', not_there)
+        yield make_prefix(tmpdir.mkdir('package'))
+
+
+@pytest.fixture()
+def server(tmpdir, prefix):
+    server = Server(str(tmpdir.join('picky.sock')), interval=0.01)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    assert not os.path.exists(server.path)
+
+
+def check(server, prefix, tmpdir, **options):
+    return send(server.path, dict(
+        command='check',
+        prefix=prefix,
+        concrete=str(tmpdir.join('environment.lock.yaml')),
+        config=str(tmpdir.join('picky.yaml')),
+        backend='native',
+        **options
+    ))
+
+
+def test_check(server, prefix, tmpdir):
+    tmpdir.join('environment.lock.yaml').write(sample_serialized)
+    compare(check(server, prefix, tmpdir), expected={'returncode': 0, 'output': ''})
+
+
+def test_lock(server, prefix, tmpdir):
+    response = send(server.path, dict(
+        command='lock',
+        prefix=prefix,
+        concrete=str(tmpdir.join('environment.lock.yaml')),
+        config=str(tmpdir.join('picky.yaml')),
+        backend='native',
+    ))
+    compare(response, expected={'returncode': None, 'output': ''})
+    compare(tmpdir.join('environment.lock.yaml').read(), expected=sample_serialized)
+
+
+def test_environment_changes(server, prefix, tmpdir):
+    tmpdir.join('environment.lock.yaml').write(sample_serialized)
+    check(server, prefix, tmpdir)
+    state, = server.states.values()
+    records = dict(state.records)
+    write_record(tmpdir.join('package', 'conda-meta'), 'python', '3.6.5', '0',
+                 'https://repo.anaconda.com/pkgs/main/osx-64')
+    response = check(server, prefix, tmpdir)
+    compare(response['returncode'], expected=1)
+    assert '+- python=3.6.5=0' in response['output']
+    state, = server.states.values()
+    # records that didn't change were not read again:
+    for name, record in records.items():
+        assert state.records[name][1] is record[1]
+
+
+def test_unchanged_environment_not_reread(server, prefix, tmpdir):
+    tmpdir.join('environment.lock.yaml').write(sample_serialized)
+    check(server, prefix, tmpdir)
+    state, = server.states.values()
+    check(server, prefix, tmpdir)
+    assert server.states[list(server.states)[0]].env is state.env
+
+
+def test_no_cache_rereads(server, prefix, tmpdir):
+    tmpdir.join('environment.lock.yaml').write(sample_serialized)
+    check(server, prefix, tmpdir)
+    state, = server.states.values()
+    compare(check(server, prefix, tmpdir, cache=False),
+            expected={'returncode': 0, 'output': ''})
+    new_state, = server.states.values()
+    assert new_state.env is not state.env
+
+
+def test_json_timings(server, prefix, tmpdir):
+    tmpdir.join('environment.lock.yaml').write(sample_serialized)
+    response = check(server, prefix, tmpdir, format='json')
+    compare(list(json.loads(response['output'])['timings']),
+            expected=['config', 'export', 'modify', 'concrete', 'diff'])
+
+
+def test_error(server, prefix, tmpdir):
+    response = check(server, prefix, tmpdir)
+    compare(response['returncode'], expected=2)
+    assert response['output'].startswith('Error: ')
+
+
+def test_main_uses_server(server, prefix, tmpdir):
+    tmpdir.join('environment.lock.yaml').write(sample_serialized.replace('0.7.10', '0.7.9'))
+    tmpdir.join('picky.yaml').write('backend: native\n')
+    tmpdir.chdir()
+    with Replacer() as r:
+        r.replace('sys.argv', ['x', '--socket', server.path, 'check', '--format', 'json'])
+        r.in_environ('CONDA_PREFIX', prefix)
+        r.replace('picky.main.load_environment', None)
+        with OutputCapture() as output:
+            rc = main()
+    compare(rc, expected=1)
+    assert '"name": "alabaster"' in output.captured
+
+
+def test_main_forwards_no_cache(server, prefix, tmpdir):
+    tmpdir.join('environment.lock.yaml').write(sample_serialized)
+    tmpdir.join('picky.yaml').write('backend: native\n')
+    tmpdir.chdir()
+    check(server, prefix, tmpdir)
+    state, = server.states.values()
+    with Replacer() as r:
+        r.replace('sys.argv', ['x', '--socket', server.path, '--no-cache', 'check'])
+        r.in_environ('CONDA_PREFIX', prefix)
+        r.replace('picky.main.load_environment', None)
+        with OutputCapture() as output:
+            rc = main()
+    compare(rc, expected=0)
+    output.compare('')
+    new_state, = server.states.values()
+    assert new_state.env is not state.env
+
+
+def test_main_forwards_timeout_and_retries(server, prefix, tmpdir):
+    tmpdir.join('environment.lock.yaml').write(sample_serialized)
+    tmpdir.join('picky.yaml').write('backend: native\n')
+    tmpdir.chdir()
+    with Replacer() as r:
+        load = Mock(side_effect=load_environment)
+        r.replace('picky.server.load_environment', load)
+        r.replace('sys.argv', ['x', '--socket', server.path, '--timeout', '30',
+                               '--retries', '2', 'check'])
+        r.in_environ('CONDA_PREFIX', prefix)
+        r.replace('picky.main.load_environment', None)
+        with OutputCapture() as output:
+            rc = main()
+    compare(rc, expected=0)
+    output.compare('')
+    compare(load.call_args[0][5:7], expected=(30.0, 2))
+
+
+def test_no_server(tmpdir, prefix):
+    with Replacer() as r:
+        r.in_environ('CONDA_PREFIX', prefix)
+        compare(request(str(tmpdir.join('missing.sock')), 'check', 'x', 'y'),
+                expected=None)
+        compare(request(None, 'check', 'x', 'y'), expected=None)
+
+
+def test_not_activated(server, tmpdir):
+    compare(request(server.path, 'check', 'x', 'y'), expected=None)
+
+
+def test_unresponsive_server(tmpdir, prefix):
+    # a server that accepts connections but never answers them:
+    path = str(tmpdir.join('hung.sock'))
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+    try:
+        with Replacer() as r:
+            r.in_environ('CONDA_PREFIX', prefix)
+            r.replace('picky.client.RESPONSE_TIMEOUT', 0.2)
+            start = default_timer()
+            compare(request(path, 'check', 'x', 'y'), expected=None)
+            compare(request(path, 'check', 'x', 'y', timeout=0.2), expected=None)
+        assert default_timer() - start < 5
+    finally:
+        listener.close()
+
+
+def test_locks_of_one_file_serialized(server, prefix, tmpdir):
+    running = []
+    overlapped = []
+
+    def slow_lock(current_env, concrete, *args):
+        running.append(concrete)
+        if len(running) > 1:
+            overlapped.append(list(running))
+        sleep(0.05)
+        running.remove(concrete)
+
+    requests = [dict(command='lock', prefix=prefix, backend='native',
+                     concrete=str(tmpdir.join('environment.lock.yaml')),
+                     config=str(tmpdir.join('picky.yaml')))] * 4
+    with Replacer() as r:
+        r.replace('picky.server.lock', slow_lock)
+        threads = [threading.Thread(target=server.respond, args=(request_,))
+                   for request_ in requests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    compare(overlapped, expected=[])
@@ -0,0 +1,97 @@
+import pytest
+from testfixtures import compare
+
+from picky import sidecar
+from picky.env import Environment, PackageSpec
+from tests.test_env import sample_env, sample_serialized
+
+
+@pytest.fixture()
+def concrete(tmpdir):
+    path = tmpdir.join('environment.lock.yaml')
+    path.write(sample_serialized)
+    sidecar.write(str(path), sample_env, sample_serialized)
+    return str(path)
+
+
+def loaded(concrete, text=sample_serialized):
+    table = sidecar.load(concrete, text)
+    assert table is not None
+    return table
+
+
+class TestSidecar(object):
+
+    def test_environment(self, concrete):
+        table = loaded(concrete)
+        expected = sample_env.copy()
+        expected['name'] = None
+        expected['channels'] = sorted(expected['channels'])
+        compare(table.environment(), strict=True, expected=expected)
+        table.close()
+
+    def test_matches(self, concrete):
+        env = sample_env.copy()
+        env['name'] = 'other'
+        env['channels'] = list(reversed(env['channels']))
+        assert loaded(concrete).matches(env)
+
+    @pytest.mark.parametrize('section, key, spec', [
+        ('conda', 'certifi', PackageSpec('=', 'certifi', '2018.1.17', 'py36_0')),
+        ('conda', 'certifi', PackageSpec('=', 'certifi', '2018.1.18', 'py36_1')),
+        ('conda', 'certifi', None),
+        ('conda', 'python', PackageSpec('=', 'python', '3.6.5', '0')),
+        ('pip', 'attrs', PackageSpec('==', 'attrs', '17.3.0')),
+        ('develop', '.', None),
+        ('develop', '../other', PackageSpec(' ', '-e', '../other')),
+    ])
+    def test_does_not_match(self, concrete, section, key, spec):
+        env = sample_env.copy()
+        if spec is None:
+            del env[section][key]
+        else:
+            env[section][key] = spec
+        assert not loaded(concrete).matches(env)
+
+    def test_channel_changed(self, concrete):
+        env = sample_env.copy()
+        env['channels'] = ['conda-forge', 'bioconda']
+        assert not loaded(concrete).matches(env)
+
+    def test_stale(self, concrete):
+        compare(sidecar.load(concrete, sample_serialized + '\n'), expected=None)
+
+    def test_missing(self, tmpdir):
+        compare(sidecar.load(str(tmpdir.join('nothing.yaml')), ''), expected=None)
+
+    @pytest.mark.parametrize('content', [b'', b'PICKY', b'x' * 100])
+    def test_corrupt(self, tmpdir, content):
+        path = tmpdir.join('environment.lock.yaml')
+        tmpdir.join('environment.lock.yaml.picky').write(content, 'wb')
+        compare(sidecar.load(str(path), sample_serialized), expected=None)
+
+    def test_truncated(self, concrete):
+        with open(concrete + '.picky', 'r+b') as target:
+            target.truncate(sidecar.HEADER.size + sidecar.ENTRY.size)
+        compare(sidecar.load(concrete, sample_serialized), expected=None)
+
+    def test_no_build(self, tmpdir):
+        env = Environment.from_string(
+            sample_serialized.replace('=0\n', '\n').replace('=py36_0', '')
+        )
+        path = str(tmpdir.join('environment.lock.yaml'))
+        sidecar.write(path, env, 'text')
+        table = loaded(path, 'text')
+        assert table.matches(env)
+        compare(table.environment()['conda']['certifi'],
+                expected=PackageSpec('=', 'certifi', '2018.1.18'))
+
+    def test_non_ascii(self, tmpdir):
+        env = sample_env.copy()
+        env['develop']['/src/café'] = PackageSpec(' ', '-e', '/src/café')
+        env['pip']['zope'] = PackageSpec('==', 'zope', '1.0')
+        path = str(tmpdir.join('environment.lock.yaml'))
+        sidecar.write(path, env, 'text')
+        table = loaded(path, 'text')
+        assert table.matches(env)
+        compare(table.environment()['pip']['zope'], expected=PackageSpec('==', 'zope', '1.0'))
@@ -0,0 +1,112 @@
+import os
+import threading
+
+import pytest
+from testfixtures import compare
+
+from picky.main import watch_targets
+from picky.watch import InotifyWatcher, PollingWatcher, bursts, inotify, watcher
+from tests.test_conda import make_prefix
+
+
+def polling(targets):
+    return PollingWatcher(targets, interval=0.01)
+
+
+def inotifying(targets):
+    libc = inotify()
+    if libc is None:
+        pytest.skip('inotify not available')
+    return InotifyWatcher(targets, libc)
+
+
+def touch(path, content='x'):
+    with open(str(path), 'w') as target:
+        target.write(content)
+
+
+@pytest.fixture(params=[polling, inotifying])
+def make_watcher(request):
+    watchers = []
+
+    def make(targets):
+        made = request.param(targets)
+        watchers.append(made)
+        return made
+
+    yield make
+    for made in watchers:
+        made.close()
+
+
+class TestWatcher(object):
+
+    def test_no_change(self, tmpdir, make_watcher):
+        compare(make_watcher([(str(tmpdir), None)]).wait(0.05), expected=False)
+
+    def test_anything_in_directory(self, tmpdir, make_watcher):
+        watching = make_watcher([(str(tmpdir), None)])
+        touch(tmpdir.join('new.json'))
+        compare(watching.wait(1), expected=True)
+
+    def test_named_file(self, tmpdir, make_watcher):
+        touch(tmpdir.join('environment.lock.yaml'))
+        watching = make_watcher([(str(tmpdir), {'environment.lock.yaml'})])
+        touch(tmpdir.join('environment.lock.yaml'), 'changed')
+        compare(watching.wait(1), expected=True)
+
+    def test_named_file_created(self, tmpdir, make_watcher):
+        watching = make_watcher([(str(tmpdir), {'environment.lock.yaml'})])
+        touch(tmpdir.join('environment.lock.yaml'))
+        compare(watching.wait(1), expected=True)
+
+    def test_other_file_ignored(self, tmpdir, make_watcher):
+        watching = make_watcher([(str(tmpdir), {'environment.lock.yaml'})])
+        touch(tmpdir.join('other.txt'))
+        compare(watching.wait(0.05), expected=False)
+
+    def test_missing_directory_ignored(self, tmpdir, make_watcher):
+        watching = make_watcher([(str(tmpdir.join('missing')), None)])
+        compare(watching.wait(0.05), expected=False)
+
+
+class TestBursts(object):
+
+    def test_debounced(self, tmpdir):
+        watching = polling([(str(tmpdir), None)])
+        changes = bursts(watching, debounce=0.1)
+        done = threading.Event()
+
+        def burst():
+            for i in range(3):
+                touch(tmpdir.join('{}.json'.format(i)))
+                done.wait(0.03)
+
+        thread = threading.Thread(target=burst)
+        thread.start()
+        next(changes)
+        thread.join()
+        # everything in the burst was consumed by the one yield:
+        compare(watching.wait(0.15), expected=False)
+
+
+def test_watcher_prefers_inotify(tmpdir):
+    watching = watcher([(str(tmpdir), None)])
+    try:
+        expected = PollingWatcher if inotify() is None else InotifyWatcher
+        compare(type(watching), expected=expected)
+    finally:
+        watching.close()
+
+
+def test_watch_targets(tmpdir):
+    prefix = make_prefix(tmpdir.mkdir('env'))
+    project = tmpdir.join('project')
+    project.ensure(dir=True)
+    compare(watch_targets(prefix, [
+        str(project.join('environment.lock.yaml')), str(project.join('picky.yaml'))
+    ]), expected=[
+        (os.path.join(prefix, 'conda-meta'), None),
+        (os.path.join(prefix, 'lib', 'python3.6', 'site-packages'), None),
+        (str(project), {'environment.lock.yaml', 'picky.yaml'}),
+    ])